@@ -1,14 +1,226 @@
 #!/usr/bin/env python
 
-import csv
+import csv, codecs, mmap, gzip, bz2, lzma, zipfile
 
-def detect(filename, custom_list=None):
-	if custom_list is None:
-		custom_list = ',\t'
+try:
+	import pyarrow, pyarrow.csv
+except ImportError:
+	pyarrow = None
+
+# other modules use import *, which shouldn't drag the tests at the bottom along
+__all__ = ['FileDialect', 'compression_of', 'read_sample', 'detect_encoding', 'detect_dialect', 'detect']
+
+class FileDialect(object):
+	"""
+	What detect_dialect figured out about a delimited file.
+	Pass read_csv_kwargs() to pandas.read_csv, or pyarrow_csv_options() to pyarrow.csv.read_csv if you have pyarrow.
+	"""
+
+	def __init__(self, delimiter='\t', quotechar='"', escapechar=None, encoding='utf-8', has_header=True, columns=None, compression=None):
+		self.delimiter = delimiter
+		self.quotechar = quotechar
+		self.escapechar = escapechar
+		self.encoding = encoding
+		self.has_header = has_header
+		# the column headers, if we could read them out of the sample. made up (column_1, column_2, etc) if the file doesn't have a header row
+		self.columns = columns
+		# gzip, bz2, xz, zip or None. see compression_of
+		self.compression = compression
+
+	def read_csv_kwargs(self):
+		kwargs = {'sep': self.delimiter, 'quotechar': self.quotechar, 'encoding': self.encoding}
+		if self.escapechar is not None:
+			kwargs['escapechar'] = self.escapechar
+		if not self.has_header:
+			# otherwise the 1st row of data becomes the header
+			kwargs['header'] = None
+			kwargs['names'] = self.columns
+		return kwargs
+
+	def pyarrow_csv_options(self):
+		"""
+		returns read_options, parse_options, convert_options for pyarrow.csv.read_csv, or None if we don't have pyarrow or don't know the column headers.
+		Every column is read as a string, same as pandas.read_csv(dtype=object). Otherwise pyarrow would turn zip codes like 01234 into numbers.
+		"""
+		if pyarrow is None or not self.columns or self.compression == 'zip':
+			# pyarrow can decompress gzip, bz2 and xz on its own, but not zip
+			return None
+		read_options = pyarrow.csv.ReadOptions(encoding=self.encoding, column_names=None if self.has_header else self.columns)
+		parse_options = pyarrow.csv.ParseOptions(delimiter=self.delimiter, quote_char=self.quotechar, escape_char=self.escapechar or False)
+		convert_options = pyarrow.csv.ConvertOptions(column_types={column: pyarrow.string() for column in self.columns}, strings_can_be_null=True)
+		return read_options, parse_options, convert_options
+
+compressed_extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zip': 'zip'}
+
+def compression_of(filename):
+	"""
+	How the file is compressed, going by its extension. None if it isn't.
+	"""
+	for extension, compression in compressed_extensions.items():
+		if str(filename).lower().endswith(extension):
+			return compression
+	return None
+
+def read_sample(filename, sample_size):
+	"""
+	The first sample_size bytes of the file. Memory maps the file so we only touch the part we need.
+	Compressed files are decompressed as they're read, and only until we have enough. For zip files, it's the first file in the archive.
+	"""
+	compression = compression_of(filename)
+	if compression == 'zip':
+		with zipfile.ZipFile(filename) as archive:
+			members = archive.namelist()
+			if len(members) == 0:
+				return b''
+			with archive.open(members[0]) as to_sniff:
+				return to_sniff.read(sample_size)
+	elif compression is not None:
+		opener = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}[compression]
+		with opener(filename, 'rb') as to_sniff:
+			return to_sniff.read(sample_size)
 	with open(filename, 'rb') as to_sniff:
 		try:
-			dialect = csv.Sniffer().sniff(to_sniff.readline().decode('utf-8', 'replace'), delimiters=custom_list)
-		except csv.Error:
+			with mmap.mmap(to_sniff.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+				return mapped[:sample_size]
+		except ValueError:
+			# can't mmap an empty file
+			return b''
+
+def detect_encoding(sample, whole_file=False):
+	"""
+	Guesses the encoding of a sample of bytes. utf-8-sig if there's a byte order mark, utf-8 if it decodes as utf-8, latin-1 (which can decode anything) otherwise.
+	If the sample isn't the whole file, it's ok for it to stop in the middle of a character.
+	"""
+	if sample.startswith(codecs.BOM_UTF8):
+		return 'utf-8-sig'
+	try:
+		codecs.getincrementaldecoder('utf-8')().decode(sample, final=whole_file)
+	except UnicodeDecodeError:
+		return 'latin-1'
+	return 'utf-8'
+
+def mostly_digits(cell):
+	"""
+	Whether more than half of a csv cell is digits, like a phone number or zip code. Column headers don't look like that.
+	"""
+	cell = cell.strip()
+	return len(cell) > 0 and sum(c.isdigit() for c in cell) * 2 > len(cell)
+
+def detect_dialect(filename, custom_list=None, sample_size=64*1024):
+	"""
+	Reads a sample from the start of a file and figures out its encoding, delimiter, quoting, and whether it has a header row.
+	input:
+	filename - file to look at
+	custom_list (optional) - string of the delimiters to consider. defaults to commas and tabs
+	sample_size (optional) - how many bytes to look at
+	output:
+	FileDialect. If the delimiter can't be figured out, it's whichever of custom_list shows up most in the first line, or tabs if none do.
+	"""
+	if custom_list is None:
+		custom_list = ',\t'
+	sample = read_sample(filename, sample_size)
+	whole_file = len(sample) < sample_size
+	encoding = detect_encoding(sample, whole_file=whole_file)
+	text = sample.decode(encoding, 'ignore')
+	if not whole_file and '\n' in text:
+		# the last line is probably cut off
+		text = text[:text.rfind('\n')+1]
+	dialect = FileDialect(encoding=encoding, compression=compression_of(filename))
+	sniffer = csv.Sniffer()
+	try:
+		sniffed = sniffer.sniff(text, delimiters=custom_list)
+		dialect.delimiter = sniffed.delimiter
+		dialect.quotechar = sniffed.quotechar or '"'
+		dialect.escapechar = sniffed.escapechar
+	except csv.Error:
+		first_line = text.split('\n', 1)[0]
+		counts = [(first_line.count(d), d) for d in custom_list]
+		best_count, best = max(counts) if counts else (0, None)
+		if best_count == 0:
 			print("Warning: Can't detect seperator. Defaulting to tabs.")
-			return '\t'
-	return dialect.delimiter
+			best = '\t'
+		dialect.delimiter = best
+	try:
+		first_row = next(csv.reader(text.splitlines(), delimiter=dialect.delimiter, quotechar=dialect.quotechar, escapechar=dialect.escapechar))
+	except (StopIteration, csv.Error):
+		return dialect
+	try:
+		# the sniffer says there's no header whenever it has nothing to go on (ie every column is text), so it also has to look like data
+		dialect.has_header = sniffer.has_header(text) or not any(mostly_digits(cell) for cell in first_row)
+	except csv.Error:
+		pass
+	if dialect.has_header:
+		dialect.columns = first_row
+	else:
+		dialect.columns = ['column_' + str(i + 1) for i in range(len(first_row))]
+	return dialect
+
+def detect(filename, custom_list=None):
+	"""
+	Just the delimiter from detect_dialect
+	"""
+	return detect_dialect(filename, custom_list=custom_list).delimiter
+
+import unittest, os, tempfile
+class TestAutoDetectSeperator(unittest.TestCase):
+
+	def detect_from_bytes(self, contents, **kwargs):
+		with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as ofile:
+			ofile.write(contents)
+		try:
+			return detect_dialect(ofile.name, **kwargs)
+		finally:
+			os.remove(ofile.name)
+
+	def test_detect_dialect_commas(self):
+		dialect = self.detect_from_bytes(b'first,last,phone\nJane,"Doe, Jr",555-555-1234\nJohn,Doe,555-555-1235\n')
+		assert dialect.delimiter == ','
+		assert dialect.quotechar == '"'
+		assert dialect.encoding == 'utf-8'
+		assert dialect.columns == ['first', 'last', 'phone']
+
+	def test_detect_dialect_tabs_latin_1(self):
+		dialect = self.detect_from_bytes(b'first\tlast\tphone\nRen\xe9e\tDoe\t555-555-1234\n')
+		assert dialect.delimiter == '\t'
+		assert dialect.encoding == 'latin-1'
+
+	def test_detect_dialect_byte_order_mark(self):
+		dialect = self.detect_from_bytes(b'\xef\xbb\xbffirst,last,phone\nRen\xc3\xa9e,Doe,555-555-1234\n')
+		assert dialect.encoding == 'utf-8-sig'
+		assert dialect.columns == ['first', 'last', 'phone']
+
+	def test_detect_dialect_cut_off_character(self):
+		# the sample ends in the middle of the 2 byte e, which shouldn't make it look like latin-1
+		contents = b'first,last,phone\n' + b'Ren\xc3\xa9e,Doe,555-555-1234\n' * 10
+		sample_size = contents.rfind(b'\xa9')
+		assert self.detect_from_bytes(contents, sample_size=sample_size).encoding == 'utf-8'
+
+	def test_detect_dialect_compressed(self):
+		contents = b'first,last,phone\nJane,Doe,555-555-1234\n'
+		for suffix, compress in [('.csv.gz', gzip.compress), ('.csv.bz2', bz2.compress)]:
+			with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as ofile:
+				ofile.write(compress(contents))
+			try:
+				dialect = detect_dialect(ofile.name)
+			finally:
+				os.remove(ofile.name)
+			assert dialect.columns == ['first', 'last', 'phone']
+			assert dialect.compression == compression_of(suffix)
+
+	def test_detect_dialect_no_header(self):
+		dialect = self.detect_from_bytes(b'Jane,Doe,555-555-1234\nJohn,Roe,555-555-1235\nJim,Smithers,555-555-1236\n')
+		assert not dialect.has_header
+		assert dialect.columns == ['column_1', 'column_2', 'column_3']
+		assert dialect.read_csv_kwargs()['header'] is None
+		# all text, so the sniffer can't tell, but those are headers
+		dialect = self.detect_from_bytes(b'name,city\nJane Doe,Springfield\nBob,NYC\n')
+		assert dialect.has_header and dialect.columns == ['name', 'city']
+		assert 'header' not in dialect.read_csv_kwargs()
+
+	def test_detect_dialect_fallback(self):
+		assert self.detect_from_bytes(b'first,last,phone').delimiter == ','
+		assert self.detect_from_bytes(b'nothing to see here').delimiter == '\t'
+		assert self.detect_from_bytes(b'').delimiter == '\t'
+
+if __name__ == '__main__':
+	unittest.main()
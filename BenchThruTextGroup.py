@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the parts of ThruTextGroup that don't need to talk to ThruText.
+Run it directly: python BenchThruTextGroup.py
+"""
+
+import time
+import numpy
+import pandas
+
+from LoginManager import LoginManager
+from ThruTextGroup import ThruTextGroup
+
+def example_dataframe(num_rows):
+	"""
+	Makes a dataframe that looks like a typical voter file. Some blanks, all strings, like read_csv(dtype=object) would give you.
+	"""
+	index = numpy.arange(num_rows)
+	df = pandas.DataFrame({
+		'first': 'Jane',
+		'last': 'Doe',
+		'phone': pandas.Series(index % 10000000).map('555{:07d}'.format),
+		'zip': numpy.where(index % 7 == 0, None, '99000'),
+		'precinct': numpy.where(index % 3 == 0, None, 'PCT 0042'),
+		'van_id': pandas.Series(index).astype(str),
+	})
+	return df.astype(object)
+
+def iterrows_csv_data(df, line_by_line_func=None):
+	"""
+	The way from_dataframe used to build csv_data. Here to compare against.
+	"""
+	csv_data = []
+	csv_data.append(df.columns.values.tolist())
+	for index, row in df.iterrows():
+		raw_row = [v if not pandas.isnull(v) else '' for v in row.values]
+		if line_by_line_func is not None:
+			raw_row = line_by_line_func(raw_row)
+			if raw_row is None:
+				continue
+		csv_data.append(raw_row)
+	return csv_data
+
+def time_it(func, *args, **kwargs):
+	start = time.perf_counter()
+	result = func(*args, **kwargs)
+	return time.perf_counter() - start, result
+
+def bench_dataframe_to_csv_data(sizes=None, max_iterrows_rows=100000):
+	"""
+	Compares the vectorized dataframe_to_csv_data with the old iterrows loop.
+	iterrows gets slow enough that past max_iterrows_rows we time a slice of the frame and scale it up.
+	"""
+	if sizes is None:
+		sizes = [10000, 100000, 1000000]
+	ttg = ThruTextGroup(login_manager=LoginManager(thru_text_account_name='benchmark', fake=True))
+	print("rows        iterrows (s)   vectorized (s)   speedup")
+	for size in sizes:
+		df = example_dataframe(size)
+		vector_time, vector_result = time_it(ttg.dataframe_to_csv_data, df)
+		if size <= max_iterrows_rows:
+			loop_time, loop_result = time_it(iterrows_csv_data, df)
+			assert loop_result == vector_result
+			estimated = ''
+		else:
+			loop_time, _ = time_it(iterrows_csv_data, df.iloc[:max_iterrows_rows])
+			loop_time = loop_time * size / max_iterrows_rows
+			estimated = ' (estimated)'
+		print('{:<11} {:<14.3f} {:<16.3f} {:.1f}x{}'.format(size, loop_time, vector_time, loop_time / vector_time, estimated))
+
+def clean_row(row):
+	"""
+	line_by_line_func version of a typical cleanup: drop rows w/o a zip, keep only the digits of the phone number, and capitalize names.
+	"""
+	if row[3] == '':
+		return None
+	return [row[0].title(), row[1].title(), ''.join(c for c in row[2] if c.isdigit())] + row[3:]
+
+def clean_frame(df):
+	"""
+	frame_transform version of clean_row
+	"""
+	df = df[df['zip'].notna()].copy()
+	df['first'] = df['first'].str.title()
+	df['last'] = df['last'].str.title()
+	df['phone'] = df['phone'].str.replace(r'\D', '', regex=True)
+	return df
+
+def bench_frame_transform(size=100000, max_iterrows_rows=20000):
+	"""
+	Compares cleaning up a list w/ line_by_line_func (the old iterrows way, and on top of dataframe_to_csv_data) to doing the same thing w/ frame_transform.
+	The iterrows time is measured on max_iterrows_rows rows and scaled up.
+	"""
+	ttg = ThruTextGroup(login_manager=LoginManager(thru_text_account_name='benchmark', fake=True))
+	df = example_dataframe(size)
+	loop_time, _ = time_it(iterrows_csv_data, df.iloc[:max_iterrows_rows], line_by_line_func=clean_row)
+	loop_time = loop_time * size / max_iterrows_rows
+	line_time, line_result = time_it(ttg.dataframe_to_csv_data, df, line_by_line_func=clean_row)
+	print(str(size) + " rows")
+	print('{:<42} {:.3f}s'.format('iterrows + line_by_line_func (estimated)', loop_time))
+	print('{:<42} {:.3f}s'.format('dataframe_to_csv_data + line_by_line_func', line_time))
+	for dtype in [object, 'string[pyarrow]']:
+		typed = df.astype(dtype)
+		frame_time, frame_result = time_it(lambda: ttg.dataframe_to_csv_data(ttg.apply_frame_transform(typed, clean_frame)))
+		assert line_result == frame_result
+		print('{:<42} {:.3f}s'.format('frame_transform (' + str(dtype) + ' columns)', frame_time))
+
+if __name__ == '__main__':
+	bench_dataframe_to_csv_data()
+	bench_frame_transform()
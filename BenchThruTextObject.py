@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the request layer in ThruTextObject. Everything talks to a server on localhost, never to ThruText.
+Run it directly: python BenchThruTextObject.py
+"""
+
+import json, threading, time, asyncio, concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from LoginManager import LoginManager
+from JsonCodec import JsonCodec, orjson
+from ThruTextObject import ConcreteThruTextObject
+from ThruTextCampaign import ThruTextCampaign
+from FakeThruText import FakeThruTextServer
+
+def throttled_server(bytes_per_second):
+	"""
+	Starts a server on localhost that reads request bodies no faster than bytes_per_second, to act like a slow uplink.
+	returns the server. call shutdown() on it when you're done.
+	"""
+	class ThrottledHandler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def read_throttled(self, num_bytes):
+			received = 0
+			while received < num_bytes:
+				piece = self.rfile.read(min(16384, num_bytes - received))
+				if not piece:
+					break
+				received += len(piece)
+				time.sleep(len(piece) / bytes_per_second)
+			return received
+
+		def do_POST(self):
+			received = 0
+			if self.headers.get('Transfer-Encoding') == 'chunked':
+				while True:
+					size = int(self.rfile.readline().strip(), 16)
+					if size == 0:
+						self.rfile.readline()
+						break
+					received += self.read_throttled(size)
+					self.rfile.readline()
+			else:
+				received = self.read_throttled(int(self.headers.get('Content-Length', 0)))
+			out = json.dumps({'data': {'received': received}}).encode('utf-8')
+			self.send_response(201)
+			self.send_header('Content-Length', str(len(out)))
+			self.end_headers()
+			self.wfile.write(out)
+
+		def log_message(self, *args):
+			pass
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottledHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+def group_import_payload(num_rows, num_custom_fields=12):
+	"""
+	A group import payload shaped like a real one: critical fields plus a dozen custom fields.
+	"""
+	header = ['first', 'last', 'phone'] + ['custom_' + str(c) for c in range(num_custom_fields)]
+	rows = [['Jane', 'Doe', '555{:07d}'.format(r)] + ['value {}'.format(r % (c + 5)) for c in range(num_custom_fields)] for r in range(num_rows)]
+	return {
+		'data': {
+			'attributes': {
+				'name': 'benchmark_group',
+				'country_id': 'US',
+				'time_zone': '',
+				'group_custom_fields': [{'custom_field_id': 1000 + c, 'column': 3 + c} for c in range(num_custom_fields)],
+				'import': {'csv_data': [header] + rows, 'mapping': {'first_name': 0, 'last_name': 1, 'phone': 2}},
+			}
+		}
+	}
+
+def bench_compression(num_rows=50000, megabits_per_second=20, encodings=None):
+	"""
+	Times uploading a group import payload over a throttled local link w/ and w/o compression.
+	"""
+	if encodings is None:
+		encodings = [False, 'gzip', 'deflate']
+	server = throttled_server(megabits_per_second * 1000000 / 8)
+	url = 'http://127.0.0.1:' + str(server.server_port) + '/groups'
+	try:
+		lm = LoginManager(thru_text_account_name='benchmark', fake=True)
+		lm.enable_compression(threshold=1024)
+		tto = ConcreteThruTextObject(login_manager=lm)
+		payload = group_import_payload(num_rows)
+		print(str(num_rows) + " rows, " + str(len(json.dumps(payload))) + " bytes of json, " + str(megabits_per_second) + " Mbit/s link")
+		print("encoding    bytes sent    upload (s)")
+		for encoding in encodings:
+			start = time.perf_counter()
+			response, worked = tto.safe_request('post', url=url, data=payload, compress=encoding)
+			elapsed = time.perf_counter() - start
+			assert worked
+			print('{:<11} {:<13} {:.2f}'.format(str(encoding or 'none'), json.loads(response.content)['data']['received'], elapsed))
+		tto.session.close()
+	finally:
+		server.shutdown()
+
+def json_server(body):
+	"""
+	Starts a server on localhost that answers every GET w/ body. call shutdown() on it when you're done.
+	"""
+	class JsonHandler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def do_GET(self):
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, *args):
+			pass
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), JsonHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+def campaign_dict(index):
+	attributes = {
+		'name': 'campaign ' + str(index), 'status': 'active', 'open_time': '09:00', 'close_time': '21:00',
+		'start_date': '2020-10-01', 'end_date': '2020-11-03', 'description': '', 'opt_outs_count': 3,
+		'initial_sent_count': 1000, 'replies_count': 120, 'conversations_count': 1000, 'unassigned_count': 0,
+		'senders_count': 4, 'script': 'Hi {first_name}, this is a reminder to vote!', 'country_id': 'US',
+		'time_zone': 'America/New_York', 'apportionment_failed_reason': None,
+	}
+	relationships = {name: {'data': []} for name in ['followups', 'segments', 'campaign_tags', 'surveys', 'saved_replies', 'custom_fields', 'regions']}
+	return {'id': str(index), 'type': 'campaign', 'attributes': attributes, 'relationships': relationships, 'links': {'self': '/campaigns/' + str(index)}}
+
+def constructor_list_all(campaign, private_sessions=False):
+	"""
+	The way list_all used to build its results, one constructor call per item. w/ private_sessions, each one also gets its own session the way configure_login used to make one.
+	"""
+	object_list_request, worked = campaign.safe_request('get', url=campaign.base_url, headers={})
+	result = []
+	for ol in json.loads(object_list_request.content)['data']:
+		one = campaign.__class__(in_dict=ol, login_manager=campaign.login_manager)
+		if private_sessions:
+			one.session = campaign.login_manager.create_session()
+		result.append(one)
+	return result
+
+def bench_list_all(num_items=2000, repeats=5):
+	"""
+	Times list_all on num_items campaigns served from localhost against building each one w/ the constructor.
+	"""
+	server = json_server(json.dumps({'data': [campaign_dict(i) for i in range(num_items)]}).encode('utf-8'))
+	class LocalCampaign(ThruTextCampaign):
+		base_url = 'http://127.0.0.1:' + str(server.server_port) + '/campaigns'
+	try:
+		campaign = LocalCampaign(login_manager=LoginManager(thru_text_account_name='benchmark', fake=True))
+		print(str(num_items) + " campaigns, best of " + str(repeats))
+		print("{:<40} {:<10} {}".format('', 'seconds', 'objects/s'))
+		for label, func in [
+			('constructor + a session each', lambda: constructor_list_all(campaign, private_sessions=True)),
+			('constructor + shared session', lambda: constructor_list_all(campaign)),
+			('list_all (from_dicts)', campaign.list_all),
+		]:
+			best = None
+			for r in range(repeats):
+				start = time.perf_counter()
+				result = func()
+				elapsed = time.perf_counter() - start
+				assert len(result) == num_items
+				best = elapsed if best is None else min(best, elapsed)
+			print("{:<40} {:<10.4f} {:.0f}".format(label, best, num_items / best))
+	finally:
+		server.shutdown()
+
+def bench_fetch_many(num_ids=500, latency=0.05, max_workers=16):
+	"""
+	Times refreshing num_ids campaigns from a FakeThruTextServer w/ latency seconds per request: become in a loop, fetch_many w/ a GET each, and fetch_many w/ filter[id].
+	"""
+	server = FakeThruTextServer().start()
+	try:
+		ids = [server.add('campaigns', campaign_dict(i)['attributes'])['id'] for i in range(num_ids)]
+		lm = server.login_manager()
+		server.latency = latency
+		print(str(num_ids) + " campaigns, " + str(latency) + "s per request, " + str(max_workers) + " workers")
+		print("{:<40} {}".format('', 'seconds'))
+		def become_loop():
+			campaign = ThruTextCampaign(login_manager=lm)
+			return [campaign.become(i) for i in ids]
+		for label, func in [
+			('become in a loop', become_loop),
+			('fetch_many, a GET each', lambda: ThruTextCampaign.fetch_many(ids, login_manager=lm, max_workers=max_workers, use_filter=False)),
+			('fetch_many, filter[id]', lambda: ThruTextCampaign.fetch_many(ids, login_manager=lm, max_workers=max_workers, use_filter=True)),
+		]:
+			start = time.perf_counter()
+			result = func()
+			elapsed = time.perf_counter() - start
+			assert len(result) == num_ids
+			print("{:<40} {:.2f}".format(label, elapsed))
+	finally:
+		server.stop()
+
+def bench_json_codec(num_rows=50000, num_campaigns=2000, repeats=5):
+	"""
+	Times encoding a group import payload and decoding a campaign listing w/ each json backend that's installed.
+	"""
+	group_payload = group_import_payload(num_rows)
+	campaign_listing = json.dumps({'data': [campaign_dict(i) for i in range(num_campaigns)]}).encode('utf-8')
+	backends = ['json'] + ([] if orjson is None else ['orjson'])
+	print("group import of " + str(num_rows) + " rows, listing of " + str(num_campaigns) + " campaigns (" + str(len(campaign_listing)) + " bytes), best of " + str(repeats))
+	print("{:<10} {:<20} {}".format('backend', 'encode group (s)', 'decode campaigns (s)'))
+	for backend in backends:
+		codec = JsonCodec(backend=backend)
+		timings = []
+		for func in [lambda: codec.dumps(group_payload), lambda: codec.loads(campaign_listing)]:
+			best = None
+			for r in range(repeats):
+				start = time.perf_counter()
+				func()
+				elapsed = time.perf_counter() - start
+				best = elapsed if best is None else min(best, elapsed)
+			timings.append(best)
+		print("{:<10} {:<20.4f} {:.4f}".format(backend, timings[0], timings[1]))
+
+def http2_server(latency, body):
+	"""
+	Starts an HTTP/2 server on localhost (plain http, so clients need to know to talk HTTP/2 to it) that takes latency seconds to answer every request w/ body.
+	returns (server, stats). stats['connections'] counts the connections clients opened. call shutdown() on the server when you're done.
+	"""
+	import h2.config, h2.connection, h2.events, h2.settings
+	stats = {'connections': 0}
+	loop = asyncio.new_event_loop()
+	handlers = set()
+
+	async def handle(reader, writer):
+		stats['connections'] += 1
+		handlers.add(asyncio.current_task())
+		conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+		conn.local_settings = h2.settings.Settings(client=False, initial_values={h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 1000})
+		conn.initiate_connection()
+		writer.write(conn.data_to_send())
+		pending = set()
+		async def respond(stream_id):
+			await asyncio.sleep(latency)
+			conn.send_headers(stream_id, [(':status', '200'), ('content-type', 'application/vnd.api+json'), ('content-length', str(len(body)))])
+			conn.send_data(stream_id, body, end_stream=True)
+			writer.write(conn.data_to_send())
+		while True:
+			data = await reader.read(65536)
+			if not data:
+				break
+			for event in conn.receive_data(data):
+				if isinstance(event, h2.events.RequestReceived):
+					task = asyncio.ensure_future(respond(event.stream_id))
+					pending.add(task)
+					task.add_done_callback(pending.discard)
+				elif isinstance(event, h2.events.DataReceived):
+					conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+			writer.write(conn.data_to_send())
+		writer.close()
+		handlers.discard(asyncio.current_task())
+
+	async def stop():
+		server.close()
+		for handler in list(handlers):
+			handler.cancel()
+		await asyncio.gather(*handlers, return_exceptions=True)
+		loop.stop()
+
+	server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+	server.server_port = server.sockets[0].getsockname()[1]
+	threading.Thread(target=loop.run_forever, daemon=True).start()
+	server.shutdown = lambda: asyncio.run_coroutine_threadsafe(stop(), loop)
+	return server, stats
+
+def http1_server(latency, body):
+	"""
+	json_server, but it takes latency seconds to answer and counts connections the way http2_server does.
+	"""
+	stats = {'connections': 0}
+	class SlowHandler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def setup(self):
+			stats['connections'] += 1
+			BaseHTTPRequestHandler.setup(self)
+
+		def do_GET(self):
+			time.sleep(latency)
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, *args):
+			pass
+
+	ThreadingHTTPServer.daemon_threads = True
+	ThreadingHTTPServer.request_queue_size = 1024
+	server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, stats
+
+def bench_transports(num_requests=200, latency=0.05, pool_size=10):
+	"""
+	Times num_requests GETs made at once from as many threads, w/ the requests transport against an HTTP/1.1 server and the http2 transport against an HTTP/2 one. Both servers take latency seconds per request.
+	"""
+	body = json.dumps({'data': campaign_dict(1)}).encode('utf-8')
+	print(str(num_requests) + " concurrent GETs, " + str(latency) + "s per request, pool_size " + str(pool_size))
+	print("{:<12} {:<10} {:<12} {}".format('transport', 'seconds', 'new conns', 'worked'))
+	for transport, make_server in [('requests', http1_server), ('http2', http2_server)]:
+		server, stats = make_server(latency, body)
+		try:
+			lm = LoginManager(thru_text_account_name='benchmark', fake=True, pool_size=pool_size, transport=transport)
+			# the local server is plain http, so tell httpx to talk HTTP/2 to it w/o asking first
+			lm.transport_kwargs = {'http1': False}
+			tto = ConcreteThruTextObject(login_manager=lm)
+			lm.single_flight = None
+			url = 'http://127.0.0.1:' + str(server.server_port) + '/campaigns/1'
+			# one request first so both start w/ a connection open
+			tto.safe_request('get', url=url)
+			stats['connections'] = 0
+			start = time.perf_counter()
+			with concurrent.futures.ThreadPoolExecutor(max_workers=num_requests) as executor:
+				results = list(executor.map(lambda i: tto.safe_request('get', url=url)[1], range(num_requests)))
+			elapsed = time.perf_counter() - start
+			print("{:<12} {:<10.2f} {:<12} {}".format(transport, elapsed, stats['connections'], sum(results)))
+			lm.close()
+		finally:
+			server.shutdown()
+
+if __name__ == '__main__':
+	bench_compression()
+	bench_list_all()
+	bench_fetch_many()
+	bench_json_codec()
+	bench_transports()
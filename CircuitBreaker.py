@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import threading, time
+from collections import deque
+
+class RouteCircuit(object):
+	"""
+	How one route has been doing lately.
+	"""
+
+	def __init__(self):
+		self.state = 'closed'
+		self.consecutive_failures = 0
+		# (when, whether it failed) for every request in the window
+		self.results = deque()
+		self.opened_at = None
+		self.probes = 0
+		# when the last half open probe was let through
+		self.probed_at = None
+
+class CircuitBreaker(object):
+	"""
+	Stops sending requests to a route that keeps failing, so a ThruText outage makes bulk jobs fail in seconds instead of tying up every thread w/ timeouts and retries. Turn it on w/ LoginManager.enable_circuit_breaker.
+
+	Standards:
+	* Routes are urls w/ the ids taken out (see RequestMetrics.route_template), so one bad group doesn't shut off every group, but a broken groups endpoint does.
+	* Connection errors and statuses in failure_statuses (500 and up by default) are failures. 4xx are our fault, not the endpoint's, and don't count.
+	* A closed circuit opens after failure_threshold failures in a row, or when at least min_requests requests in the last window seconds failed error_rate of the time.
+	* While it's open, requests fail straight away w/o being sent.
+	* After reset_timeout seconds it's half open: up to half_open_probes requests go through. If one works, the circuit closes. If one fails, it opens again for another reset_timeout.
+	* A probe that never gets recorded (the request was cancelled, or something we didn't expect blew up) is given up on after reset_timeout, so the route isn't stuck half open for good. release gives one back straight away.
+	* Safe to share between threads.
+	"""
+
+	def __init__(self, *, failure_threshold=5, error_rate=0.5, window=60, min_requests=10, reset_timeout=30, half_open_probes=1, failure_statuses=None):
+		self.failure_threshold = failure_threshold
+		self.error_rate = error_rate
+		self.window = window
+		self.min_requests = min_requests
+		self.reset_timeout = reset_timeout
+		self.half_open_probes = half_open_probes
+		self.failure_statuses = set(failure_statuses) if failure_statuses is not None else set(range(500, 600))
+		self.circuits = {}
+		self.lock = threading.Lock()
+
+	def circuit(self, route):
+		if route not in self.circuits:
+			self.circuits[route] = RouteCircuit()
+		return self.circuits[route]
+
+	def state(self, route):
+		with self.lock:
+			circuit = self.circuits.get(route)
+			if circuit is None:
+				return 'closed'
+			if circuit.state == 'open' and time.monotonic() - circuit.opened_at >= self.reset_timeout:
+				return 'half_open'
+			return circuit.state
+
+	def is_failure(self, response=None, error=None):
+		if error is not None or response is None:
+			return True
+		return response.status_code in self.failure_statuses
+
+	def allow(self, route):
+		"""
+		Whether a request to route should be sent. In a half open circuit, saying yes counts as one of the probes.
+		"""
+		with self.lock:
+			circuit = self.circuit(route)
+			now = time.monotonic()
+			if circuit.state == 'open':
+				if now - circuit.opened_at < self.reset_timeout:
+					return False
+				circuit.state = 'half_open'
+				circuit.probes = 0
+			if circuit.state == 'half_open':
+				if circuit.probes >= self.half_open_probes:
+					if now - circuit.probed_at < self.reset_timeout:
+						return False
+					# never heard back from the last ones
+					circuit.probes = 0
+				circuit.probes += 1
+				circuit.probed_at = now
+			return True
+
+	def release(self, route):
+		"""
+		Gives back the probe allow() handed out for a request that never finished, so the next request can be the probe instead.
+		"""
+		with self.lock:
+			circuit = self.circuits.get(route)
+			if circuit is not None and circuit.state == 'half_open' and circuit.probes > 0:
+				circuit.probes -= 1
+
+	def record(self, route, failed):
+		"""
+		How a request to route went. returns the circuit's state afterwards.
+		"""
+		with self.lock:
+			circuit = self.circuit(route)
+			now = time.monotonic()
+			if circuit.state == 'half_open':
+				if failed:
+					self.trip(circuit, now)
+				else:
+					self.close(circuit)
+				return circuit.state
+			if circuit.state == 'open':
+				# a request that was already going when we opened
+				return circuit.state
+			circuit.results.append((now, failed))
+			while circuit.results and circuit.results[0][0] < now - self.window:
+				circuit.results.popleft()
+			circuit.consecutive_failures = circuit.consecutive_failures + 1 if failed else 0
+			failures = sum(1 for when, was_failure in circuit.results if was_failure)
+			if circuit.consecutive_failures >= self.failure_threshold or (len(circuit.results) >= self.min_requests and failures >= self.error_rate * len(circuit.results)):
+				self.trip(circuit, now)
+			return circuit.state
+
+	def trip(self, circuit, now):
+		circuit.state = 'open'
+		circuit.opened_at = now
+		circuit.probes = 0
+		circuit.probed_at = None
+
+	def close(self, circuit):
+		circuit.state = 'closed'
+		circuit.consecutive_failures = 0
+		circuit.results.clear()
+		circuit.opened_at = None
+		circuit.probes = 0
+		circuit.probed_at = None
+
+	def reset(self, route=None):
+		"""
+		Closes route's circuit, or every circuit if route isn't given.
+		"""
+		with self.lock:
+			if route is None:
+				circuits = list(self.circuits.values())
+			else:
+				circuits = [self.circuits[route]] if route in self.circuits else []
+			for circuit in circuits:
+				self.close(circuit)
+
+import unittest
+from FakeSession import FakeResponse
+
+class TestCircuitBreaker(unittest.TestCase):
+
+	def test_consecutive_failures(self):
+		breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+		for i in range(2):
+			assert breaker.allow('/groups')
+			breaker.record('/groups', breaker.is_failure(FakeResponse(503)))
+		assert breaker.record('/groups', breaker.is_failure(FakeResponse(404))) == 'closed'
+		for i in range(3):
+			breaker.record('/groups', breaker.is_failure(error=Exception('timed out')))
+		assert breaker.state('/groups') == 'open'
+		assert not breaker.allow('/groups')
+		assert breaker.allow('/campaigns')
+		time.sleep(0.06)
+		assert breaker.state('/groups') == 'half_open'
+		assert breaker.allow('/groups')
+		assert not breaker.allow('/groups')
+		assert breaker.record('/groups', True) == 'open'
+		time.sleep(0.06)
+		assert breaker.allow('/groups')
+		assert breaker.record('/groups', False) == 'closed'
+		assert breaker.allow('/groups') and breaker.allow('/groups')
+
+	def test_lost_probes(self):
+		breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+		breaker.record('/groups', True)
+		time.sleep(0.06)
+		assert breaker.allow('/groups') and not breaker.allow('/groups')
+		breaker.release('/groups')
+		assert breaker.allow('/groups') and not breaker.allow('/groups')
+		# that probe is never heard from again
+		time.sleep(0.06)
+		assert breaker.state('/groups') == 'half_open'
+		assert breaker.allow('/groups')
+		assert breaker.record('/groups', False) == 'closed'
+
+	def test_error_rate(self):
+		breaker = CircuitBreaker(failure_threshold=100, error_rate=0.5, min_requests=6)
+		for failed in [True, False, True, False, True]:
+			breaker.record('/groups', failed)
+		assert breaker.state('/groups') == 'closed'
+		breaker.record('/groups', False)
+		assert breaker.state('/groups') == 'open'
+		breaker.reset()
+		assert breaker.state('/groups') == 'closed'
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import contextvars, math, time
+
+# the deadline for whatever operation is going on right now. see Deadline
+current_deadline = contextvars.ContextVar('current_deadline', default=None)
+
+class Deadline(object):
+	"""
+	A time budget for a whole operation, like making a campaign from a file or uploading a batch of groups. Every request safe_request makes inside it shares what's left.
+
+		with Deadline(600):
+			campaign.from_file('campaign.yml')
+
+	Standards:
+	* Timeouts for each request are cut down to what's left of the budget.
+	* Once the budget's gone, no more requests or retries go out. They fail like a connection error would, w/ (None, False).
+	* A retry that would have to wait longer than what's left isn't tried at all.
+	* Deadlines inside deadlines can't give you more time than the outer one has left.
+	* seconds=None means no limit of its own, so functions can take an optional deadline and always use a with block.
+	* Threads don't see the deadline of the thread that started them. Wrap what you give a thread pool in carry_deadline.
+	"""
+
+	# the least timeout we ever hand out. requests won't take 0, and a deadline that's up is checked before sending anyway
+	shortest_timeout = 0.001
+
+	def __init__(self, seconds=None):
+		self.seconds = seconds
+		self.expires = math.inf if seconds is None else time.monotonic() + seconds
+		self.token = None
+
+	@classmethod
+	def current(cls):
+		"""
+		The deadline we're inside, or None if there isn't one.
+		"""
+		return current_deadline.get()
+
+	def remaining(self):
+		return max(0.0, self.expires - time.monotonic())
+
+	def expired(self):
+		return time.monotonic() >= self.expires
+
+	def allows(self, delay):
+		"""
+		Whether there's time to wait delay seconds and still send something.
+		"""
+		return delay < self.remaining()
+
+	def timeout(self, timeout):
+		"""
+		timeout, a (connect, read) tuple, cut down so neither goes past the deadline. Never less than shortest_timeout, even once the deadline's up.
+		"""
+		if self.expires == math.inf:
+			return timeout
+		remaining = max(self.shortest_timeout, self.remaining())
+		connect, read = timeout
+		return (min(connect, remaining) if connect is not None else remaining, min(read, remaining) if read is not None else remaining)
+
+	def __enter__(self):
+		outer = current_deadline.get()
+		if outer is not None:
+			self.expires = min(self.expires, outer.expires)
+		self.token = current_deadline.set(self)
+		return self
+
+	def __exit__(self, *exc_info):
+		current_deadline.reset(self.token)
+		self.token = None
+		return False
+
+def carry_deadline(func):
+	"""
+	func, wrapped so it runs inside the current deadline (if there is one) in whichever thread ends up calling it.
+	"""
+	deadline = current_deadline.get()
+	if deadline is None:
+		return func
+	def run(*args, **kwargs):
+		token = current_deadline.set(deadline)
+		try:
+			return func(*args, **kwargs)
+		finally:
+			current_deadline.reset(token)
+	return run
+
+import unittest, threading
+
+class TestDeadline(unittest.TestCase):
+
+	def test_budget(self):
+		assert Deadline.current() is None
+		with Deadline(10) as outer:
+			assert Deadline.current() is outer
+			assert 9 < outer.remaining() <= 10 and not outer.expired()
+			assert outer.timeout((5, 60))[0] == 5 and outer.timeout((5, 60))[1] <= 10
+			assert outer.allows(1) and not outer.allows(11)
+			with Deadline(0.01) as inner:
+				time.sleep(0.02)
+				assert inner.expired() and inner.timeout((5, 60)) == (inner.shortest_timeout, inner.shortest_timeout)
+			with Deadline(100) as longer:
+				assert longer.remaining() <= 10
+			with Deadline() as unlimited:
+				assert unlimited.remaining() <= 10
+			assert Deadline.current() is outer
+		assert Deadline.current() is None
+		assert Deadline().timeout((5, 60)) == (5, 60)
+
+	def test_threads(self):
+		seen = []
+		with Deadline(10) as deadline:
+			plain = threading.Thread(target=lambda: seen.append(Deadline.current()))
+			carried = threading.Thread(target=carry_deadline(lambda: seen.append(Deadline.current())))
+			for thread in [plain, carried]:
+				thread.start()
+				thread.join()
+		assert seen == [None, deadline]
+
+if __name__ == '__main__':
+	unittest.main()
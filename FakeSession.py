@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import json, threading, time
+from requests.structures import CaseInsensitiveDict
+
+class FakeResponse(object):
+	"""
+	Stands in for a requests.Response in tests. content can be bytes, a str, or anything json can encode.
+	"""
+
+	def __init__(self, status_code=200, headers=None, content=b''):
+		self.status_code = status_code
+		self.headers = CaseInsensitiveDict(headers or {})
+		if not isinstance(content, (str, bytes)):
+			content = json.dumps(content)
+		self.content = content.encode('utf-8') if isinstance(content, str) else content
+		self.text = self.content.decode('utf-8', 'replace')
+		self.elapsed = None
+
+class FakeSession(object):
+	"""
+	Stands in for a requests.Session in tests, so safe_request can be tested w/o a server. For tests that want a whole fake ThruText, see FakeThruTextServer.
+
+	Standards:
+	* Each request gets the next of outcomes, and the last one over and over once they run out. Or, if you give it respond, whatever respond(method, **kwargs) returns.
+	* An outcome that's an exception gets raised instead of returned.
+	* Every request is kept in calls as (method, kwargs), in the order they came in. sent(name) is one of the kwargs for each of them.
+	* Streamed bodies get read all the way through, like a real session would send them.
+	* delay - seconds each request takes.
+	* Safe to use from lots of threads at once.
+	"""
+
+	def __init__(self, outcomes=None, respond=None, delay=0):
+		self.outcomes = list(outcomes) if outcomes else [FakeResponse()]
+		self.respond = respond
+		self.delay = delay
+		self.calls = []
+		self.headers = {}
+		self.lock = threading.Lock()
+
+	def request(self, method, **kwargs):
+		data = kwargs.get('data')
+		if data is not None and not isinstance(data, (str, bytes)):
+			kwargs['data'] = b''.join(data)
+		with self.lock:
+			index = len(self.calls)
+			self.calls.append((method, kwargs))
+		if self.delay:
+			time.sleep(self.delay)
+		if self.respond is not None:
+			outcome = self.respond(method, **kwargs)
+		else:
+			outcome = self.outcomes[min(index, len(self.outcomes) - 1)]
+		if isinstance(outcome, BaseException):
+			raise outcome
+		return outcome
+
+	def sent(self, name):
+		"""
+		The name keyword argument (url, headers, timeout, etc) of every request so far.
+		"""
+		return [kwargs.get(name) for method, kwargs in self.calls]
+
+	def get(self, url=None, **kwargs):
+		return self.request('get', url=url, **kwargs)
+
+	def post(self, url=None, **kwargs):
+		return self.request('post', url=url, **kwargs)
+
+	def put(self, url=None, **kwargs):
+		return self.request('put', url=url, **kwargs)
+
+	def patch(self, url=None, **kwargs):
+		return self.request('patch', url=url, **kwargs)
+
+	def delete(self, url=None, **kwargs):
+		return self.request('delete', url=url, **kwargs)
+
+	def head(self, url=None, **kwargs):
+		return self.request('head', url=url, **kwargs)
+
+	def close(self):
+		pass
+
+import unittest
+
+class TestFakeSession(unittest.TestCase):
+
+	def test_outcomes(self):
+		session = FakeSession([ConnectionError('refused'), FakeResponse(503, {'Retry-After': '1'}), FakeResponse(200, content={'data': []})])
+		with self.assertRaises(ConnectionError):
+			session.get(url='https://example.com/groups', timeout=(1, 2))
+		assert session.get(url='https://example.com/groups').headers['retry-after'] == '1'
+		for i in range(2):
+			assert json.loads(session.post(url='https://example.com/groups', data=(b'x' for i in range(3))).content) == {'data': []}
+		assert [method for method, kwargs in session.calls] == ['get', 'get', 'post', 'post']
+		assert session.sent('timeout') == [(1, 2), None, None, None]
+		assert session.sent('data')[2] == b'xxx'
+
+	def test_respond(self):
+		session = FakeSession(respond=lambda method, **kwargs: FakeResponse(201 if method == 'post' else 200))
+		assert session.post(url='https://example.com').status_code == 201
+		assert session.delete(url='https://example.com').status_code == 200
+
+if __name__ == '__main__':
+	unittest.main()
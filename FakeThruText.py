@@ -0,0 +1,719 @@
+#!/usr/bin/env python
+
+"""
+A stand-in for the ThruText API that runs on localhost, for tests and benchmarks that shouldn't touch the real thing.
+
+	with FakeThruTextServer(latency=0.05) as server:
+		lm = server.login_manager()
+		group = ThruTextGroup(login_manager=lm)
+		group.make_new(...)
+
+Run it directly to keep one going for other programs: python FakeThruText.py --serve [port]
+"""
+
+import json, gzip, zlib, hashlib, random, re, os, sys, threading, time, itertools
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from LoginManager import LoginManager
+
+class FakeThruTextError(Exception):
+	"""
+	Raised inside a request handler to send back a JSON:API error.
+	"""
+
+	def __init__(self, status, detail):
+		super().__init__(detail)
+		self.status = status
+		self.detail = detail
+
+class FakeThruTextHandler(BaseHTTPRequestHandler):
+	"""
+	Hands each request to the FakeThruTextServer it came in on.
+	"""
+	protocol_version = 'HTTP/1.1'
+	# headers and body go out in separate writes, which w/ Nagle and delayed acks costs 40ms a request
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		self.server.fake.handle(self, 'get')
+
+	def do_POST(self):
+		self.server.fake.handle(self, 'post')
+
+	def do_PUT(self):
+		self.server.fake.handle(self, 'put')
+
+	def do_PATCH(self):
+		self.server.fake.handle(self, 'patch')
+
+	def do_DELETE(self):
+		self.server.fake.handle(self, 'delete')
+
+	def read_body(self):
+		if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+			pieces = []
+			while True:
+				size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+				if size == 0:
+					self.rfile.readline()
+					break
+				pieces.append(self.rfile.read(size))
+				self.rfile.readline()
+			body = b''.join(pieces)
+		else:
+			body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		encoding = self.headers.get('Content-Encoding', '').lower()
+		if encoding == 'gzip':
+			body = gzip.decompress(body)
+		elif encoding == 'deflate':
+			body = zlib.decompress(body)
+		return body
+
+	def log_message(self, *args):
+		pass
+
+class FakeThruTextServer(object):
+	"""
+	A local fake of the parts of the ThruText API this library uses: sessions, groups, campaigns, custom_fields, saved_replies, surveys, exports and countries. Point a LoginManager at it w/ api_url=server.url, or use server.login_manager().
+
+	Standards:
+	* Speaks JSON:API the way ThruText does: {'data': ...} in and out, errors as {'errors': [...]}, filter[x]=, page[size]= and page[number]= w/ links.next, and gzip/deflate/chunked request bodies.
+	* Everything but logging in needs a token from POST /sessions, like the real one.
+	* Keeps what you make in memory until the server stops (or reset()). Nothing is shared between servers.
+	* Groups count their valid and invalid phone numbers. w/ processing_seconds, they're 'processing' for that long first.
+	* latency - seconds (or (min, max) for a random amount) before each response.
+	* error_rate - fraction of requests that randomly get one of error_statuses instead. fail_next queues up failures for specific requests, so tests don't have to be random.
+	* rate_limit - most requests per rate_window seconds. Every response says how many are left (X-RateLimit-Limit/Remaining/Reset), and going over gets a 429 w/ Retry-After.
+	* GETs have ETags, and If-None-Match gets a 304, so ResponseCache works against it.
+	* Safe to hit from lots of threads at once.
+	"""
+
+	collections = ['groups', 'campaigns', 'custom_fields', 'saved_replies', 'surveys', 'exports']
+	types = {'groups': 'group', 'campaigns': 'campaign', 'custom_fields': 'custom_field', 'saved_replies': 'saved_reply', 'surveys': 'surveys', 'exports': 'export'}
+	regions = [
+		('US', 'New York (212)'), ('US', 'New York (718)'), ('US', 'Chicago (312)'), ('US', 'Los Angeles (213)'),
+		('US', 'Philadelphia (215)'), ('US', 'Detroit (313)'), ('US', 'Atlanta (404)'), ('US', 'Miami (305)'),
+		('CA', 'Toronto (416)'), ('CA', 'Vancouver (604)'),
+	]
+
+	def __init__(self, *, host='127.0.0.1', port=0, latency=0, error_rate=0, error_statuses=None, rate_limit=None, rate_window=1, page_size=None, max_page_size=None, processing_seconds=0, account_number='0000000001', account_name='fake', email='fake@example.com', password='fake password', seed=None):
+		"""
+		input:
+		host, port (optional) - where to listen. port 0 picks a free one
+		latency (optional) - seconds to wait before answering, or a (min, max) range
+		error_rate (optional) - fraction of requests to fail on purpose, w/ a status from error_statuses (500, 502 and 503 by default)
+		rate_limit, rate_window (optional) - most requests per rate_window seconds. None is no limit
+		page_size (optional) - most objects in a listing when the request doesn't ask for a page size. None sends everything
+		max_page_size (optional) - most objects in a listing even when the request asks for more. None is no limit
+		processing_seconds (optional) - how long new groups stay 'processing'
+		account_number, account_name, email, password (optional) - the one account you can log into
+		seed (optional) - for the random latency and errors
+		"""
+		self.host = host
+		self.port = port
+		self.latency = latency
+		self.error_rate = error_rate
+		self.error_statuses = list(error_statuses) if error_statuses is not None else [500, 502, 503]
+		self.rate_limit = rate_limit
+		self.rate_window = rate_window
+		self.page_size = page_size
+		self.max_page_size = max_page_size
+		self.processing_seconds = processing_seconds
+		self.account_number = str(account_number)
+		self.account_name = account_name
+		self.email = email
+		self.password = password
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.httpd = None
+		self.thread = None
+		self.saved_environ = None
+		self.reset()
+
+	def reset(self):
+		"""
+		Forgets everything: what's been made, tokens, queued failures, the request log and the rate limit window.
+		"""
+		with self.lock:
+			self.store = {name: {} for name in self.collections}
+			self.ids = itertools.count(1)
+			self.tokens = set()
+			self.failures = []
+			self.requests = []
+			self.throttled = 0
+			self.injected = 0
+			self.window_start = time.monotonic()
+			self.window_count = 0
+
+	def start(self):
+		"""
+		Starts answering requests in a background thread. returns the server.
+		"""
+		ThreadingHTTPServer.daemon_threads = True
+		self.httpd = ThreadingHTTPServer((self.host, self.port), FakeThruTextHandler)
+		self.httpd.fake = self
+		self.port = self.httpd.server_port
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		"""
+		Stops the server, and puts back the environment variables if set_environ changed them.
+		"""
+		if self.httpd is not None:
+			self.httpd.shutdown()
+			self.httpd.server_close()
+			self.httpd = None
+		if self.saved_environ is not None:
+			for key, value in self.saved_environ.items():
+				if value is None:
+					os.environ.pop(key, None)
+				else:
+					os.environ[key] = value
+			self.saved_environ = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc_info):
+		self.stop()
+		return False
+
+	@property
+	def url(self):
+		"""
+		The API's base url, for LoginManager's api_url.
+		"""
+		return 'http://' + str(self.host) + ':' + str(self.port) + '/v1'
+
+	@property
+	def account_url(self):
+		return '/v1/accounts/' + self.account_number
+
+	def login_manager(self, **kwargs):
+		"""
+		A LoginManager for this server, already logged in. kwargs are passed along to LoginManager.
+		"""
+		lm = LoginManager(thru_text_account_name=self.account_name, api_url=self.url, **kwargs)
+		lm.real_authenticate(self.email, self.password, fatal_failure=True, verbose=False)
+		return lm
+
+	def environ(self):
+		"""
+		The environment variables that make LoginManager() (and env_login) use this server.
+		"""
+		return {
+			'THRU_TEXT_API_URL': self.url,
+			'THRU_TEXT_ACCOUNT_NAME': self.account_name,
+			'THRU_TEXT_API_UN': self.email,
+			'THRU_TEXT_API_PW': self.password,
+		}
+
+	def set_environ(self):
+		"""
+		Points the environment at this server (see environ) until it stops.
+		"""
+		if self.saved_environ is None:
+			self.saved_environ = {key: os.environ.get(key) for key in self.environ()}
+		os.environ.update(self.environ())
+
+	@classmethod
+	def for_offline_tests(cls):
+		"""
+		For test suites that normally talk to ThruText. If the environment variable THRU_TEXT_OFFLINE is set, starts one of these w/ some examples in it (see add_examples) and points the environment at it. returns it, or None if the tests should use ThruText.
+		"""
+		if not os.environ.get('THRU_TEXT_OFFLINE'):
+			return None
+		server = cls().start()
+		server.add_examples()
+		server.set_environ()
+		return server
+
+	def fail_next(self, count=1, status=503, *, method=None, path=None, headers=None):
+		"""
+		Makes the next count requests (that match method and contain path, if you give them) get status instead of an answer.
+		"""
+		with self.lock:
+			for i in range(count):
+				self.failures.append({'status': status, 'method': method, 'path': path, 'headers': headers or {}})
+
+	def add(self, collection, attributes, relationships=None):
+		"""
+		Puts an object straight into collection, like someone made it in the web app. returns its dict.
+		"""
+		with self.lock:
+			return self.create(collection, dict(attributes), relationships)
+
+	def add_examples(self):
+		"""
+		Fills the account w/ a little of everything, the way a real one would already have some, for tests that expect to find things.
+		"""
+		group = self.add('groups', {'name': 'example group', 'import': {'csv_data': [['first', 'last', 'phone'], ['Jane', 'Doe', '555-555-1234']], 'mapping': {'first_name': 0, 'last_name': 1, 'phone': 2}}})
+		campaign = self.add('campaigns', {'name': 'example campaign', 'description': 'an example', 'script': 'Hi {first_name}!', 'time_zone': 'US/Central', 'open_time': '09:00', 'close_time': '21:00', 'start_date': '2020-10-01', 'end_date': '2020-11-03'})
+		self.add('custom_fields', {'title': 'Polling Location', 'code': 'poll_loc'})
+		self.add('saved_replies', {'title': 'Wrong Number', 'body': 'Sorry about that!', 'campaign_id': campaign['id']})
+		self.add('surveys', {'question': 'Can we count on your vote?', 'survey_type': 'yes_no', 'campaign_id': campaign['id']})
+		return group, campaign
+
+	# request handling
+
+	def handle(self, handler, method):
+		url = urlsplit(handler.path)
+		path = re.sub('/+', '/', url.path).rstrip('/')
+		query = parse_qsl(url.query, keep_blank_values=True)
+		with self.lock:
+			self.requests.append((method, path))
+		self.sleep()
+		try:
+			body = handler.read_body() if method in ['post', 'put', 'patch'] else b''
+			headers = self.check_limits(method, path)
+			if path == '/v1/sessions' and method == 'post':
+				status, out = self.new_session(self.parse(body))
+			else:
+				self.check_token(handler.headers.get('Authorization'))
+				status, out = self.route(method, path, query, self.parse(body) if body else {})
+		except FakeThruTextError as e:
+			headers = getattr(e, 'headers', {})
+			status, out = e.status, {'errors': [{'status': str(e.status), 'detail': e.detail}]}
+		except Exception as e:
+			# a bug in the fake, or a request it can't make sense of. the real one would 500 too
+			headers = {}
+			status, out = 500, {'errors': [{'status': '500', 'detail': repr(e)}]}
+		self.respond(handler, method, status, out, headers)
+
+	def sleep(self):
+		latency = self.latency
+		if isinstance(latency, (tuple, list)):
+			latency = self.random.uniform(*latency)
+		if latency:
+			time.sleep(latency)
+
+	def check_limits(self, method, path):
+		"""
+		Queued failures, then random ones, then the rate limit. Raises FakeThruTextError if this request doesn't get through. returns the rate limit headers to send.
+		"""
+		with self.lock:
+			for failure in self.failures:
+				if (failure['method'] is None or failure['method'] == method) and (failure['path'] is None or failure['path'] in path):
+					self.failures.remove(failure)
+					self.injected += 1
+					error = FakeThruTextError(failure['status'], 'failed on purpose')
+					error.headers = failure['headers']
+					raise error
+			if self.error_rate and self.random.random() < self.error_rate:
+				self.injected += 1
+				raise FakeThruTextError(self.random.choice(self.error_statuses), 'failed on purpose')
+			if self.rate_limit is None:
+				return {}
+			now = time.monotonic()
+			if now - self.window_start >= self.rate_window:
+				self.window_start = now
+				self.window_count = 0
+			reset = max(0.0, self.rate_window - (now - self.window_start))
+			headers = {'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Reset': '{:.3f}'.format(reset)}
+			if self.window_count >= self.rate_limit:
+				self.throttled += 1
+				error = FakeThruTextError(429, 'rate limit exceeded')
+				error.headers = dict(headers, **{'X-RateLimit-Remaining': '0', 'Retry-After': '{:.3f}'.format(reset)})
+				raise error
+			self.window_count += 1
+			headers['X-RateLimit-Remaining'] = str(self.rate_limit - self.window_count)
+			return headers
+
+	def check_token(self, authorization):
+		match = re.match(r'Token token="(.*)"', authorization or '')
+		with self.lock:
+			if match is None or match.group(1) not in self.tokens:
+				raise FakeThruTextError(401, 'not logged in')
+
+	def parse(self, body):
+		try:
+			return json.loads(body) if body else {}
+		except ValueError:
+			raise FakeThruTextError(400, "body isn't json")
+
+	def respond(self, handler, method, status, out, headers):
+		body = b'' if out is None else json.dumps(out).encode('utf-8')
+		headers = dict(headers)
+		if method == 'get' and status == 200:
+			etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+			headers['ETag'] = etag
+			if handler.headers.get('If-None-Match') == etag:
+				status, body = 304, b''
+		handler.send_response(status)
+		if body:
+			handler.send_header('Content-Type', 'application/vnd.api+json')
+		handler.send_header('Content-Length', str(len(body)))
+		for name, value in headers.items():
+			handler.send_header(name, value)
+		try:
+			handler.end_headers()
+			handler.wfile.write(body)
+		except (BrokenPipeError, ConnectionResetError):
+			# the client gave up on us, ie it stopped partway through sending a streamed body
+			handler.close_connection = True
+
+	def new_session(self, payload):
+		attributes = (payload.get('data') or {}).get('attributes') or {}
+		if attributes.get('email') != self.email or attributes.get('password') != self.password:
+			raise FakeThruTextError(401, 'wrong email or password')
+		token = hashlib.sha1(str(self.random.random()).encode('utf-8')).hexdigest()
+		with self.lock:
+			self.tokens.add(token)
+		return 201, {
+			'data': {'type': 'session', 'id': token[:8], 'attributes': {'token': token}},
+			'included': [{'type': 'account', 'id': self.account_number, 'attributes': {'name': self.account_name}}],
+		}
+
+	def route(self, method, path, query, payload):
+		if path == '/v1/countries' and method == 'get':
+			return 200, self.countries()
+		if not path.startswith(self.account_url + '/'):
+			raise FakeThruTextError(404, 'no such account')
+		parts = path[len(self.account_url) + 1:].split('/')
+		campaign_id = None
+		if len(parts) >= 3 and parts[0] == 'campaigns' and parts[2] in ['saved_replies', 'surveys', 'exports']:
+			# nested under a campaign, ie campaigns/5/saved_replies/7/reorder
+			campaign_id = parts[1]
+			with self.lock:
+				self.get(parts[0], campaign_id)
+			parts = parts[2:]
+		collection, object_id, action = (parts + [None, None])[:3]
+		if collection not in self.collections:
+			raise FakeThruTextError(404, 'no such endpoint: ' + path)
+		with self.lock:
+			if object_id is None:
+				if method == 'get':
+					return 200, self.listing(collection, path, query, campaign_id)
+				if method == 'post':
+					attributes = dict((payload.get('data') or {}).get('attributes') or {})
+					if campaign_id is not None:
+						attributes['campaign_id'] = campaign_id
+					return 201, {'data': self.create(collection, attributes)}
+			elif action is None:
+				if method == 'get':
+					return 200, {'data': self.refresh(self.get(collection, object_id))}
+				if method == 'patch':
+					one = self.get(collection, object_id)
+					one['attributes'].update((payload.get('data') or {}).get('attributes') or {})
+					self.touch(one)
+					return 200, {'data': one}
+				if method == 'delete':
+					self.get(collection, object_id)
+					del self.store[collection][object_id]
+					return 204, None
+			elif action == 'archive' and method == 'post':
+				one = self.get(collection, object_id)
+				one['attributes']['status'] = 'archived'
+				if 'archived_at' in one['attributes']:
+					one['attributes']['archived_at'] = self.now()
+				return 200, {'data': one}
+			elif action == 'reorder' and method == 'put':
+				one = self.get(collection, object_id)
+				one['attributes']['order'] = int(((payload.get('data') or {}).get('attributes') or {}).get('order', 0))
+				self.touch(one)
+				return 200, {'data': one}
+			elif action == 'apportion' and collection == 'campaigns' and method == 'post':
+				one = self.get(collection, object_id)
+				one['attributes']['status'] = 'active'
+				return 200, {'data': one}
+		raise FakeThruTextError(405, "can't " + method + ' ' + path)
+
+	# the data. everything below is called w/ the lock held
+
+	def now(self):
+		return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+	def touch(self, one):
+		if 'updated_at' in one['attributes']:
+			one['attributes']['updated_at'] = self.now()
+
+	def get(self, collection, object_id):
+		one = self.store[collection].get(str(object_id))
+		if one is None:
+			raise FakeThruTextError(404, 'no ' + self.types[collection] + ' w/ id ' + str(object_id))
+		return one
+
+	def listing(self, collection, path, query, campaign_id=None):
+		objects = [self.refresh(one) for one in self.store[collection].values()]
+		if campaign_id is not None:
+			objects = [one for one in objects if str(one['attributes'].get('campaign_id')) == str(campaign_id)]
+		params = dict(query)
+		for key, value in params.items():
+			match = re.match(r'filter\[(.*)\]$', key)
+			if match is None:
+				continue
+			wanted = set(value.split(','))
+			if match.group(1) == 'id':
+				objects = [one for one in objects if one['id'] in wanted]
+			else:
+				objects = [one for one in objects if str(one['attributes'].get(match.group(1))) in wanted]
+		page_size = int(params.get('page[size]', self.page_size or 0)) or None
+		if self.max_page_size is not None:
+			page_size = min(page_size or self.max_page_size, self.max_page_size)
+		out = {'data': objects, 'links': {'self': path + ('?' + urlencode(query) if query else '')}}
+		if page_size is not None:
+			number = int(params.get('page[number]', 1))
+			out['data'] = objects[(number - 1) * page_size:number * page_size]
+			if number * page_size < len(objects):
+				params['page[number]'] = number + 1
+				params['page[size]'] = page_size
+				out['links']['next'] = path + '?' + urlencode(params)
+		return out
+
+	def create(self, collection, attributes, relationships=None):
+		object_id = str(next(self.ids))
+		make = getattr(self, 'new_' + self.types[collection])
+		one = {'id': object_id, 'type': self.types[collection], 'attributes': make(attributes), 'relationships': relationships or {}, 'links': {'self': self.account_url + '/' + collection + '/' + object_id}}
+		if collection == 'groups':
+			one['relationships'] = dict({'campaigns': {'data': []}, 'import': {'data': None}, 'custom_fields': {'data': [{'type': 'custom_field', 'id': str(f.get('custom_field_id'))} for f in attributes.get('group_custom_fields') or []]}}, **one['relationships'])
+			one['contacts'] = self.count_contacts(attributes)
+			one['ready_at'] = time.monotonic() + self.processing_seconds
+		elif collection == 'campaigns':
+			one['relationships'] = dict({name: {'data': []} for name in ['followups', 'segments', 'campaign_tags', 'surveys', 'saved_replies', 'custom_fields', 'regions']}, **one['relationships'])
+			one['relationships']['regions']['data'] = [{'type': 'region', 'id': str(r.get('id'))} for r in attributes.get('regions') or []]
+		self.store[collection][object_id] = one
+		return self.refresh(one)
+
+	def refresh(self, one):
+		"""
+		Finishes processing a group once its time is up.
+		"""
+		ready_at = one.get('ready_at')
+		if ready_at is not None and time.monotonic() >= ready_at:
+			counts = one['attributes']['contact_counts']
+			if one['attributes']['status'] == 'processing':
+				one['attributes']['status'] = 'active'
+			counts['valid'], counts['invalid'] = one.pop('contacts')
+			counts['unvalidated'] = 0
+			del one['ready_at']
+		return {key: value for key, value in one.items() if key not in ['ready_at', 'contacts']}
+
+	def count_contacts(self, attributes):
+		"""
+		(valid, invalid) for a new group's import. A phone number needs at least 10 digits to be valid.
+		"""
+		import_data = attributes.get('import') or {}
+		rows = (import_data.get('csv_data') or [])[1:]
+		phone = (import_data.get('mapping') or {}).get('phone')
+		valid = sum(1 for row in rows if phone is not None and phone < len(row) and len(re.sub(r'\D', '', str(row[phone]))) >= 10)
+		return valid, len(rows) - valid
+
+	def new_group(self, attributes):
+		rows = ((attributes.get('import') or {}).get('csv_data') or [])[1:]
+		return {
+			'name': attributes.get('name'), 'status': 'processing', 'account_id': self.account_number,
+			'country_id': attributes.get('country_id') or 'US', 'upload_failed_reason': None,
+			'contact_counts': {'unvalidated': len(rows), 'valid': 0, 'opted_out': 0, 'invalid': 0},
+		}
+
+	def new_campaign(self, attributes):
+		return {
+			'name': attributes.get('name'), 'status': 'draft', 'description': attributes.get('description', ''),
+			'open_time': attributes.get('open_time'), 'close_time': attributes.get('close_time'),
+			'start_date': attributes.get('start_date'), 'end_date': attributes.get('end_date'),
+			'time_zone': attributes.get('time_zone'), 'country_id': attributes.get('country_id') or 'US',
+			'script': attributes.get('script'), 'opt_outs_count': 0, 'initial_sent_count': 0, 'replies_count': 0,
+			'conversations_count': 0, 'unassigned_count': 0, 'senders_count': 0, 'apportionment_failed_reason': None,
+		}
+
+	def new_custom_field(self, attributes):
+		if not attributes.get('title') or not attributes.get('code'):
+			raise FakeThruTextError(422, 'custom fields need a title and a code')
+		if any(f['attributes']['code'] == attributes['code'] for f in self.store['custom_fields'].values()):
+			raise FakeThruTextError(422, 'there is already a custom field w/ code ' + str(attributes['code']))
+		return {'title': attributes['title'], 'code': attributes['code'], 'account_id': self.account_number, 'has_data': False}
+
+	def new_saved_reply(self, attributes):
+		campaign_id = attributes.get('campaign_id') or None
+		order = sum(1 for r in self.store['saved_replies'].values() if r['attributes']['campaign_id'] == campaign_id)
+		return {
+			'title': attributes.get('title'), 'body': attributes.get('body'), 'campaign_id': campaign_id, 'order': order,
+			'account_id': self.account_number, 'tag_id': None, 'user_id': None, 'updated_at': self.now(),
+		}
+
+	def new_surveys(self, attributes):
+		campaign_id = attributes.get('campaign_id') or None
+		order = sum(1 for s in self.store['surveys'].values() if s['attributes']['campaign_id'] == campaign_id)
+		return {
+			'question': attributes.get('question'), 'survey_type': attributes.get('survey_type'), 'campaign_id': campaign_id,
+			'survey_choices': attributes.get('survey_choices'), 'is_global': campaign_id is None, 'order': order,
+			'account_id': self.account_number, 'archived_at': None, 'in_active_campaign': False, 'inserted_at': self.now(),
+			'provider': None, 'provider_data': None, 'provider_id': None, 'provider_type': None, 'response_count': 0, 'responsed_count': 0,
+		}
+
+	def new_export(self, attributes):
+		now = self.now()
+		return {
+			'export_type': attributes.get('export_type') or 'surveys', 'campaign_id': attributes.get('campaign_id'), 'status': 'complete',
+			'start_date': now, 'end_date': now, 'inserted_at': now, 'csv_url': None,
+		}
+
+	def countries(self):
+		included = [{'id': str(index + 1), 'type': 'region', 'attributes': {'name': name, 'country_id': country}} for index, (country, name) in enumerate(self.regions)]
+		countries = []
+		for country, name in [('US', 'United States'), ('CA', 'Canada')]:
+			regions = [{'type': 'region', 'id': r['id']} for r in included if r['attributes']['country_id'] == country]
+			countries.append({'id': country, 'type': 'country', 'attributes': {'name': name}, 'relationships': {'regions': {'data': regions}}})
+		return {'data': countries, 'included': included}
+
+import unittest, tempfile
+from HttpxSession import httpx
+
+class TestFakeThruTextServer(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.server = FakeThruTextServer(seed=1).start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.stop()
+
+	def setUp(self):
+		self.server.reset()
+		self.server.latency = 0
+		self.server.rate_limit = None
+		self.server.page_size = None
+		self.server.max_page_size = None
+		self.server.processing_seconds = 0
+
+	def test_login(self):
+		lm = self.server.login_manager()
+		assert lm.token is not None and lm.account_number == self.server.account_number
+		assert lm.prove_token_works()
+		bad = LoginManager(thru_text_account_name='fake', api_url=self.server.url)
+		assert bad.real_authenticate('fake@example.com', 'wrong', fatal_failure=False, verbose=False) is None
+		bad.token = 'made up'
+		assert not bad.prove_token_works()
+
+	def test_groups(self):
+		from ThruTextGroup import ThruTextGroup
+		lm = self.server.login_manager()
+		lm.enable_compression(threshold=0)
+		group = ThruTextGroup(login_manager=lm)
+		csv_data = [['first', 'last', 'phone'], ['Jane', 'Doe', '555-555-1234'], ['John', 'Doe', '12']]
+		assert group.make_new(name='fake group', custom_field_mapping=[], critical_field_mapping={'first_name': 0, 'last_name': 1, 'phone': 2}, csv_data=csv_data)
+		assert group.status == 'active' and group.contacts_valid == 1 and group.contacts_invalid == 1
+		streamed = ThruTextGroup(login_manager=lm)
+		assert streamed.make_new_streaming(name='streamed', custom_field_mapping=[], critical_field_mapping={'first_name': 0, 'last_name': 1, 'phone': 2}, csv_chunks=[csv_data[:2], csv_data[2:]])
+		assert streamed.contacts_valid == 1 and streamed.contacts_invalid == 1
+		for i in range(3):
+			self.server.add('groups', {'name': 'extra ' + str(i), 'import': {'csv_data': []}})
+		self.server.page_size = 2
+		assert sorted(g.name for g in group.list_all()) == ['extra 0', 'extra 1', 'extra 2', 'fake group', 'streamed']
+		before = len(self.server.requests)
+		fetched = ThruTextGroup.fetch_many([group.id, streamed.id, '999'], login_manager=lm)
+		assert [r[1].name if r[1] is not None else None for r in fetched] == ['fake group', 'streamed', None]
+		# one filter[id] listing for all of them, then a GET for the one it didn't return
+		assert [path.rsplit('/', 1)[-1] for method, path in self.server.requests[before:]] == ['groups', '999']
+		assert group.get_rid_of()
+		assert group.become() and group.status == 'archived'
+		assert [g.name for g in group.list_all(filters={'status': 'archived'})] == ['fake group']
+
+	def test_fetch_many(self):
+		from ThruTextCustomField import ThruTextCustomField
+		lm = self.server.login_manager()
+		ids = [self.server.add('custom_fields', {'title': 'Field ' + str(i), 'code': 'field_' + str(i)})['id'] for i in range(5)]
+		self.server.max_page_size = 2
+		before = len(self.server.requests)
+		fetched = ThruTextCustomField.fetch_many(ids + ['999'], login_manager=lm, batch_size=3)
+		assert [r[1].code if r[1] is not None else None for r in fetched] == ['field_0', 'field_1', 'field_2', 'field_3', 'field_4', None]
+		assert [r[2] is None for r in fetched] == [True] * 5 + [False]
+		# the 1st batch doesn't fit in a page, so it takes 2 listings. then a GET for the one neither batch returned
+		assert sorted(path.rsplit('/', 1)[-1] for method, path in self.server.requests[before:]) == ['999', 'custom_fields', 'custom_fields', 'custom_fields']
+
+	@unittest.skipIf(httpx is None, "needs httpx")
+	def test_httpx_timings(self):
+		from ThruTextGroup import ThruTextGroup
+		self.server.latency = 0.02
+		lm = self.server.login_manager(transport='httpx')
+		events = []
+		lm.add_request_hook(lambda **event: events.append(event))
+		assert ThruTextGroup(login_manager=lm).list_all() == []
+		# a new connection, so it had to connect. plain http, so no tls
+		assert events[0]['connect'] is not None and events[0]['tls'] is None
+		assert events[0]['server'] >= 0.02
+
+	def test_processing(self):
+		from ThruTextGroup import ThruTextGroup
+		self.server.processing_seconds = 0.2
+		group = ThruTextGroup(login_manager=self.server.login_manager())
+		assert group.make_new(name='slow', custom_field_mapping=[], critical_field_mapping={'first_name': 0, 'last_name': 1, 'phone': 2}, csv_data=[['first', 'last', 'phone'], ['Jane', 'Doe', '5555551234']])
+		assert group.status == 'processing' and not group.is_processed()
+		assert group.wait_until_processed(timeout=5, min_interval=0.1)
+		assert group.status == 'active' and group.contacts_valid == 1
+
+	def test_campaign_pieces(self):
+		from ThruTextCustomField import ThruTextCustomField
+		from ThruTextSavedReply import ThruTextSavedReply
+		from ThruTextSurvey import ThruTextSurvey
+		from ThruTextRegion import ThruTextRegion
+		lm = self.server.login_manager()
+		field = ThruTextCustomField(login_manager=lm)
+		assert field.make_new(title='Polling Location', code='poll_loc') and field.code == 'poll_loc'
+		assert not ThruTextCustomField(login_manager=lm).make_new(title='Again', code='poll_loc')
+		campaign = self.server.add('campaigns', {'name': 'fake campaign'})
+		reply = ThruTextSavedReply(login_manager=lm)
+		assert reply.make_new(title='Wrong Number', body='Sorry about that!', campaign_id=campaign['id'])
+		assert reply.campaign_id == campaign['id'] and reply.order == 0
+		assert reply.reorder(2)
+		survey = ThruTextSurvey(login_manager=lm)
+		assert survey.make_new(question='Voting?', survey_type='yes_no', survey_choices=None, campaign_id=campaign['id'])
+		assert survey.campaign_id == campaign['id'] and not survey.is_global
+		with tempfile.TemporaryDirectory() as directory:
+			regions = ThruTextRegion(login_manager=lm).new_region_list(os.path.join(directory, 'regions.cfg'))
+		assert regions['212'] == regions['new york (212)']
+		tto = ThruTextCustomField(login_manager=lm)
+		response, worked = tto.safe_request('post', url=lm.api_url + '/accounts/' + lm.account_number + '/campaigns/' + campaign['id'] + '/exports', data={'data': {'attributes': {'export_type': 'surveys'}}})
+		assert worked and tto.response_json(response)['data']['attributes']['campaign_id'] == campaign['id']
+		response, worked = tto.safe_request('get', url=lm.api_url + '/accounts/' + lm.account_number + '/campaigns/' + campaign['id'] + '/exports')
+		assert worked and len(tto.response_json(response)['data']) == 1
+
+	def test_errors_and_rate_limit(self):
+		from ThruTextCustomField import ThruTextCustomField
+		lm = self.server.login_manager()
+		lm.retry_policy.backoff_base = 0
+		tto = ThruTextCustomField(login_manager=lm)
+		self.server.fail_next(2, 503, method='get')
+		response, worked = tto.safe_request('get', url=tto.base_url)
+		assert worked and self.server.injected == 2
+		self.server.fail_next(1, 500, path='/custom_fields')
+		response, worked = tto.safe_request('get', url=tto.base_url)
+		assert not worked and response.status_code == 500
+		self.server.rate_limit = 3
+		self.server.rate_window = 0.5
+		self.server.window_count = 0
+		results = [tto.safe_request('get', url=tto.base_url, params={'n': i})[1] for i in range(5)]
+		assert all(results) and self.server.throttled >= 1
+		lm.enable_cache()
+		first, worked = tto.safe_request('get', url=tto.base_url)
+		lm.response_cache.ttl = 0
+		second, worked = tto.safe_request('get', url=tto.base_url)
+		assert worked and second.content == first.content
+
+	def test_environ(self):
+		saved = {key: os.environ.get(key) for key in self.server.environ()}
+		with FakeThruTextServer(account_number='42') as other:
+			other.set_environ()
+			lm = LoginManager()
+			assert lm.api_url == other.url
+			lm.env_login(verbose=False)
+			assert lm.account_number == '42'
+		assert {key: os.environ.get(key) for key in saved} == saved
+
+if __name__ == '__main__':
+	if '--serve' in sys.argv:
+		args = sys.argv[sys.argv.index('--serve') + 1:]
+		server = FakeThruTextServer(port=int(args[0]) if args else 8123).start()
+		for key, value in server.environ().items():
+			print('export ' + key + "='" + value + "'")
+		try:
+			server.thread.join()
+		except KeyboardInterrupt:
+			server.stop()
+	else:
+		unittest.main()
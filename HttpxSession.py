@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import requests, time
+
+try:
+	import httpx
+except ImportError:
+	httpx = None
+
+def trace_timings(timings, asynchronous=False):
+	"""
+	An httpx trace callback that adds up how long connecting (including looking up the host), tls and waiting for the response headers took into timings, as 'connect', 'tls' and 'server'.
+	asynchronous (optional) - for an httpx.AsyncClient, which wants an async callback
+	"""
+	phases = {'connect_tcp': 'connect', 'start_tls': 'tls', 'receive_response_headers': 'server'}
+	starts = {}
+	def trace(event_name, info):
+		step, _, state = event_name.rpartition('.')
+		phase = phases.get(step.rpartition('.')[2])
+		if phase is None:
+			return
+		if state == 'started':
+			starts[phase] = time.perf_counter()
+		elif phase in starts:
+			timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - starts.pop(phase)
+	if not asynchronous:
+		return trace
+	async def async_trace(event_name, info):
+		trace(event_name, info)
+	return async_trace
+
+class HttpxSession(object):
+	"""
+	Stands in for a requests.Session, but sends everything through an httpx.Client, which can speak HTTP/2. LoginManager makes one of these for its shared session when you pick transport='http2' or transport='httpx'.
+
+	Standards:
+	* safe_request shouldn't be able to tell the difference. Same methods (get, post, etc. w/ url, headers, data, params), same headers attribute, and the responses have status_code, headers, content, text and elapsed like requests' do.
+	* w/ HTTP/2, every request to a host shares one connection, however many threads are making them. pool_size only matters for HTTP/1.1.
+	* httpx's connection errors are raised as requests.exceptions.ConnectionError, and its read and write timeouts as requests.exceptions.ReadTimeout, so safe_request's retrying works the same.
+	* timeout can be a number or a (connect, read) tuple, like requests takes.
+	* Responses also have timings, a dict of how long connecting, tls and waiting for the server took (see trace_timings). safe_request passes them along to request hooks.
+	* Needs httpx, and h2 for HTTP/2 (pip install 'httpx[http2]').
+	"""
+
+	def __init__(self, *, http2=True, pool_size=10, **client_kwargs):
+		"""
+		input:
+		http2 (optional) - use HTTP/2 where the server supports it. defaults to True
+		pool_size (optional) - most connections to keep open
+		client_kwargs (optional) - passed along to httpx.Client, ie {'http1': False} to talk HTTP/2 to a plain http server that doesn't negotiate it
+		"""
+		if httpx is None:
+			raise ImportError("HttpxSession needs httpx. pip install 'httpx[http2]'")
+		limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+		self.client = httpx.Client(http2=http2, limits=limits, **client_kwargs)
+
+	@property
+	def headers(self):
+		return self.client.headers
+
+	def request(self, method, url, headers=None, data=None, params=None, timeout=None, **kwargs):
+		if isinstance(timeout, (tuple, list)):
+			kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0])
+		elif timeout is not None:
+			kwargs['timeout'] = timeout
+		timings = {}
+		kwargs['extensions'] = dict(kwargs.get('extensions') or {}, trace=trace_timings(timings))
+		try:
+			response = self.client.request(str(method).upper(), url, headers=headers, content=data, params=params, **kwargs)
+		except (httpx.ReadTimeout, httpx.WriteTimeout) as e:
+			raise requests.exceptions.ReadTimeout(repr(e)) from e
+		except httpx.TimeoutException as e:
+			raise requests.exceptions.ConnectTimeout(repr(e)) from e
+		except httpx.TransportError as e:
+			raise requests.exceptions.ConnectionError(repr(e)) from e
+		response.timings = timings
+		return response
+
+	def get(self, url, **kwargs):
+		return self.request('get', url, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request('post', url, **kwargs)
+
+	def put(self, url, **kwargs):
+		return self.request('put', url, **kwargs)
+
+	def patch(self, url, **kwargs):
+		return self.request('patch', url, **kwargs)
+
+	def delete(self, url, **kwargs):
+		return self.request('delete', url, **kwargs)
+
+	def head(self, url, **kwargs):
+		return self.request('head', url, **kwargs)
+
+	def options(self, url, **kwargs):
+		return self.request('options', url, **kwargs)
+
+	def close(self):
+		self.client.close()
+
+import unittest
+
+class TestHttpxSession(unittest.TestCase):
+
+	@unittest.skipIf(httpx is None, "needs httpx")
+	def test_looks_like_requests(self):
+		seen = []
+		def handler(request):
+			seen.append(request)
+			if request.url.path == '/down':
+				raise httpx.ConnectError('refused', request=request)
+			if request.url.path == '/slow':
+				assert request.extensions['timeout']['connect'] == 2 and request.extensions['timeout']['read'] == 5
+				raise httpx.ReadTimeout('timed out', request=request)
+			return httpx.Response(200, json={'data': {'id': 1}}, request=request)
+		session = HttpxSession(http2=False, transport=httpx.MockTransport(handler))
+		session.headers.update({'Authorization': 'Bearer token'})
+		response = session.post('https://example.com/groups', headers={'Content-Type': 'application/json'}, data=b'{}', params={'page': 2})
+		assert response.status_code == 200 and response.json()['data']['id'] == 1
+		assert seen[0].method == 'POST' and seen[0].content == b'{}'
+		assert seen[0].url.params['page'] == '2' and seen[0].headers['Authorization'] == 'Bearer token'
+		with self.assertRaises(requests.exceptions.ConnectionError):
+			session.get('https://example.com/down')
+		with self.assertRaises(requests.exceptions.ReadTimeout):
+			session.get('https://example.com/slow', timeout=(2, 5))
+		session.close()
+
+if __name__ == '__main__':
+	unittest.main()
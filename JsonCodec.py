@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import json
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+class JsonCodec(object):
+	"""
+	How request bodies get turned into json, and responses get turned back. safe_request and everything that reads a response goes through the login manager's json_codec.
+
+	Standards:
+	* Uses orjson if it's installed, since it's several times faster on big group imports and listings. Otherwise the standard library.
+	* You can plug in anything else that has dumps and loads, ie JsonCodec(backend=ujson). Make sure its loads raises a ValueError on bad json.
+	* dumps always gives back utf-8 bytes, whatever the backend.
+	* Bad json raises json.JSONDecodeError (or a subclass), whatever the backend, so callers only have one thing to catch.
+	* decode only parses a response once. The result is kept on the response, so asking again is free. Don't change what you get back, since whoever asks next gets the same thing.
+	"""
+
+	def __init__(self, backend=None):
+		"""
+		input:
+		backend (optional) - 'orjson', 'json', or a module/object w/ dumps and loads. Defaults to orjson if it's installed, json if it isn't.
+		"""
+		if backend is None:
+			backend = 'json' if orjson is None else 'orjson'
+		if backend == 'orjson' and orjson is None:
+			print("Warning: orjson isn't installed. Using json instead.")
+			backend = 'json'
+		self.backend = backend
+
+	@property
+	def name(self):
+		if isinstance(self.backend, str):
+			return self.backend
+		return getattr(self.backend, '__name__', str(self.backend))
+
+	def dumps(self, obj):
+		"""
+		obj as json encoded bytes
+		"""
+		if self.backend == 'orjson':
+			try:
+				return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+			except TypeError:
+				# something orjson won't do, like a subclass of int. json might manage it, and will say why if it can't
+				pass
+		elif self.backend != 'json':
+			encoded = self.backend.dumps(obj)
+			return encoded.encode('utf-8') if isinstance(encoded, str) else encoded
+		return json.dumps(obj).encode('utf-8')
+
+	def loads(self, content):
+		"""
+		Parses json out of str or bytes.
+		"""
+		if self.backend == 'orjson':
+			return orjson.loads(content)
+		if self.backend == 'json':
+			return json.loads(content)
+		try:
+			return self.backend.loads(content)
+		except json.JSONDecodeError:
+			raise
+		except ValueError as e:
+			raise json.JSONDecodeError(str(e), content if isinstance(content, str) else content.decode('utf-8', 'replace'), 0)
+
+	def decode(self, response):
+		"""
+		The response's body, parsed. Only parsed the first time, after that you get the same thing back.
+		"""
+		try:
+			return response.decoded_json
+		except AttributeError:
+			pass
+		decoded = self.loads(response.content)
+		response.decoded_json = decoded
+		return decoded
+
+import unittest
+from FakeSession import FakeResponse
+
+class CountingBackend(object):
+	def __init__(self):
+		self.loads_calls = 0
+	def dumps(self, obj):
+		return json.dumps(obj)
+	def loads(self, content):
+		self.loads_calls += 1
+		if content == b'oops':
+			raise ValueError('not json')
+		return json.loads(content)
+
+class TestJsonCodec(unittest.TestCase):
+
+	def test_backends_agree(self):
+		payload = {'data': {'attributes': {'name': 'café', 'import': {'csv_data': [['first', 'phone'], ['Jane', '5555555555']]}}}}
+		backends = ['json', CountingBackend()] + ([] if orjson is None else ['orjson'])
+		for backend in backends:
+			codec = JsonCodec(backend=backend)
+			encoded = codec.dumps(payload)
+			assert isinstance(encoded, bytes)
+			assert json.loads(encoded) == payload
+			assert codec.loads(encoded) == payload
+			assert codec.loads(encoded.decode('utf-8')) == payload
+
+	def test_decode_once(self):
+		backend = CountingBackend()
+		codec = JsonCodec(backend=backend)
+		response = FakeResponse(content=b'{"data": [1, 2]}')
+		assert codec.decode(response) is codec.decode(response)
+		assert backend.loads_calls == 1
+
+	def test_bad_json(self):
+		for backend in ['json', CountingBackend()] + ([] if orjson is None else ['orjson']):
+			try:
+				JsonCodec(backend=backend).decode(FakeResponse(content=b'oops'))
+				assert False
+			except json.JSONDecodeError:
+				pass
+
+if __name__ == '__main__':
+	unittest.main()
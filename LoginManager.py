@@ -2,11 +2,28 @@
 
 import getpass
 import requests
+import threading
+import weakref
+import asyncio
+from requests.adapters import HTTPAdapter
+from RetryPolicy import RetryPolicy
+from ResponseCache import ResponseCache
+from JsonCodec import JsonCodec
+from RequestMetrics import RequestMetrics
+from RateLimiter import RateLimiter
+from CircuitBreaker import CircuitBreaker
+from SingleFlight import SingleFlight
+from HttpxSession import HttpxSession
 import json
 import os
 import sys
 import random
 
+try:
+	import httpx
+except ImportError:
+	httpx = None
+
 class LoginManager(object):
 	"""
 	Class used to log into ThruText and hold on to that token, along w/ some associated information.
@@ -21,11 +38,15 @@ class LoginManager(object):
 	
 	"""
 
-	def __init__(self, *, thru_text_account_name=None, staging=None, fake=False):
+	def __init__(self, *, thru_text_account_name=None, staging=None, fake=False, pool_size=10, transport='requests', connect_timeout=10, read_timeout=120, api_url=None):
 		"""
 		A login manager remembers a token, whether or not you're in the staging environment or production, and what your account number is. All of those things are intrinsically tied to your login. Things that aren't intrinsic to your login should be handled elsewhere.
 		input:
 		thru_text_account_name (optional-ish) : name of the thru_text account to log into (ie, in elsonforemperor.thrutexttxt.io, elsonforemperor is the account name. If not specified, the value defaults to the environment variable THRU_TEXT_ACCOUNT_ID. This value needs to be specified in some way.
+		pool_size (optional) : how many connections the shared session keeps open. Raise it if you have more threads than that making requests at once.
+		transport (optional) : what the shared session sends requests w/. 'requests' (the default), 'http2' to use httpx w/ HTTP/2 so lots of threads can share one connection, 'httpx' for httpx w/o HTTP/2, or a function that takes this login manager and returns something that works like a requests.Session.
+		api_url (optional) : where the API is, ie http://127.0.0.1:8123/v1 for a FakeThruTextServer. If not specified, the value defaults to the environment variable THRU_TEXT_API_URL, and then to ThruText's production or staging API.
+		connect_timeout, read_timeout (optional) : seconds safe_request waits to connect, and then for each bit of a response, before giving up on that attempt. None waits forever. safe_request's timeout overrides them for one request.
 		"""
 		self.token = None if not fake else 'fake'
 		self.account_number = None
@@ -51,6 +72,164 @@ class LoginManager(object):
 				self.staging = True
 			else:
 				self.staging = False
+		if api_url is None:
+			api_url = os.environ.get('THRU_TEXT_API_URL')
+		# None means the real ThruText API. see the api_url property
+		self.custom_api_url = api_url
+
+		# request body compression. off unless you turn it on w/ enable_compression
+		self.request_compression = None
+		self.compression_threshold = 16 * 1024
+		self.compression_level = 6
+
+		# when and how safe_request retries. see RetryPolicy
+		self.retry_policy = RetryPolicy()
+
+		# how long each attempt gets to connect and to read the response. see request_timeout
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+
+		# how request and response bodies get turned into and out of json. see JsonCodec
+		self.json_codec = JsonCodec()
+
+		# paces requests to stay under ThruText's rate limits. off unless you turn it on w/ enable_rate_limit
+		self.rate_limiter = None
+
+		# makes identical GETs that happen at the same time share one request. set to None to turn it off
+		self.single_flight = SingleFlight()
+
+		# stops sending requests to routes that keep failing. off unless you turn it on w/ enable_circuit_breaker
+		self.circuit_breaker = None
+
+		# functions called as hook(**event) after every request safe_request makes. see notify_request for what's in event
+		self.request_hooks = []
+
+		# cache for GET requests. off unless you turn it on w/ enable_cache
+		self.response_cache = None
+
+		# the session every ThruText object using this login manager shares. made the first time someone asks for it in get_session
+		self.pool_size = pool_size
+		self.transport = transport
+		# passed along to HttpxSession (and from there httpx.Client) for the 'http2' and 'httpx' transports
+		self.transport_kwargs = {}
+		self.session = None
+		self.session_token = None
+		self.session_lock = threading.Lock()
+
+		# async_concurrency is the most requests the async_ methods will have in flight at once
+		# async_client_kwargs get passed along to httpx.AsyncClient, ie {'http2': True}
+		# each event loop gets its own client and semaphore, since they can't be shared between loops
+		self.async_concurrency = 50
+		self.async_client_kwargs = {}
+		self.async_clients = weakref.WeakKeyDictionary()
+
+	def enable_compression(self, encoding='gzip', threshold=16*1024, level=6):
+		"""
+		Compresses request bodies sent by ThruText objects using this login manager. Handy for big group imports, which are very repetitive.
+		input:
+		encoding - 'gzip' or 'deflate'. None turns compression back off.
+		threshold - bodies smaller than this many bytes aren't worth compressing and are sent as is. Streamed bodies are always compressed since we don't know how big they are.
+		level - zlib compression level, 1 (fastest) to 9 (smallest)
+		"""
+		if encoding not in [None, 'gzip', 'deflate']:
+			print("Error: don't know how to compress with " + str(encoding) + ". Use gzip or deflate.")
+			return False
+		self.request_compression = encoding
+		self.compression_threshold = threshold
+		self.compression_level = level
+		return True
+
+	@property
+	def api_url(self):
+		"""
+		The url every API url starts w/, ie https://api.relaytxt.io/v1
+		"""
+		if self.custom_api_url:
+			return str(self.custom_api_url).rstrip('/')
+		if self.staging:
+			return 'https://api.relaytxt-staging.io/v1'
+		return 'https://api.relaytxt.io/v1'
+
+	def request_timeout(self, timeout=None):
+		"""
+		The (connect, read) timeout for a request. timeout can be a number for both, a (connect, read) tuple, or None for this login manager's connect_timeout and read_timeout.
+		"""
+		if timeout is None:
+			return (self.connect_timeout, self.read_timeout)
+		if isinstance(timeout, (tuple, list)):
+			return tuple(timeout)
+		return (timeout, timeout)
+
+	def enable_cache(self, ttl=60, max_entries=1000):
+		"""
+		Caches GET responses for ThruText objects using this login manager, so calling become on the same campaign every minute doesn't download it every minute. See ResponseCache.
+		input:
+		ttl - seconds a response is used w/o asking ThruText. After that, if it had an ETag or Last-Modified, we ask ThruText whether it's changed instead of downloading it again.
+		max_entries - most responses to keep. The least recently used go first.
+		"""
+		self.response_cache = ResponseCache(ttl=ttl, max_entries=max_entries)
+		return self.response_cache
+
+	def disable_cache(self):
+		self.response_cache = None
+
+	def enable_rate_limit(self, reads_per_second=10, writes_per_second=5, read_burst=None, write_burst=None, adaptive=True):
+		"""
+		Paces every request made by ThruText objects using this login manager, from every thread, so bulk jobs don't set off 429 storms. See RateLimiter.
+		input:
+		reads_per_second, writes_per_second - the most GETs and the most POST/PATCH/DELETEs a second
+		read_burst, write_burst (optional) - how many can go at once after a quiet spell. defaults to one second's worth
+		adaptive (optional) - slow down (and speed back up) based on ThruText's rate limit headers and 429s
+		"""
+		self.rate_limiter = RateLimiter(reads_per_second=reads_per_second, writes_per_second=writes_per_second, read_burst=read_burst, write_burst=write_burst, adaptive=adaptive)
+		return self.rate_limiter
+
+	def disable_rate_limit(self):
+		self.rate_limiter = None
+
+	def enable_circuit_breaker(self, failure_threshold=5, error_rate=0.5, window=60, min_requests=10, reset_timeout=30, half_open_probes=1):
+		"""
+		Makes requests to an endpoint that keeps failing fail straight away for a while, instead of each one waiting on timeouts and retries. See CircuitBreaker.
+		input:
+		failure_threshold - failures in a row that open the circuit
+		error_rate, window, min_requests - also open it if at least min_requests requests in the last window seconds failed this often
+		reset_timeout - seconds to wait before letting half_open_probes requests through to see if it's better
+		"""
+		self.circuit_breaker = CircuitBreaker(failure_threshold=failure_threshold, error_rate=error_rate, window=window, min_requests=min_requests, reset_timeout=reset_timeout, half_open_probes=half_open_probes)
+		return self.circuit_breaker
+
+	def disable_circuit_breaker(self):
+		self.circuit_breaker = None
+
+	def add_request_hook(self, hook):
+		self.request_hooks.append(hook)
+
+	def enable_metrics(self, buckets=None):
+		"""
+		Keeps latency histograms and counts for every endpoint ThruText objects using this login manager talk to. Returns the RequestMetrics, so you can print its summary() or write_prometheus(filename).
+		"""
+		metrics = RequestMetrics(buckets=buckets)
+		self.add_request_hook(metrics)
+		return metrics
+
+	def notify_request(self, **event):
+		"""
+		Tells every request hook about a request. event has:
+		method, url, route (the url's path w/ ids taken out, see RequestMetrics.route_template)
+		status - None if we never got a response
+		retries - how many times it was retried
+		request_bytes, response_bytes - body sizes
+		connect, tls, server - seconds spent connecting (looking up the host included), on tls, and waiting for the response headers. The httpx transports ('http2' and 'httpx', and async_safe_request) tell us all three. requests only tells us server, which includes connecting. None if we don't know.
+		total - seconds from start to finish, including retries
+		cached - whether the response cache answered it
+		circuit - the route's circuit breaker state afterwards, 'closed', 'open' or 'half_open'. None if there's no circuit breaker.
+		short_circuited - whether the circuit breaker stopped it from being sent (or retried)
+		"""
+		for hook in self.request_hooks:
+			try:
+				hook(**event)
+			except Exception as e:
+				print("Warning: request hook " + str(hook) + " failed w/ " + repr(e))
 
 	def real_authenticate(self, un, pw, fatal_failure=True, verbose=True):
 		"""
@@ -67,10 +246,7 @@ class LoginManager(object):
 		# reset everything
 		self.token = None
 		self.account_number = None 
-		if self.staging:
-			auth_url = 'https://api.relaytxt-staging.io/v1/sessions'
-		else:
-			auth_url = 'https://api.relaytxt.io/v1/sessions'
+		auth_url = self.api_url + '/sessions'
 
 		# do the request
 		with requests.Session() as s:
@@ -79,7 +255,7 @@ class LoginManager(object):
 				'Content-Type' : 'application/vnd.api+json',
 			})
 			payload = {"data": {"attributes": {"email": un, "password": pw}}}
-			login_response = s.post(url=auth_url, data=json.dumps(payload), headers={})
+			login_response = s.post(url=auth_url, data=self.json_codec.dumps(payload), headers={}, timeout=self.request_timeout())
 		self.num_attempts += 1
 
 		# how'd it go?
@@ -96,7 +272,7 @@ class LoginManager(object):
 			print("Successfully authorized!")
 
 		# if we're here, it must have worked. get the relevant info
-		response_dict = json.loads(login_response.content)
+		response_dict = self.json_codec.decode(login_response)
 		try:
 			for incl in response_dict['included']:
 				if incl['type'] == 'account':
@@ -171,9 +347,9 @@ class LoginManager(object):
 			print("ERROR: missing method for default login " + str(self.default_login_method) + ".")
 			raise
 
-	def create_session(self, login_method=None, fatal_failure=False, redo=False):
+	def ensure_logged_in(self, login_method=None, fatal_failure=False, redo=False):
 		"""
-		Creates a session based on this login manager
+		Logs in w/ login_method (or the default one) if we haven't yet, or if redo is set.
 		"""
 		if self.token is None or redo:
 			if login_method is None:
@@ -184,13 +360,115 @@ class LoginManager(object):
 				except AttributeError:
 					print("ERROR: missing method for login " + str(login_method) + ".")
 					raise
-		session = requests.Session()
-		session.headers.update({
+
+	def session_headers(self):
+		return {
 			'Accept':'application/vnd.api+json',
+			'Accept-Encoding':'gzip, deflate',
 			'Content-Type' : 'application/vnd.api+json',
 			'Authorization' : 'Token token="' + str(self.token) + '"',
-		})
+		}
+
+	def create_session(self, login_method=None, fatal_failure=False, redo=False):
+		"""
+		Creates a new session based on this login manager. It's yours, so close it when you're done.
+		Most of the time you want get_session instead, which hands out the one session this login manager shares.
+		"""
+		self.ensure_logged_in(login_method=login_method, fatal_failure=fatal_failure, redo=redo)
+		session = requests.Session()
+		session.headers.update(self.session_headers())
+		return session
+
+	def mount_adapters(self, session):
+		"""
+		Gives session a connection pool w/ room for pool_size connections. Closes the pools it replaces, so their connections don't hang around.
+		"""
+		replaced = {id(a): a for a in [session.adapters.get('https://'), session.adapters.get('http://')] if a is not None}
+		adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+		session.mount('https://', adapter)
+		session.mount('http://', adapter)
+		for old_adapter in replaced.values():
+			old_adapter.close()
+
+	def get_session(self, login_method=None, fatal_failure=False, redo=False):
+		"""
+		The session shared by everything using this login manager. It's made the first time you ask for it, and keeps up to pool_size connections open so they can be reused.
+		Safe to use from multiple threads. If you log in again, the shared session switches over to the new token.
+		"""
+		self.ensure_logged_in(login_method=login_method, fatal_failure=fatal_failure, redo=redo)
+		with self.session_lock:
+			if self.session is None:
+				self.session = self.new_transport_session()
+			if self.session_token != self.token:
+				self.session.headers.update(self.session_headers())
+				self.session_token = self.token
+			return self.session
+
+	def new_transport_session(self):
+		"""
+		Makes the shared session w/ whatever transport says. If it can't (ie httpx isn't installed), falls back to requests.
+		"""
+		if callable(self.transport):
+			return self.transport(self)
+		if self.transport in ['http2', 'httpx']:
+			try:
+				return HttpxSession(http2=self.transport == 'http2', pool_size=self.pool_size, **self.transport_kwargs)
+			except ImportError as e:
+				print("Warning: can't use the " + str(self.transport) + " transport (" + str(e) + "). Using requests instead.")
+		elif self.transport != 'requests':
+			print("Warning: don't know the transport " + str(self.transport) + ". Using requests instead.")
+		session = requests.Session()
+		self.mount_adapters(session)
 		return session
+
+	def ensure_pool_size(self, pool_size):
+		"""
+		Makes sure the shared session can keep at least pool_size connections open, for when you're about to use that many threads.
+		"""
+		with self.session_lock:
+			if pool_size <= self.pool_size:
+				return
+			self.pool_size = pool_size
+			# an HttpxSession can't change its pool, but w/ HTTP/2 it doesn't need to
+			if isinstance(self.session, requests.Session):
+				self.mount_adapters(self.session)
+
+	def close(self):
+		"""
+		Closes the shared session's connections. It's fine to keep using it afterwards, it'll just have to reconnect.
+		"""
+		with self.session_lock:
+			if self.session is not None:
+				self.session.close()
+
+	def get_async_client(self):
+		"""
+		For use inside a running event loop. Returns (client, semaphore): the httpx.AsyncClient shared by every async_ request in this loop, and the semaphore that keeps them to async_concurrency at a time.
+		Returns (None, semaphore) if httpx isn't installed. The async_ methods then run the blocking versions in threads instead.
+		"""
+		loop = asyncio.get_running_loop()
+		if loop not in self.async_clients:
+			self.ensure_logged_in()
+			semaphore = asyncio.Semaphore(self.async_concurrency)
+			if httpx is None:
+				client = None
+			else:
+				limits = httpx.Limits(max_connections=self.async_concurrency, max_keepalive_connections=self.async_concurrency)
+				client = httpx.AsyncClient(headers=self.session_headers(), limits=limits, **self.async_client_kwargs)
+			self.async_clients[loop] = (client, semaphore, self.token)
+		client, semaphore, token = self.async_clients[loop]
+		if client is not None and token != self.token:
+			client.headers.update(self.session_headers())
+			self.async_clients[loop] = (client, semaphore, self.token)
+		return client, semaphore
+
+	async def aclose(self):
+		"""
+		Closes the async client for the running event loop. Do this before the loop ends, ie at the bottom of the coroutine you gave asyncio.run.
+		"""
+		client, semaphore, token = self.async_clients.pop(asyncio.get_running_loop(), (None, None, None))
+		if client is not None:
+			await client.aclose()
 		
 	def prove_token_works(self):
 		"""
@@ -198,11 +476,8 @@ class LoginManager(object):
 		"""
 		try:
 			s = self.create_session()
-			if self.staging:
-				test_url = 'https://api.relaytxt-staging.io/v1/accounts/'+str(self.account_number)+'/campaigns'
-			else:
-				test_url = 'https://api.relaytxt.io/v1/accounts/'+str(self.account_number)+'/campaigns'
-			proof_response = s.get(url=test_url, headers={})
+			test_url = self.api_url + '/accounts/'+str(self.account_number)+'/campaigns'
+			proof_response = s.get(url=test_url, headers={}, timeout=self.request_timeout())
 		finally:
 			s.close()
 		return proof_response.status_code >= 200 and proof_response.status_code < 300
@@ -213,8 +488,24 @@ import unittest
 class TestLoginMethod(unittest.TestCase):
 	"""
 	Suite of tests a log in method has to pass. If you add a new log in method, create a class that inherits from this one to test it.
+	Set the environment variable THRU_TEXT_OFFLINE to run against a FakeThruTextServer instead of ThruText.
 	"""
 
+	fake_server = None
+
+	@classmethod
+	def setUpClass(cls):
+		super(TestLoginMethod, cls).setUpClass()
+		# FakeThruText needs LoginManager, so it can't be imported until now
+		from FakeThruText import FakeThruTextServer
+		cls.fake_server = FakeThruTextServer.for_offline_tests()
+
+	@classmethod
+	def tearDownClass(cls):
+		super(TestLoginMethod, cls).tearDownClass()
+		if cls.fake_server is not None:
+			cls.fake_server.stop()
+
 	def create_successful_login(self, lm, fatal_failure, redo):
 		"""
 		Successfully logs in, or prompts the user to successfully log in.
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import asyncio, threading, time
+
+class TokenBucket(object):
+	"""
+	rate tokens a second, up to capacity saved up. Taking a token when there aren't any means waiting for one.
+	"""
+
+	def __init__(self, rate, capacity=None):
+		self.max_rate = float(rate)
+		self.rate = float(rate)
+		self.capacity = float(capacity) if capacity is not None else max(1.0, float(rate))
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		# nobody gets a token before this, ie because ThruText said we're out until the window resets
+		self.blocked_until = 0.0
+		self.lock = threading.Lock()
+
+	def refill(self, now):
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def take(self):
+		"""
+		Takes a token if there is one. returns how long to wait before trying again, or 0 if you got one.
+		"""
+		with self.lock:
+			now = time.monotonic()
+			if now < self.blocked_until:
+				return self.blocked_until - now
+			self.refill(now)
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return 0.0
+			return (1 - self.tokens) / self.rate
+
+	def acquire(self):
+		"""
+		Waits for a token. returns how long we waited.
+		"""
+		waited = 0.0
+		while True:
+			delay = self.take()
+			if delay <= 0:
+				return waited
+			time.sleep(delay)
+			waited += delay
+
+	async def async_acquire(self):
+		waited = 0.0
+		while True:
+			delay = self.take()
+			if delay <= 0:
+				return waited
+			await asyncio.sleep(delay)
+			waited += delay
+
+class RateLimiter(object):
+	"""
+	Paces the requests safe_request makes so we stay under ThruText's rate limits, instead of finding them w/ a pile of 429s. Turn it on w/ LoginManager.enable_rate_limit.
+
+	Standards:
+	* One limiter per login manager, so it's per account and shared by every object and thread using that login.
+	* Reads (get, head, options) and writes (everything else) have separate buckets.
+	* Every attempt takes a token, retries included.
+	* If ThruText sends rate limit headers (X-RateLimit-Limit/Remaining/Reset or RateLimit-Limit/Remaining/Reset), we use them: never more tokens than it says we have left, none at all until the reset if it says we're out, and no faster than what's left spread over the time until the reset (or limit per reset, if it doesn't say what's left).
+	* A 429 halves the rate. After that, each successful request nudges it back up by recovery, to no more than what you asked for.
+	"""
+
+	read_methods = {'get', 'head', 'options'}
+
+	def __init__(self, *, reads_per_second=10, writes_per_second=5, read_burst=None, write_burst=None, adaptive=True, min_rate=0.1, recovery=0.05):
+		"""
+		input:
+		reads_per_second, writes_per_second - the most we'll ever send
+		read_burst, write_burst (optional) - how many can go at once after a quiet spell. defaults to one second's worth
+		adaptive (optional) - tune the rates from rate limit headers and 429s. defaults to True
+		min_rate (optional) - a 429 never slows us down below this many a second
+		recovery (optional) - fraction of the max rate to add back after each successful request
+		"""
+		self.buckets = {
+			'read': TokenBucket(reads_per_second, read_burst),
+			'write': TokenBucket(writes_per_second, write_burst),
+		}
+		self.adaptive = adaptive
+		self.min_rate = min_rate
+		self.recovery = recovery
+		self.throttled = 0
+
+	def bucket(self, method):
+		return self.buckets['read' if str(method).lower() in self.read_methods else 'write']
+
+	def acquire(self, method):
+		return self.bucket(method).acquire()
+
+	async def async_acquire(self, method):
+		return await self.bucket(method).async_acquire()
+
+	def header(self, response, name):
+		for prefix in ['X-RateLimit-', 'RateLimit-']:
+			value = response.headers.get(prefix + name)
+			if value is not None:
+				try:
+					return float(value)
+				except ValueError:
+					return None
+		return None
+
+	def observe(self, method, response):
+		"""
+		Tunes the bucket for method based on response.
+		"""
+		if not self.adaptive or response is None:
+			return
+		bucket = self.bucket(method)
+		limit = self.header(response, 'Limit')
+		remaining = self.header(response, 'Remaining')
+		reset = self.header(response, 'Reset')
+		if reset is not None and reset > 1e9:
+			# an epoch time instead of seconds from now
+			reset = max(0.0, reset - time.time())
+		with bucket.lock:
+			now = time.monotonic()
+			bucket.refill(now)
+			if response.status_code == 429:
+				self.throttled += 1
+				bucket.rate = max(self.min_rate, bucket.rate / 2)
+				bucket.tokens = 0.0
+			elif response.status_code < 400:
+				bucket.rate = min(bucket.max_rate, bucket.rate + bucket.max_rate * self.recovery)
+			if reset is not None and reset > 0:
+				# reset is how long until the window starts over, not how long the window is, so pace w/ what's left of it
+				allowed = remaining if remaining is not None else limit
+				if allowed is not None:
+					bucket.rate = max(self.min_rate, min(bucket.rate, allowed / reset))
+			if remaining is not None:
+				bucket.tokens = min(bucket.tokens, remaining)
+				if remaining < 1 and reset is not None:
+					bucket.blocked_until = max(bucket.blocked_until, now + reset)
+
+import unittest
+from FakeSession import FakeResponse
+
+class TestRateLimiter(unittest.TestCase):
+
+	def test_bucket(self):
+		bucket = TokenBucket(rate=100, capacity=2)
+		assert bucket.take() == 0 and bucket.take() == 0
+		assert 0 < bucket.take() <= 0.01
+		start = time.monotonic()
+		for i in range(5):
+			bucket.acquire()
+		assert 0.03 <= time.monotonic() - start < 0.5
+
+	def test_threads_share(self):
+		limiter = RateLimiter(reads_per_second=200, read_burst=1)
+		start = time.monotonic()
+		threads = [threading.Thread(target=lambda: [limiter.acquire('get') for i in range(5)]) for t in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		assert time.monotonic() - start >= 19 / 200.0
+
+	def test_read_and_write(self):
+		limiter = RateLimiter(reads_per_second=1, writes_per_second=1)
+		assert limiter.bucket('GET') is limiter.buckets['read']
+		assert limiter.bucket('patch') is limiter.buckets['write']
+		limiter.acquire('post')
+		assert limiter.bucket('get').take() == 0
+
+	def test_adapts(self):
+		limiter = RateLimiter(reads_per_second=10, min_rate=1)
+		read = limiter.buckets['read']
+		limiter.observe('get', FakeResponse(429))
+		assert read.rate == 5 and read.tokens == 0
+		limiter.observe('get', FakeResponse(200))
+		assert read.rate == 5.5
+		limiter.observe('get', FakeResponse(200, {'X-RateLimit-Limit': '60', 'X-RateLimit-Reset': '30'}))
+		assert read.rate == 2
+		limiter.observe('get', FakeResponse(200, {'X-RateLimit-Limit': '60', 'X-RateLimit-Remaining': '3', 'X-RateLimit-Reset': '2'}))
+		assert read.rate == 1.5 and read.tokens <= 3
+		limiter.observe('get', FakeResponse(200, {'RateLimit-Remaining': '0', 'RateLimit-Reset': '5'}))
+		assert read.take() > 4
+
+	def test_paces_w_remaining(self):
+		limiter = RateLimiter(reads_per_second=50, min_rate=0.1)
+		read = limiter.buckets['read']
+		# most of the window's quota is already used, so the 20 left have to last the 10 seconds until it resets
+		limiter.observe('get', FakeResponse(200, {'X-RateLimit-Limit': '1000', 'X-RateLimit-Remaining': '20', 'X-RateLimit-Reset': '10'}))
+		assert read.rate == 2
+
+if __name__ == '__main__':
+	unittest.main()
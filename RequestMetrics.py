@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import os, re, threading
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+# path segments that are ids: all digits, uuids, or long hex strings
+id_segment = re.compile(r'^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{24,})$')
+
+def route_template(url):
+	"""
+	The path of url w/ the ids taken out, so every group's archive url counts as the same endpoint.
+	https://api.relaytxt.io/v1/accounts/1234/groups/5/archive?x=1 -> /v1/accounts/:id/groups/:id/archive
+	"""
+	path = urlsplit(str(url)).path
+	return '/'.join(':id' if id_segment.match(segment) else segment for segment in path.split('/')) or '/'
+
+class RouteStats(object):
+	"""
+	Everything we know about the requests made to one method and route.
+	"""
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.bucket_counts = [0] * (len(buckets) + 1)
+		self.count = 0
+		self.total_seconds = 0.0
+		self.max_seconds = 0.0
+		self.statuses = {}
+		self.retries = 0
+		self.request_bytes = 0
+		self.response_bytes = 0
+		self.cached = 0
+		self.short_circuited = 0
+		self.circuit = None
+		self.phase_seconds = {}
+
+	def add(self, event):
+		total = event.get('total') or 0.0
+		self.count += 1
+		self.total_seconds += total
+		self.max_seconds = max(self.max_seconds, total)
+		self.bucket_counts[bisect_left(self.buckets, total)] += 1
+		status = event.get('status')
+		status = 'error' if status is None else str(status)
+		self.statuses[status] = self.statuses.get(status, 0) + 1
+		self.retries += event.get('retries') or 0
+		self.request_bytes += event.get('request_bytes') or 0
+		self.response_bytes += event.get('response_bytes') or 0
+		if event.get('cached'):
+			self.cached += 1
+		if event.get('short_circuited'):
+			self.short_circuited += 1
+		if event.get('circuit') is not None:
+			self.circuit = event['circuit']
+		for phase in ['connect', 'tls', 'server']:
+			if event.get(phase) is not None:
+				self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + event[phase]
+
+	@property
+	def errors(self):
+		return sum(count for status, count in self.statuses.items() if status == 'error' or int(status) >= 400)
+
+	def percentile(self, fraction):
+		"""
+		Estimates a latency percentile from the histogram, assuming requests are spread evenly within each bucket.
+		"""
+		if self.count == 0:
+			return None
+		rank = fraction * self.count
+		seen = 0
+		for index, count in enumerate(self.bucket_counts):
+			if count and seen + count >= rank:
+				low = self.buckets[index - 1] if index > 0 else 0.0
+				high = self.buckets[index] if index < len(self.buckets) else self.max_seconds
+				return min(self.max_seconds, low + (high - low) * (rank - seen) / count)
+			seen += count
+		return self.max_seconds
+
+class RequestMetrics(object):
+	"""
+	Request hook that keeps latency histograms and counts for every endpoint in memory. Turn it on w/ LoginManager.enable_metrics, or add one yourself w/ LoginManager.add_request_hook.
+
+	Standards:
+	* Requests are grouped by method and route_template, so ids don't make every url its own endpoint.
+	* Latency goes into fixed buckets like a prometheus histogram. Percentiles in summary are estimated from them.
+	* Connection failures count under the status 'error'. Anything 400 and up counts as an error too.
+	* Safe to share between threads.
+	"""
+
+	default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+	def __init__(self, buckets=None):
+		self.buckets = tuple(sorted(buckets)) if buckets is not None else self.default_buckets
+		self.routes = {}
+		self.lock = threading.Lock()
+
+	def __call__(self, **event):
+		key = (str(event.get('method')).lower(), event.get('route'))
+		with self.lock:
+			if key not in self.routes:
+				self.routes[key] = RouteStats(self.buckets)
+			self.routes[key].add(event)
+
+	def reset(self):
+		with self.lock:
+			self.routes = {}
+
+	def summary(self):
+		"""
+		A table of every endpoint, slowest total time first.
+		"""
+		with self.lock:
+			rows = sorted(self.routes.items(), key=lambda item: -item[1].total_seconds)
+			lines = ['{:<7} {:<50} {:>7} {:>6} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9} {:>12} {:>9}'.format('method', 'route', 'count', 'errors', 'retries', 'cached', 'mean (s)', 'p50 (s)', 'p95 (s)', 'max (s)', 'bytes in', 'circuit')]
+			for (method, route), stats in rows:
+				lines.append('{:<7} {:<50} {:>7} {:>6} {:>7} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>12} {:>9}'.format(
+					method, str(route), stats.count, stats.errors, stats.retries, stats.cached, stats.total_seconds / stats.count,
+					stats.percentile(0.5), stats.percentile(0.95), stats.max_seconds, stats.response_bytes, str(stats.circuit or '')))
+		return '\n'.join(lines)
+
+	def prometheus_text(self, prefix='thru_text'):
+		"""
+		Everything in the prometheus text exposition format.
+		"""
+		def labels(method, route, **more):
+			pairs = [('method', method), ('route', route)] + sorted(more.items())
+			return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for name, value in pairs) + '}'
+		lines = [
+			'# HELP ' + prefix + '_request_duration_seconds How long requests took, including retries.',
+			'# TYPE ' + prefix + '_request_duration_seconds histogram',
+		]
+		with self.lock:
+			routes = sorted(self.routes.items(), key=lambda item: (item[0][0], str(item[0][1])))
+			for (method, route), stats in routes:
+				cumulative = 0
+				for bound, count in zip(list(self.buckets) + ['+Inf'], stats.bucket_counts):
+					cumulative += count
+					lines.append(prefix + '_request_duration_seconds_bucket' + labels(method, route, le=bound) + ' ' + str(cumulative))
+				lines.append(prefix + '_request_duration_seconds_sum' + labels(method, route) + ' ' + repr(stats.total_seconds))
+				lines.append(prefix + '_request_duration_seconds_count' + labels(method, route) + ' ' + str(stats.count))
+			for name, kind, help_text, value in [
+				('requests_total', 'counter', 'Requests by status. Connection failures are status="error".', None),
+				('request_retries_total', 'counter', 'Retries made by safe_request.', 'retries'),
+				('request_cached_total', 'counter', 'Requests answered by the response cache.', 'cached'),
+				('request_short_circuited_total', 'counter', 'Requests the circuit breaker stopped from being sent or retried.', 'short_circuited'),
+				('circuit_state', 'gauge', 'The route\'s circuit breaker: 0 closed, 1 half open, 2 open.', None),
+				('request_bytes_total', 'counter', 'Request body bytes sent.', 'request_bytes'),
+				('response_bytes_total', 'counter', 'Response body bytes received.', 'response_bytes'),
+				('request_phase_seconds_total', 'counter', 'Time spent in each phase of a request, where the transport tells us.', None),
+			]:
+				lines.append('# HELP ' + prefix + '_' + name + ' ' + help_text)
+				lines.append('# TYPE ' + prefix + '_' + name + ' ' + kind)
+				for (method, route), stats in routes:
+					if name == 'requests_total':
+						for status, count in sorted(stats.statuses.items()):
+							lines.append(prefix + '_' + name + labels(method, route, status=status) + ' ' + str(count))
+					elif name == 'circuit_state':
+						if stats.circuit is not None:
+							lines.append(prefix + '_' + name + labels(method, route) + ' ' + str(['closed', 'half_open', 'open'].index(stats.circuit)))
+					elif name == 'request_phase_seconds_total':
+						for phase, seconds in sorted(stats.phase_seconds.items()):
+							lines.append(prefix + '_' + name + labels(method, route, phase=phase) + ' ' + repr(seconds))
+					else:
+						lines.append(prefix + '_' + name + labels(method, route) + ' ' + str(getattr(stats, value)))
+		return '\n'.join(lines) + '\n'
+
+	def write_prometheus(self, filename, prefix='thru_text'):
+		"""
+		Writes prometheus_text to filename, ie for node_exporter's textfile collector. Writes to a temporary file first so nothing reads it half done.
+		"""
+		temporary = str(filename) + '.tmp'
+		with open(temporary, 'w') as ofile:
+			ofile.write(self.prometheus_text(prefix=prefix))
+		os.replace(temporary, filename)
+
+import unittest
+
+class TestRequestMetrics(unittest.TestCase):
+
+	def event(self, total, status=200, route='/v1/accounts/:id/groups', **more):
+		return dict({'method': 'get', 'route': route, 'url': None, 'status': status, 'retries': 0, 'request_bytes': 0, 'response_bytes': 100, 'connect': None, 'tls': None, 'server': None, 'total': total, 'cached': False}, **more)
+
+	def test_route_template(self):
+		assert route_template('https://api.relaytxt.io/v1/accounts/0000000001/groups/5/archive?x=1') == '/v1/accounts/:id/groups/:id/archive'
+		assert route_template('https://api.relaytxt.io/v1/countries') == '/v1/countries'
+		assert route_template('https://example.com/things/123e4567-e89b-12d3-a456-426614174000') == '/things/:id'
+
+	def test_summary(self):
+		metrics = RequestMetrics()
+		for total in [0.01, 0.02, 0.03, 0.2]:
+			metrics(**self.event(total))
+		metrics(**self.event(1.5, status=None, retries=2))
+		metrics(**self.event(0.1, method='post', status=422, route='/v1/accounts/:id/campaigns', server=0.09))
+		stats = metrics.routes[('get', '/v1/accounts/:id/groups')]
+		assert stats.count == 5 and stats.errors == 1 and stats.retries == 2
+		assert 0.01 <= stats.percentile(0.5) <= 0.05
+		assert stats.percentile(1.0) == 1.5
+		summary = metrics.summary().split('\n')
+		assert len(summary) == 3
+		assert summary[1].startswith('get ')
+
+	def test_prometheus(self):
+		metrics = RequestMetrics(buckets=[0.1, 1])
+		metrics(**self.event(0.05))
+		metrics(**self.event(0.5, server=0.4))
+		metrics(**self.event(0.5, status=None, circuit='open', short_circuited=True))
+		text = metrics.prometheus_text()
+		assert 'thru_text_request_duration_seconds_bucket{method="get",route="/v1/accounts/:id/groups",le="0.1"} 1' in text
+		assert 'thru_text_request_duration_seconds_bucket{method="get",route="/v1/accounts/:id/groups",le="+Inf"} 3' in text
+		assert 'thru_text_requests_total{method="get",route="/v1/accounts/:id/groups",status="200"} 2' in text
+		assert 'thru_text_request_short_circuited_total{method="get",route="/v1/accounts/:id/groups"} 1' in text
+		assert 'thru_text_circuit_state{method="get",route="/v1/accounts/:id/groups"} 2' in text
+		assert 'thru_text_request_phase_seconds_total{method="get",route="/v1/accounts/:id/groups",phase="server"} 0.4' in text
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+import threading, time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+class CachedResponse(object):
+	"""
+	A response we've held on to, along w/ what we need to ask ThruText whether it's changed.
+	"""
+
+	def __init__(self, response, expires):
+		self.response = response
+		self.expires = expires
+		self.etag = response.headers.get('ETag')
+		self.last_modified = response.headers.get('Last-Modified')
+
+	def is_fresh(self):
+		return time.monotonic() < self.expires
+
+	def can_revalidate(self):
+		return self.etag is not None or self.last_modified is not None
+
+	def conditional_headers(self):
+		headers = {}
+		if self.etag is not None:
+			headers['If-None-Match'] = self.etag
+		if self.last_modified is not None:
+			headers['If-Modified-Since'] = self.last_modified
+		return headers
+
+class ResponseCache(object):
+	"""
+	Opt-in cache for GET requests made through safe_request. Turn it on w/ LoginManager.enable_cache.
+
+	Standards:
+	* Responses are kept by url, query parameters and login token, for ttl seconds. After that they're stale.
+	* Stale responses w/ an ETag or Last-Modified header are kept, and the next GET for them asks ThruText if they've changed (If-None-Match/If-Modified-Since). A 304 means we reuse what we have for another ttl seconds.
+	* No more than max_entries responses are kept. The least recently used go first.
+	* A POST, PUT, PATCH or DELETE to a url forgets everything cached for that url, the urls above it, and the urls below it. Archiving groups/5 forgets groups/5 and the groups listing.
+	* Only 200 responses are kept, and never ones that say Cache-Control: no-store
+	"""
+
+	def __init__(self, ttl=60, max_entries=1000):
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.revalidations = 0
+		self.misses = 0
+
+	def key(self, url, params=None, token=None):
+		if params:
+			params = tuple(sorted((str(k), str(v)) for k, v in params.items()))
+		else:
+			params = ()
+		return (str(url), params, token)
+
+	def lookup(self, key):
+		"""
+		The CachedResponse for key, fresh or not, or None if we don't have one (or it's stale and can't be revalidated).
+		"""
+		with self.lock:
+			cached = self.entries.get(key)
+			if cached is None:
+				self.misses += 1
+				return None
+			if not cached.is_fresh() and not cached.can_revalidate():
+				del self.entries[key]
+				self.misses += 1
+				return None
+			self.entries.move_to_end(key)
+			if cached.is_fresh():
+				self.hits += 1
+			return cached
+
+	def store(self, key, response):
+		if response.status_code != 200 or 'no-store' in response.headers.get('Cache-Control', ''):
+			return
+		with self.lock:
+			self.entries[key] = CachedResponse(response, time.monotonic() + self.ttl)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+
+	def revalidated(self, key, cached):
+		"""
+		ThruText said cached hasn't changed. Good for another ttl seconds.
+		"""
+		with self.lock:
+			self.revalidations += 1
+			cached.expires = time.monotonic() + self.ttl
+			self.entries[key] = cached
+			self.entries.move_to_end(key)
+
+	def after_request(self, method, url, key, cached, response):
+		"""
+		Updates the cache w/ how a request went. returns the response the caller should use, which is the cached one if ThruText said 304.
+		"""
+		if str(method).lower() != 'get':
+			# even if we never heard back, the change might have happened
+			self.invalidate(url)
+			return response
+		if response is None:
+			return response
+		if response.status_code == 304 and cached is not None:
+			self.revalidated(key, cached)
+			return cached.response
+		self.store(key, response)
+		return response
+
+	def related(self, path, other_path):
+		"""
+		Whether the paths are the same, or one is inside the other. Only whole segments count, so groups/5 isn't related to groups/50.
+		"""
+		return path == other_path or other_path.startswith(path + '/') or path.startswith(other_path + '/')
+
+	def invalidate(self, url):
+		"""
+		Forgets everything cached for url, the urls above it, and the urls below it.
+		"""
+		target = urlsplit(str(url))
+		target_path = target.path.rstrip('/')
+		with self.lock:
+			for key in list(self.entries.keys()):
+				cached_url = urlsplit(key[0])
+				if cached_url.netloc == target.netloc and self.related(cached_url.path.rstrip('/'), target_path):
+					del self.entries[key]
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+import unittest
+from FakeSession import FakeResponse
+
+class TestResponseCache(unittest.TestCase):
+
+	def test_fresh_and_stale(self):
+		cache = ResponseCache(ttl=0.05)
+		key = cache.key('https://api.relaytxt.io/v1/groups/5', {'include': 'campaigns'}, 'token')
+		plain = FakeResponse()
+		cache.store(key, plain)
+		assert cache.lookup(key).response is plain
+		assert cache.lookup(cache.key('https://api.relaytxt.io/v1/groups/5', None, 'token')) is None
+		time.sleep(0.06)
+		assert cache.lookup(key) is None
+
+		tagged = FakeResponse(headers={'ETag': '"abc"'})
+		cache.store(key, tagged)
+		time.sleep(0.06)
+		cached = cache.lookup(key)
+		assert not cached.is_fresh()
+		assert cached.conditional_headers() == {'If-None-Match': '"abc"'}
+		assert cache.after_request('get', 'https://api.relaytxt.io/v1/groups/5', key, cached, FakeResponse(304)) is tagged
+		assert cache.lookup(key).is_fresh()
+
+	def test_only_keeps_200(self):
+		cache = ResponseCache()
+		for response in [FakeResponse(404), FakeResponse(200, {'Cache-Control': 'no-store'})]:
+			cache.store('key', response)
+			assert cache.lookup('key') is None
+
+	def test_lru(self):
+		cache = ResponseCache(max_entries=2)
+		for key in ['a', 'b']:
+			cache.store(key, FakeResponse())
+		cache.lookup('a')
+		cache.store('c', FakeResponse())
+		assert list(cache.entries.keys()) == ['a', 'c']
+
+	def test_invalidate(self):
+		cache = ResponseCache()
+		base = 'https://api.relaytxt.io/v1/accounts/1/'
+		urls = ['groups', 'groups/5', 'groups/50', 'campaigns', 'groups/5/imports']
+		for url in urls:
+			cache.store(cache.key(base + url), FakeResponse())
+		cache.after_request('post', base + 'groups/5/archive', None, None, None)
+		assert sorted(key[0][len(base):] for key in cache.entries) == ['campaigns', 'groups/5/imports', 'groups/50']
+		cache.invalidate(base + 'groups')
+		assert sorted(key[0][len(base):] for key in cache.entries) == ['campaigns']
+
+if __name__ == '__main__':
+	unittest.main()
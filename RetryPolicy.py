@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import random, time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+class RetryPolicy(object):
+	"""
+	Decides when safe_request tries a request again, and how long it waits first.
+
+	Standards:
+	* Responses w/ a status in retry_statuses are retried, but only for idempotent methods (see retry_methods). A POST that got a 503 might have made a group anyway.
+	* Connection errors are retried for every method unless you turn off retry_all_connection_errors. That's how safe_request has always worked.
+	* Errors after the request went out (ie read timeouts) are only retried for idempotent methods, since the server might have done it.
+	* Waits are exponential w/ full jitter: a random amount between 0 and backoff_base * 2^(attempt-1), capped at backoff_max.
+	* A Retry-After header beats the backoff, up to max_retry_after seconds.
+	* Every retry is reported to the functions in retry_hooks before we wait.
+	* If there's a Deadline and the wait wouldn't leave time for another attempt, there's no retry.
+	"""
+
+	def __init__(self, *, max_attempts=3, retry_statuses=None, retry_methods=None, retry_all_connection_errors=True, backoff_base=0.5, backoff_max=30, respect_retry_after=True, max_retry_after=120):
+		"""
+		input:
+		max_attempts (optional) - most times to send a request, counting the first one
+		retry_statuses (optional) - status codes worth trying again. defaults to 429, 502, 503 and 504
+		retry_methods (optional) - methods it's safe to send twice. defaults to get, head, options, put and delete
+		"""
+		self.max_attempts = max_attempts
+		self.retry_statuses = set(retry_statuses) if retry_statuses is not None else {429, 502, 503, 504}
+		self.retry_methods = set(m.lower() for m in retry_methods) if retry_methods is not None else {'get', 'head', 'options', 'put', 'delete'}
+		self.retry_all_connection_errors = retry_all_connection_errors
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+		self.respect_retry_after = respect_retry_after
+		self.max_retry_after = max_retry_after
+		# functions called as hook(method=, url=, attempt=, delay=, reason=) every time a request is about to be retried
+		self.retry_hooks = []
+
+	def add_hook(self, hook):
+		self.retry_hooks.append(hook)
+
+	def is_idempotent(self, method):
+		return str(method).lower() in self.retry_methods
+
+	def should_retry(self, method, attempt, *, response=None, error=None, max_attempts=None, sent=False):
+		"""
+		Whether to try again after attempt number attempt (starting at 1) got response or raised error. sent is whether error happened after the request went out.
+		"""
+		if max_attempts is None:
+			max_attempts = self.max_attempts
+		if attempt >= max_attempts:
+			return False
+		if error is not None:
+			if sent:
+				return self.is_idempotent(method)
+			return self.retry_all_connection_errors or self.is_idempotent(method)
+		if response is None:
+			return False
+		return response.status_code in self.retry_statuses and self.is_idempotent(method)
+
+	def retry_after(self, response):
+		"""
+		Seconds the server asked us to wait in its Retry-After header, or None if it didn't say (or said something we can't read).
+		"""
+		if response is None:
+			return None
+		value = response.headers.get('Retry-After')
+		if value is None:
+			return None
+		try:
+			return max(0.0, float(value))
+		except ValueError:
+			pass
+		try:
+			when = parsedate_to_datetime(value)
+		except (TypeError, ValueError, IndexError):
+			return None
+		if when.tzinfo is None:
+			when = when.replace(tzinfo=timezone.utc)
+		return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+	def backoff(self, attempt):
+		"""
+		Full jitter: anywhere from 0 to the exponential backoff for this attempt.
+		"""
+		return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+	def delay(self, attempt, response=None):
+		"""
+		How long to wait before the attempt after attempt number attempt.
+		"""
+		if self.respect_retry_after:
+			retry_after = self.retry_after(response)
+			if retry_after is not None:
+				return min(retry_after, self.max_retry_after)
+		return self.backoff(attempt)
+
+	def notify_retry(self, *, method, url, attempt, delay, reason):
+		for hook in self.retry_hooks:
+			try:
+				hook(method=method, url=url, attempt=attempt, delay=delay, reason=reason)
+			except Exception as e:
+				print("Warning: retry hook " + str(hook) + " failed w/ " + repr(e))
+
+	def start_retry(self, *, method, url, attempt, reason, response=None, deadline=None):
+		"""
+		Reports the retry to the hooks and returns how long to wait before trying again. Use this if you're going to do the waiting yourself, ie w/ asyncio.sleep.
+		Returns None (and reports nothing) if deadline would be up before the wait was over.
+		"""
+		delay = self.delay(attempt, response)
+		if deadline is not None and not deadline.allows(delay):
+			return None
+		self.notify_retry(method=method, url=url, attempt=attempt, delay=delay, reason=reason)
+		return delay
+
+	def wait(self, *, method, url, attempt, reason, response=None, deadline=None):
+		"""
+		Reports the retry to the hooks and waits however long we should before trying again. Returns None w/o waiting if there isn't time before deadline.
+		"""
+		delay = self.start_retry(method=method, url=url, attempt=attempt, reason=reason, response=response, deadline=deadline)
+		if delay is not None:
+			time.sleep(delay)
+		return delay
+
+import unittest
+from FakeSession import FakeResponse
+from Deadline import Deadline
+
+class TestRetryPolicy(unittest.TestCase):
+
+	def test_should_retry(self):
+		policy = RetryPolicy(max_attempts=3)
+		assert policy.should_retry('get', 1, response=FakeResponse(503))
+		assert policy.should_retry('GET', 2, response=FakeResponse(429))
+		assert not policy.should_retry('get', 3, response=FakeResponse(503))
+		assert not policy.should_retry('get', 1, response=FakeResponse(500))
+		assert not policy.should_retry('get', 1, response=FakeResponse(200))
+		assert not policy.should_retry('post', 1, response=FakeResponse(503))
+		assert policy.should_retry('post', 1, error=Exception('connection reset'))
+		policy.retry_all_connection_errors = False
+		assert not policy.should_retry('post', 1, error=Exception('connection reset'))
+		assert policy.should_retry('delete', 1, error=Exception('connection reset'))
+		policy.retry_all_connection_errors = True
+		assert not policy.should_retry('post', 1, error=Exception('read timed out'), sent=True)
+		assert policy.should_retry('get', 1, error=Exception('read timed out'), sent=True)
+
+	def test_retry_after(self):
+		policy = RetryPolicy(max_retry_after=10)
+		assert policy.retry_after(FakeResponse(503)) is None
+		assert policy.retry_after(FakeResponse(503, {'Retry-After': '2'})) == 2.0
+		assert policy.retry_after(FakeResponse(503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0.0
+		assert policy.retry_after(FakeResponse(503, {'Retry-After': 'soon'})) is None
+		assert policy.delay(1, FakeResponse(429, {'Retry-After': '3'})) == 3.0
+		assert policy.delay(1, FakeResponse(429, {'Retry-After': '300'})) == 10
+
+	def test_backoff(self):
+		policy = RetryPolicy(backoff_base=1, backoff_max=5)
+		for attempt, ceiling in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+			for i in range(50):
+				assert 0 <= policy.backoff(attempt) <= ceiling
+
+	def test_hooks(self):
+		policy = RetryPolicy(backoff_base=0)
+		seen = []
+		policy.add_hook(lambda **kwargs: seen.append(kwargs))
+		policy.add_hook(lambda **kwargs: 1/0)
+		policy.wait(method='get', url='https://example.com', attempt=1, reason=503)
+		assert seen == [{'method': 'get', 'url': 'https://example.com', 'attempt': 1, 'delay': 0, 'reason': 503}]
+		with Deadline(1) as deadline:
+			assert policy.wait(method='get', url='https://example.com', attempt=1, reason=503, response=FakeResponse(503, {'Retry-After': '5'}), deadline=deadline) is None
+		assert len(seen) == 1
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import asyncio, threading, weakref
+
+class Flight(object):
+	"""
+	One request that's on its way, and whatever it came back w/.
+	"""
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.waiters = 0
+
+class SingleFlight(object):
+	"""
+	Makes identical GETs that happen at the same time share one request. Every LoginManager has one as single_flight. Set it to None to turn it off.
+
+	Standards:
+	* Requests are identical if they have the same url, query parameters, extra headers, login token and session.
+	* The first one goes out. Anyone who asks for the same thing before it's back waits for it and gets the same result, parsed body and all (see JsonCodec.decode).
+	* Nothing is kept once the request is back, so unlike ResponseCache you never get something stale. The next one goes out again.
+	* If the request raises, everyone waiting on it gets the exception.
+	* If the coroutine making the request gets cancelled, that only stops it. Everyone who was waiting on it tries again, and one of them makes the request.
+	* A waiter w/ a timeout stops waiting when it's up and calls func itself. safe_request uses this so nobody waits past their own Deadline on someone else's request.
+	* Threads share flights w/ threads. Coroutines share flights w/ coroutines in the same event loop.
+	"""
+
+	def __init__(self):
+		self.flights = {}
+		self.lock = threading.Lock()
+		self.async_flights = weakref.WeakKeyDictionary()
+		self.requests = 0
+		self.coalesced = 0
+
+	def key(self, url, params=None, token=None, session=None, headers=None):
+		params = tuple(sorted((str(k), str(v)) for k, v in params.items())) if params else ()
+		headers = tuple(sorted((str(k).lower(), str(v)) for k, v in headers.items())) if headers else ()
+		return (str(url), params, headers, token, id(session))
+
+	def do(self, key, func, timeout=None):
+		"""
+		Returns func(), or if someone's already calling func for key, what they get.
+		timeout (optional) - most seconds to wait on someone else's call before making our own
+		"""
+		with self.lock:
+			flight = self.flights.get(key)
+			leader = flight is None
+			if leader:
+				flight = Flight()
+				self.flights[key] = flight
+				self.requests += 1
+			else:
+				flight.waiters += 1
+				self.coalesced += 1
+		if not leader:
+			if not flight.done.wait(timeout):
+				return func()
+			if flight.error is not None:
+				raise flight.error
+			return flight.result
+		try:
+			flight.result = func()
+		except BaseException as e:
+			flight.error = e
+			raise
+		finally:
+			with self.lock:
+				del self.flights[key]
+			flight.done.set()
+		return flight.result
+
+	async def async_do(self, key, func, timeout=None):
+		"""
+		do for asyncio. func is an async function.
+		"""
+		flights = self.async_flights.setdefault(asyncio.get_running_loop(), {})
+		future = flights.get(key)
+		if future is not None:
+			self.coalesced += 1
+			started = asyncio.get_running_loop().time()
+			try:
+				return await asyncio.wait_for(asyncio.shield(future), timeout)
+			except asyncio.TimeoutError:
+				if future.done():
+					# the request itself timed out
+					raise
+				return await func()
+			except asyncio.CancelledError:
+				# Task.cancelling is new in 3.11. before that, we can only go by whether the shared future was cancelled
+				cancelling = getattr(asyncio.current_task(), 'cancelling', None)
+				if not future.cancelled() or (cancelling is not None and cancelling()):
+					# we're the one being cancelled
+					raise
+				# the one making the request was cancelled, not us. start over, which makes one of us the new leader
+				if timeout is not None:
+					timeout = max(timeout - (asyncio.get_running_loop().time() - started), 0)
+				return await self.async_do(key, func, timeout=timeout)
+		future = asyncio.get_running_loop().create_future()
+		flights[key] = future
+		self.requests += 1
+		try:
+			result = await func()
+		except asyncio.CancelledError:
+			future.cancel()
+			raise
+		except BaseException as e:
+			future.set_exception(e)
+			# nobody else might be waiting, and that's fine
+			future.exception()
+			raise
+		else:
+			future.set_result(result)
+		finally:
+			del flights[key]
+		return result
+
+import unittest, time
+
+class TestSingleFlight(unittest.TestCase):
+
+	def test_threads_share(self):
+		flight = SingleFlight()
+		calls = []
+		def slow():
+			calls.append(1)
+			time.sleep(0.05)
+			return object()
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(flight.do(flight.key('https://example.com/groups/5', {'include': 'campaigns'}, 'token'), slow))) for i in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		assert len(calls) == 1
+		assert len(results) == 8 and all(r is results[0] for r in results)
+		assert flight.flights == {}
+		flight.do(flight.key('https://example.com/groups/5', {'include': 'campaigns'}, 'token'), slow)
+		assert len(calls) == 2
+
+	def test_errors_shared(self):
+		flight = SingleFlight()
+		def broken():
+			time.sleep(0.05)
+			raise ValueError('nope')
+		errors = []
+		def call():
+			try:
+				flight.do('key', broken)
+			except ValueError as e:
+				errors.append(e)
+		threads = [threading.Thread(target=call) for i in range(3)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		assert len(errors) == 3 and flight.requests == 1
+
+	def test_timeout(self):
+		flight = SingleFlight()
+		def slow():
+			time.sleep(0.3)
+			return 'leader'
+		leader = threading.Thread(target=lambda: flight.do('key', slow))
+		leader.start()
+		time.sleep(0.05)
+		start = time.monotonic()
+		assert flight.do('key', lambda: 'mine', timeout=0.05) == 'mine'
+		assert time.monotonic() - start < 0.2
+		leader.join()
+		async def slow_async():
+			await asyncio.sleep(0.3)
+			return 'leader'
+		async def mine():
+			return 'mine'
+		async def run():
+			first = asyncio.ensure_future(flight.async_do('key', slow_async))
+			await asyncio.sleep(0)
+			second = await flight.async_do('key', mine, timeout=0.05)
+			return await first, second
+		assert asyncio.run(run()) == ('leader', 'mine')
+
+	def test_async_leader_cancelled(self):
+		flight = SingleFlight()
+		calls = []
+		async def slow():
+			calls.append(1)
+			await asyncio.sleep(0.05)
+			return len(calls)
+		async def run():
+			leader = asyncio.ensure_future(flight.async_do('key', slow))
+			await asyncio.sleep(0)
+			waiters = [asyncio.ensure_future(flight.async_do('key', slow)) for i in range(3)]
+			await asyncio.sleep(0.01)
+			leader.cancel()
+			results = await asyncio.gather(*waiters)
+			return leader.cancelled(), results
+		# the waiters still get a result, and share one new request instead of making one each
+		assert asyncio.run(run()) == (True, [2, 2, 2])
+		assert len(calls) == 2 and flight.requests == 2
+
+	def test_async(self):
+		flight = SingleFlight()
+		calls = []
+		async def slow():
+			calls.append(1)
+			await asyncio.sleep(0.02)
+			return object()
+		async def run():
+			return await asyncio.gather(*[flight.async_do('key', slow) for i in range(5)])
+		results = asyncio.run(run())
+		assert len(calls) == 1 and all(r is results[0] for r in results)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,8 +1,20 @@
 #!/bin/bash
 
+python AutoDetectSeperator.py
 python CustomFieldInterp.py
 python TestEnvLogin.py
 #python TestTerminalLogin.py
+python FakeSession.py
+python RetryPolicy.py
+python Deadline.py
+python ResponseCache.py
+python JsonCodec.py
+python RequestMetrics.py
+python RateLimiter.py
+python CircuitBreaker.py
+python SingleFlight.py
+python HttpxSession.py
+python FakeThruText.py
 python ThruTextObject.py
 python TestThruTextGroup.py
 python TestThruTextCampaign.py
@@ -1,9 +1,19 @@
 #!/usr/bin/env python
 
-import json, os, unittest
+import json, os, unittest, tempfile
+import pandas
 from TestThruTextObject import TestThruTextObject
 from ThruTextGroup import ThruTextGroup
 from LoginManager import LoginManager
+from JsonCodec import JsonCodec, orjson
+from FakeSession import FakeResponse, FakeSession
+from FakeThruText import FakeThruTextServer
+from CustomFieldInterp import CustomFieldInterp
+
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
 
 class TestThruTextGroup(TestThruTextObject):
 	"""
@@ -216,6 +226,204 @@ class TestThruTextGroup(TestThruTextObject):
 		# I guess make one and kill it
 		pass
 
+	def test_dataframe_to_csv_data(self):
+		lm = LoginManager(fake=True)
+		ttg = self.construct_one(login_manager=lm)
+		df = pandas.DataFrame({'first':['John', None, 'Jane'], 'last':['Doe', 'Roe', float('nan')], 'phone':['555-555-1234', '555-555-1235', '555-555-1236']}, dtype=object)
+		correct_answer = [['first', 'last', 'phone'], ['John', 'Doe', '555-555-1234'], ['', 'Roe', '555-555-1235'], ['Jane', '', '555-555-1236']]
+		self.assert_same(ttg.dataframe_to_csv_data(df), correct_answer, 'test_dataframe_to_csv_data_no_func')
+		def no_blank_first_names(row):
+			if row[0] == '':
+				return None
+			return [row[0].upper()] + row[1:]
+		correct_answer = [['first', 'last', 'phone'], ['JOHN', 'Doe', '555-555-1234'], ['JANE', '', '555-555-1236']]
+		self.assert_same(ttg.dataframe_to_csv_data(df, line_by_line_func=no_blank_first_names), correct_answer, 'test_dataframe_to_csv_data_line_by_line')
+
+	def test_streaming_payload(self):
+		lm = LoginManager(fake=True)
+		ttg = self.construct_one(login_manager=lm)
+		csv_data = [['first', 'last', 'phone', 'zip'], ['John', 'Doe', '555-555-1234', '99000'], ['Jane', 'Roe', '555-555-1235', ''], ['Jim', 'Poe', '555-555-1236', '"quoted"']]
+		custom = [{'custom_field_id': 2454914995, 'column': 3}]
+		critical = {'first_name': 0, 'last_name': 1, 'phone': 2}
+		correct_answer = ttg.new_group_payload(name='streaming_group', custom_field_mapping=custom, critical_field_mapping=critical, csv_data=csv_data)
+		for csv_chunks in [[csv_data], [csv_data[:1], csv_data[1:3], [], csv_data[3:]], [csv_data[:2], csv_data[2:]]]:
+			body = b''.join(ttg.streaming_payload(name='streaming_group', custom_field_mapping=custom, critical_field_mapping=critical, csv_chunks=csv_chunks))
+			self.assert_same(json.loads(body), correct_answer, 'test_streaming_payload_' + str(len(csv_chunks)))
+
+	def test_split_csv_data(self):
+		lm = LoginManager(fake=True)
+		ttg = self.construct_one(login_manager=lm)
+		ttg.figured_custom = []
+		ttg.figured_critical = {'first_name': 0, 'last_name': 1, 'phone': 2}
+		header = ['first', 'last', 'phone']
+		rows = [['Jane', 'Doe', '555-555-' + str(1000 + i)] for i in range(10)]
+		shards = ttg.split_csv_data([header] + rows, rows_per_shard=4)
+		self.assert_same([len(s) for s in shards], [5, 5, 3], 'test_split_csv_data_rows')
+		shard_payloads = []
+		for max_payload_bytes in [300, 400, 100000]:
+			shards = ttg.split_csv_data([header] + rows, max_payload_bytes=max_payload_bytes, group_name='split')
+			for shard in shards:
+				assert shard[0] == header
+				payload = ttg.new_group_payload(name=ttg.shard_name('split', len(shards)), custom_field_mapping=ttg.figured_custom, critical_field_mapping=ttg.figured_critical, csv_data=shard)
+				assert len(lm.json_codec.dumps(payload)) <= max_payload_bytes
+			self.assert_same([r for s in shards for r in s[1:]], rows, 'test_split_csv_data_bytes_' + str(max_payload_bytes))
+			shard_payloads.append(len(shards))
+		assert shard_payloads[0] > shard_payloads[1] > shard_payloads[2] == 1
+		self.assert_same(ttg.shard_name('split', 3), 'split_part_03', 'test_split_csv_data_name')
+
+	def test_split_csv_data_backends(self):
+		lm = LoginManager(fake=True)
+		ttg = self.construct_one(login_manager=lm)
+		ttg.figured_custom = [{'custom_field_id': 11, 'column': 3}]
+		ttg.figured_critical = {'first_name': 0, 'last_name': 1, 'phone': 2}
+		header = ['first', 'last', 'phone', 'precinct']
+		rows = [['Jane' * (1 + i % 5), 'Doe', '555-555-' + str(1000 + i), 'Precinct ' + str(i % 37)] for i in range(500)]
+		for backend in ['json'] + ([] if orjson is None else ['orjson']):
+			lm.json_codec = JsonCodec(backend=backend)
+			for max_payload_bytes in [1000, 5000, 20000]:
+				shards = ttg.split_csv_data([header] + rows, max_payload_bytes=max_payload_bytes, group_name='split')
+				self.assert_same([r for s in shards for r in s[1:]], rows, 'test_split_csv_data_backends_rows')
+				sizes = [len(lm.json_codec.dumps(ttg.new_group_payload(name=ttg.shard_name('split', part), custom_field_mapping=ttg.figured_custom, critical_field_mapping=ttg.figured_critical, csv_data=shard))) for part, shard in enumerate(shards, start=1)]
+				assert max(sizes) <= max_payload_bytes, (backend, max_payload_bytes, max(sizes))
+				# and they're as full as they can be. one more row would have been too many
+				for part, shard in enumerate(shards[:-1], start=1):
+					next_row = shards[part][1]
+					fuller = ttg.new_group_payload(name=ttg.shard_name('split', part), custom_field_mapping=ttg.figured_custom, critical_field_mapping=ttg.figured_critical, csv_data=shard + [next_row])
+					assert len(lm.json_codec.dumps(fuller)) > max_payload_bytes, (backend, max_payload_bytes, part)
+
+	def test_project_mapping(self):
+		lm = LoginManager(fake=True)
+		ttg = self.construct_one(login_manager=lm)
+		ttg.figured_custom = [{'custom_field_id': 11, 'column': 6}, {'custom_field_id': 12, 'column': 2}]
+		ttg.figured_critical = {'first_name': 4, 'last_name': 0, 'phone': 7}
+		columns, custom, critical = ttg.project_mapping()
+		self.assert_same(columns, [0, 2, 4, 6, 7], 'test_project_mapping_columns')
+		self.assert_same(custom, [{'custom_field_id': 11, 'column': 3}, {'custom_field_id': 12, 'column': 1}], 'test_project_mapping_custom')
+		self.assert_same(critical, {'first_name': 2, 'last_name': 0, 'phone': 4}, 'test_project_mapping_critical')
+		assert ttg.figured_custom[0]['column'] == 6
+		df = pandas.DataFrame([['Doe', 'x', 'zip', 'y', 'Jane', 'z', 'precinct', 'phone']], columns=['last', 'a', 'zip', 'b', 'first', 'c', 'precinct', 'phone'])
+		projected = df.iloc[:, columns]
+		self.assert_same(projected.columns.values.tolist(), ['last', 'zip', 'first', 'precinct', 'phone'], 'test_project_mapping_frame')
+		self.assert_same(projected.columns[critical['first_name']], 'first', 'test_project_mapping_first')
+		self.assert_same(projected.columns[custom[0]['column']], 'precinct', 'test_project_mapping_custom_column')
+
+	def test_apply_frame_transform(self):
+		lm = LoginManager(fake=True)
+		ttg = self.construct_one(login_manager=lm)
+		df = pandas.DataFrame({'first':['John', None, 'Jane'], 'last':['Doe', 'Roe', 'Poe'], 'phone':['(555) 555-1234', '555.555.1235', '555-555-1236']}, dtype=object)
+		def clean_up(frame):
+			frame = frame[frame['first'].notna()].copy()
+			frame['phone'] = frame['phone'].str.replace(r'\D', '', regex=True)
+			return frame
+		correct_answer = [['first', 'last', 'phone'], ['John', 'Doe', '5555551234'], ['Jane', 'Poe', '5555551236']]
+		self.assert_same(ttg.dataframe_to_csv_data(ttg.apply_frame_transform(df, clean_up)), correct_answer, 'test_apply_frame_transform')
+		assert ttg.apply_frame_transform(df, lambda frame: None) is None
+
+	def test_from_chunks_frame_transform(self):
+		lm = LoginManager(fake=True)
+		session = FakeSession([FakeResponse(201, content={'data': self.example_dict()})])
+		lm.session = session
+		lm.session_token = lm.token
+		chunks = [pandas.DataFrame({'first': ['John', 'Jane'], 'last': ['Doe', 'Roe'], 'phone': ['555-555-123' + str(i), '']}, dtype=object) for i in range(3)]
+		def drop_blank_phones(frame):
+			return frame[frame['phone'] != '']
+		ttg = self.construct_one(login_manager=lm)
+		ttg.figured_custom = []
+		ttg.figured_critical = {'first_name': 0, 'last_name': 1, 'phone': 2}
+		assert ttg.from_chunks('chunked', chunks, frame_transform=drop_blank_phones)
+		self.assert_same(json.loads(session.sent('data')[0])['data']['attributes']['import']['csv_data'], [['first', 'last', 'phone']] + [['John', 'Doe', '555-555-123' + str(i)] for i in range(3)], 'test_from_chunks_frame_transform_sent')
+		calls = []
+		def fails_on_second_chunk(frame):
+			calls.append(1)
+			return None if len(calls) == 2 else frame
+		ttg = self.construct_one(login_manager=lm)
+		ttg.figured_custom = []
+		ttg.figured_critical = {'first_name': 0, 'last_name': 1, 'phone': 2}
+		assert ttg.from_chunks('chunked', chunks, frame_transform=fails_on_second_chunk) is False
+		assert ttg.id is None
+		self.assert_same(len(calls), 2, 'test_from_chunks_frame_transform_stopped')
+
+	def test_wait_for_groups(self):
+		lm = LoginManager(fake=True)
+		groups = []
+		for statuses in [['uploading', 'uploading', 'active'], ['uploading', 'active'], ['active']]:
+			ttg = self.construct_one(login_manager=lm, in_dict=self.example_dict())
+			ttg.become_calls = 0
+			def fake_become(ttg=ttg, statuses=statuses):
+				ttg.status = statuses[min(ttg.become_calls, len(statuses) - 1)]
+				ttg.become_calls += 1
+				return True
+			ttg.become = fake_become
+			ttg.become()
+			groups.append(ttg)
+		assert ThruTextGroup.wait_for_groups(groups, timeout=5, min_interval=0.01, max_interval=0.02)
+		self.assert_same([g.become_calls for g in groups], [3, 2, 1], 'test_wait_for_groups_calls')
+		groups[0].status = 'uploading'
+		groups[0].become = lambda: True
+		assert not groups[0].wait_until_processed(timeout=0.05, min_interval=0.01, max_interval=0.02)
+		groups[0].upload_failed_reason = 'bad phone column'
+		assert groups[0].wait_until_processed(timeout=0.05)
+
+	@unittest.skipIf(pyarrow is None, "needs pyarrow")
+	def test_from_file_columnar(self):
+		import pyarrow.parquet, pyarrow.feather
+		lm = LoginManager(fake=True)
+		df = pandas.DataFrame({'zip': ['99000', '99001'], 'first': ['Jane', 'John'], 'notes': ['x', 'y'], 'last': ['Doe', 'Roe'], 'phone': ['555-555-1234', '555-555-1235']})
+		sent = []
+		def record(name, custom_field_mapping, critical_field_mapping, csv_data=None, csv_chunks=None, country_id='US'):
+			if csv_data is None:
+				csv_data = [row for chunk in csv_chunks for row in chunk]
+			sent.append(([csv_data[1][critical_field_mapping[field]] for field in ['first_name', 'last_name', 'phone']], [csv_data[1][cfm['column']] for cfm in custom_field_mapping], len(csv_data[0])))
+			return True
+		with tempfile.TemporaryDirectory() as directory:
+			for filename, write in [('list.parquet', pyarrow.parquet.write_table), ('list.feather', pyarrow.feather.write_feather)]:
+				path = os.path.join(directory, filename)
+				write(pyarrow.Table.from_pandas(df, preserve_index=False), path)
+				ttg = self.construct_one(login_manager=lm)
+				ttg.figured_custom = [{'custom_field_id': 11, 'column': 0}]
+				ttg.figured_critical = {'first_name': 1, 'last_name': 3, 'phone': 4}
+				ttg.make_new = record
+				ttg.make_new_streaming = record
+				for chunksize in [None, None, 1]:
+					assert ttg.from_file('list', path, chunksize=chunksize)
+				self.assert_same(ttg.figured_critical, {'first_name': 1, 'last_name': 3, 'phone': 4}, 'test_from_file_columnar_mapping_kept')
+				self.assert_same(ttg.new_shard().figured_custom, [{'custom_field_id': 11, 'column': 0}], 'test_from_file_columnar_shard_mapping')
+		self.assert_same(sent, [(['Jane', 'Doe', '555-555-1234'], ['99000'], 4)] * 6, 'test_from_file_columnar')
+
+	def test_bulk_from_files(self):
+		cfi = CustomFieldInterp()
+		cfi.synonym_to_code = {'first': 'first_name', 'last': 'last_name', 'phone': 'phone'}
+		cfi.code_to_id = {'first_name': 0, 'last_name': 0, 'phone': 0}
+		with FakeThruTextServer(latency=(0, 0.02), seed=1) as server, tempfile.TemporaryDirectory() as directory:
+			lm = server.login_manager()
+			pairs = []
+			for i in range(6):
+				path = os.path.join(directory, 'list_' + str(i) + '.csv')
+				with open(path, 'w') as f:
+					f.write('first,last,phone\n' + '\n'.join('Jane,Doe,555-555-{:04d}'.format(j) for j in range(i + 1)) + '\n')
+				pairs.append(('bulk ' + str(i), path))
+			pairs.insert(2, ('bulk missing', os.path.join(directory, 'missing.csv')))
+			results = ThruTextGroup.bulk_from_files(pairs, login_manager=lm, max_workers=3, cfi=cfi)
+			self.assert_same([r[:2] for r in results], pairs, 'test_bulk_from_files_order')
+			self.assert_same([r[2].name if r[2] is not None else None for r in results], ['bulk 0', 'bulk 1', None, 'bulk 2', 'bulk 3', 'bulk 4', 'bulk 5'], 'test_bulk_from_files_groups')
+			self.assert_same([r[2].contacts_valid for r in results if r[2] is not None], [1, 2, 3, 4, 5, 6], 'test_bulk_from_files_contacts')
+			self.assert_same(all(r[2].login_manager is lm for r in results if r[2] is not None), True, 'test_bulk_from_files_login_manager')
+			self.assert_same([path for method, path in server.requests].count('/v1/sessions'), 1, 'test_bulk_from_files_one_login')
+
+	def test_read_file_no_header(self):
+		ttg = self.construct_one(login_manager=LoginManager(fake=True))
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'no_header.csv')
+			with open(path, 'w') as f:
+				f.write('Jane,Doe,555-555-1234\nJohn,Roe,555-555-1235\nJim,Smithers,555-555-1236\n')
+			df = ttg.read_file(path)
+			with ttg.read_file(path, chunksize=2) as df_chunks:
+				chunked = pandas.concat(list(df_chunks))
+		for name, frame in [('test_read_file_no_header', df), ('test_read_file_no_header_chunks', chunked)]:
+			self.assert_same(list(frame.columns), ['column_1', 'column_2', 'column_3'], name + '_columns')
+			self.assert_same(frame.values.tolist()[0], ['Jane', 'Doe', '555-555-1234'], name + '_first_row')
+			self.assert_same(len(frame), 3, name + '_rows')
+
 	def test_from_file(self):
 		# this is 90% other modules' stuff. make sure it can read a csv, apply the line by line?
 		pass
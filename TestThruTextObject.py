@@ -2,6 +2,7 @@
 
 from ThruTextObject import ThruTextObject
 from LoginManager import LoginManager
+from FakeThruText import FakeThruTextServer
 from abc import ABC, abstractmethod
 import unittest, json, requests, time
 from datetime import datetime
@@ -10,9 +11,11 @@ class TestThruTextObject(unittest.TestCase, ABC):
 	"""
 	Basic suite of tests that cover the functions of ThruTextObject that are meant to be overridden. 
 	Each thru_text object should extend this class with its own tests.
+	Set the environment variable THRU_TEXT_OFFLINE to run against a FakeThruTextServer instead of ThruText.
 	"""
 
 	test_id = None
+	fake_server = None
 
 	def assert_same(self, thing1, thing2, test_name=None):
 		if thing1 != thing2 or (thing1 is None and thing1 is not thing2):
@@ -26,6 +29,7 @@ class TestThruTextObject(unittest.TestCase, ABC):
 	@classmethod
 	def setUpClass(cls):
 		super(TestThruTextObject, cls).setUpClass()
+		cls.fake_server = FakeThruTextServer.for_offline_tests()
 		lm = LoginManager()
 		cls.test_id = cls.make_test_in_thru_text(login_manager=lm)
 
@@ -35,6 +39,8 @@ class TestThruTextObject(unittest.TestCase, ABC):
 		testing = cls.construct_one()
 		testing.get_rid_of(cls.test_id)
 		testing.session.close()
+		if cls.fake_server is not None:
+			cls.fake_server.stop()
 
 	@classmethod
 	@abstractmethod
@@ -111,6 +117,18 @@ class TestThruTextObject(unittest.TestCase, ABC):
 		for index in range(len(manual_list)):
 			self.assert_same(manual_list[index]['id'], func_list[index].id, 'test_list_all_'+str(index))
 
+	def test_from_dicts(self):
+		in_dict = self.example_dict()
+		if not in_dict:
+			return
+		lm = LoginManager(fake=True)
+		built = self.construct_one(login_manager=lm, in_dict=in_dict)
+		hydrated = built.from_dicts([in_dict, {}, in_dict], login_manager=lm)
+		self.assert_same(len(hydrated), 2, 'test_from_dicts_skips_bad_dicts')
+		for one in hydrated:
+			assert one.session is built.session
+			self.assert_same(one.as_dict(), built.as_dict(), 'test_from_dicts')
+
 	@abstractmethod
 	def test_make_new(self):
 		"""
@@ -128,6 +146,7 @@ class TestThruTextObject(unittest.TestCase, ABC):
 		lm = LoginManager(fake=True)
 		lm.account_number = '0000000001'
 		lm.staging = False
+		lm.custom_api_url = None
 		testing = self.construct_one(login_manager=lm)
 		test_url = testing.base_url
 		assert test_url is not None
@@ -10,10 +10,12 @@ from ThruTextGroup import ThruTextGroup
 from ThruTextSavedReply import ThruTextSavedReply
 from ThruTextSurvey import ThruTextSurvey
 from ThruTextRegion import ThruTextRegion
+from Deadline import Deadline
 
 class ThruTextCampaign(ThruTextObject):
 
 	url_name = 'campaigns'
+	filter_by_ids = True
 	thru_text_type = 'campaign'
 
 	acceptable_time_zones = ['US/Alaska', 'US/Aleutian', 'US/Arizona', 'US/Central', 'US/East-Indiana', 'US/Eastern', 'US/Hawaii', 'US/Indiana-Starke', 'US/Michigan', 'US/Mountain', 'US/Pacific', 'US/Pacific-New', 'US/Samoa']
@@ -161,7 +163,7 @@ class ThruTextCampaign(ThruTextObject):
 		if not working:
 			print("Error: Couldn't get surveys for " + self.name)
 			return None
-		exports_list_dict = json.loads(export_response.content)
+		exports_list_dict = self.response_json(export_response)
 		for eld in exports_list_dict['data']:
 			try:
 				results.append(ThruTextExport(eld))
@@ -185,7 +187,7 @@ class ThruTextCampaign(ThruTextObject):
 			return None
 
 		try:
-			return ThruTextExport(json.loads(export_response.content)['data'])
+			return ThruTextExport(self.response_json(export_response)['data'])
 		except KeyError:
 			return None
 #
@@ -271,8 +273,11 @@ class ThruTextCampaign(ThruTextObject):
 			return None
 		return dt.strftime('%H:%M')
 
-	def from_file(self, filename, group_id=None, segments=None, debug=False):
-		with open(filename, 'r') as ymlfile:
+	def from_file(self, filename, group_id=None, segments=None, debug=False, deadline=None):
+		"""
+		deadline (optional) - seconds to make the campaign, its saved replies and its surveys in. Once they're up, nothing else gets sent. See Deadline.
+		"""
+		with open(filename, 'r') as ymlfile, Deadline(deadline):
 			cfg = yaml.load(ymlfile)
 			parameter_dict = {}
 			for key in ['name', 'description', 'script', 'start_date', 'end_date', 'time_zone', 'open_time', 'close_time', 'regions']:
@@ -457,7 +462,7 @@ class ThruTextCampaign(ThruTextObject):
 			print("Error: failed to make new campaign.")
 			return False
 		try:
-			self.from_dict(json.loads(new_campaign_response.content)['data'])
+			self.from_dict(self.response_json(new_campaign_response)['data'])
 		except json.JSONDecodeError:
 			print("Warning: got something weird back from attempt to make new campaign. This campaign may not be an accurate representation of what's in ThruText")
 		return True
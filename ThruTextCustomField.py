@@ -10,6 +10,8 @@ class ThruTextCustomField(ThruTextObject):
 	"""
 
 	url_name = 'custom_fields'
+	thru_text_type = 'custom_field'
+	filter_by_ids = True
 	ageAttribute = None
 
 	def initialize_values(self, in_dict=None, login_manager=None):
@@ -60,7 +62,7 @@ class ThruTextCustomField(ThruTextObject):
 			print("Error: failed to make new custom field.")
 			return False
 		try:
-			self.from_dict(json.loads(response.content)['data'])
+			self.from_dict(self.response_json(response)['data'])
 		except json.JSONDecodeError:
 			print("Warning: got something weird back from attempt to make new custom field. This custom field may not be an accurate representation of what's in ThruText")
 		return True
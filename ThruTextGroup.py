@@ -1,21 +1,40 @@
 #!/usr/bin/env python
 
-import json, os
+import json, os, itertools, contextlib, time
+import concurrent.futures
 
+from LoginManager import LoginManager
 from ThruTextObject import ThruTextObject
+from Deadline import Deadline, carry_deadline
 from CustomFieldInterp import CustomFieldInterp
 from AutoDetectSeperator import *
 import pandas
 
+class FrameTransformFailed(Exception):
+	"""
+	Raised from inside a streaming upload when frame_transform doesn't give back a dataframe for one of the chunks, to cut the upload off before ThruText gets a partial list.
+	"""
+	pass
+
 class ThruTextGroup(ThruTextObject):
 	"""
 	Object that represents a group on the ThruText website.
 	"""
 
 	url_name = 'groups'
+	filter_by_ids = True
 	age_attribute = None 
 	thru_text_type = 'group'
 
+	# stands in for csv_data when encoding a streaming payload
+	csv_data_placeholder = '__thru_text_streaming_csv_data__'
+
+	# statuses a group has while ThruText is still working on its import
+	processing_statuses = ['uploading', 'processing']
+
+	# file extensions read_file reads w/ pyarrow instead of as delimited text
+	columnar_extensions = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
 	def initialize_values(self):
 		self.type = None
 		self.id = None
@@ -43,33 +62,439 @@ class ThruTextGroup(ThruTextObject):
 		self.imports = None
 		self.custom_fields = None
 
-	def figure_out_mapping(self, columns, verbose=False):
-		cfi = CustomFieldInterp(login_manager=self.login_manager)
-		cfi.setup(verbose=verbose)
+	def figure_out_mapping(self, columns, verbose=False, cfi=None):
+		"""
+		Uses a CustomFieldInterp to figure out which columns go to which fields.
+		cfi (optional) - a CustomFieldInterp that's already been set up. Saves setting up a new one, which reads the config files and can ask ThruText for the custom fields.
+		"""
+		if cfi is None:
+			cfi = CustomFieldInterp(login_manager=self.login_manager)
+			cfi.setup(verbose=verbose)
 		self.figured_custom, self.figured_critical = cfi.columns_to_mappings(columns)
 		if self.figured_custom is None and self.figured_critical is None:
 			print("Error: couldn't figure out mapping for " + str(columns))
 			return False
 		return True
 		
-	def from_dataframe(self, group_name, df, line_by_line_func=None, country_id='US'):
+	def dataframe_to_csv_data(self, df, line_by_line_func=None, include_header=True):
+		"""
+		Turns a dataframe into the 2-D list that make_new wants for csv_data.
+		Blanks (NaN, None, etc) become empty strings. This is done on the whole frame at once, which is a lot faster than going row by row.
+		input:
+		df - the dataframe
+		line_by_line_func (optional) - called on each row (as a list). return the row to keep it, or None to drop it. This is the slow path, only use it if you have to.
+		include_header (optional) - whether the first row should be the column headers. defaults to True
+		output:
+		2-D list of the csv
+		"""
+		rows = df.astype(object).where(df.notna(), '').values.tolist()
+		if line_by_line_func is not None:
+			rows = [r for r in (line_by_line_func(raw_row) for raw_row in rows) if r is not None]
+		if include_header:
+			rows.insert(0, df.columns.values.tolist())
+		return rows
+
+	def project_mapping(self, custom_field_mapping=None, critical_field_mapping=None):
+		"""
+		Figures out how to cut csv data down to just the columns that are mapped to a field. ThruText ignores the other columns, so all they do is make the upload bigger.
+		input:
+		custom_field_mapping, critical_field_mapping (optional) - same as make_new. default to this group's figured out mapping.
+		output:
+		columns - list of the positions of the mapped columns, in order. ie, df.iloc[:, columns] is the cut down frame
+		custom_field_mapping, critical_field_mapping - the mappings, renumbered to match the cut down columns
+		"""
+		if custom_field_mapping is None:
+			custom_field_mapping = self.figured_custom
+		if critical_field_mapping is None:
+			critical_field_mapping = self.figured_critical
+		columns = sorted(set(critical_field_mapping.values()) | set(cfm['column'] for cfm in custom_field_mapping))
+		new_position = {old: new for new, old in enumerate(columns)}
+		projected_custom = [dict(cfm, column=new_position[cfm['column']]) for cfm in custom_field_mapping]
+		projected_critical = {field: new_position[column] for field, column in critical_field_mapping.items()}
+		return columns, projected_custom, projected_critical
+
+	def mapping_to_send(self, project_columns, custom_field_mapping=None, critical_field_mapping=None):
+		"""
+		returns (columns, custom_field_mapping, critical_field_mapping) to use when sending data w/ the given mapping, or this group's if it isn't given.
+		columns is None if project_columns is False, otherwise see project_mapping.
+		"""
+		if custom_field_mapping is None:
+			custom_field_mapping = self.figured_custom
+		if critical_field_mapping is None:
+			critical_field_mapping = self.figured_critical
+		if project_columns:
+			return self.project_mapping(custom_field_mapping, critical_field_mapping)
+		return None, custom_field_mapping, critical_field_mapping
+
+	def has_mapping(self, custom_field_mapping=None, critical_field_mapping=None):
+		"""
+		Whether we know which columns go to which fields, from the mapping given or this group's.
+		"""
+		if custom_field_mapping is not None and critical_field_mapping is not None:
+			return True
+		return self.figured_custom is not None and self.figured_critical is not None
+
+	def apply_frame_transform(self, df, frame_transform):
+		"""
+		Runs frame_transform on df and makes sure it gave back a dataframe.
+		returns the transformed dataframe, or None if it didn't
+		"""
+		transformed = frame_transform(df)
+		if not isinstance(transformed, pandas.DataFrame):
+			print("Error: frame_transform returned " + str(type(transformed)) + " instead of a dataframe.")
+			return None
+		return transformed
+
+	def from_dataframe(self, group_name, df, line_by_line_func=None, country_id='US', project_columns=False, frame_transform=None, custom_field_mapping=None, critical_field_mapping=None):
+		"""
+		Makes a group out of a dataframe. Figures out the mapping from the column headers if it hasn't been already.
+		project_columns (optional) - only send the columns that are mapped to a field (see project_mapping). If you use this, line_by_line_func gets the cut down rows.
+		frame_transform (optional) - called on the whole dataframe before anything else happens, including figuring out the mapping. Return the dataframe you want to send, w/ whatever rows dropped or values cleaned up. Does the same job as line_by_line_func but w/ pandas operations on all the rows at once, which is a lot faster.
+		custom_field_mapping, critical_field_mapping (optional) - the mapping for df's columns, if it isn't this group's. from_file uses this after cutting the columns down.
+		"""
+		if frame_transform is not None:
+			df = self.apply_frame_transform(df, frame_transform)
+			if df is None:
+				return False
+		if not self.has_mapping(custom_field_mapping, critical_field_mapping):
+			if not self.figure_out_mapping(df.columns.values):
+				return False
+		columns, custom_field_mapping, critical_field_mapping = self.mapping_to_send(project_columns, custom_field_mapping, critical_field_mapping)
+		if columns is not None:
+			df = df.iloc[:, columns]
+		csv_data = self.dataframe_to_csv_data(df, line_by_line_func=line_by_line_func)
+		return self.make_new(name=group_name, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_data=csv_data, country_id=country_id)
+
+	def from_chunks(self, group_name, df_chunks, line_by_line_func=None, country_id='US', project_columns=False, frame_transform=None, custom_field_mapping=None, critical_field_mapping=None):
+		"""
+		Makes a group out of a bunch of dataframes that all have the same columns, like what you get from pandas.read_csv(chunksize=...).
+		Each chunk is turned into csv data and sent on its way before the next one is read, so memory use depends on the chunk size rather than the size of the whole list.
+		frame_transform (optional) - see from_dataframe. It's called on each chunk, and has to give back the same columns every time. If it fails on a later chunk, the upload is cut off and you get False.
+		custom_field_mapping, critical_field_mapping (optional) - see from_dataframe
+		"""
+		df_chunks = iter(df_chunks)
+		try:
+			first_chunk = next(df_chunks)
+		except StopIteration:
+			print("Error: no data to make group " + str(group_name) + " out of.")
+			return False
+		if frame_transform is not None:
+			first_chunk = self.apply_frame_transform(first_chunk, frame_transform)
+			if first_chunk is None:
+				return False
+			df_chunks = self.transform_chunks(df_chunks, frame_transform)
+		if not self.has_mapping(custom_field_mapping, critical_field_mapping):
+			if not self.figure_out_mapping(first_chunk.columns.values):
+				return False
+		columns, custom_field_mapping, critical_field_mapping = self.mapping_to_send(project_columns, custom_field_mapping, critical_field_mapping)
+		if columns is not None:
+			df_chunks = (df.iloc[:, columns] for df in itertools.chain([first_chunk], df_chunks))
+		else:
+			df_chunks = itertools.chain([first_chunk], df_chunks)
+		csv_chunks = (self.dataframe_to_csv_data(df, line_by_line_func=line_by_line_func, include_header=(index == 0)) for index, df in enumerate(df_chunks))
+		try:
+			return self.make_new_streaming(name=group_name, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_chunks=csv_chunks, country_id=country_id)
+		except FrameTransformFailed:
+			print("Error: stopped uploading group " + str(group_name) + " partway through because frame_transform failed on one of the chunks.")
+			return False
+
+	def transform_chunks(self, df_chunks, frame_transform):
+		"""
+		Generator that runs frame_transform on each chunk as it's needed. Raises FrameTransformFailed if it doesn't give back a dataframe.
+		"""
+		for df in df_chunks:
+			transformed = self.apply_frame_transform(df, frame_transform)
+			if transformed is None:
+				raise FrameTransformFailed()
+			yield transformed
+
+	def file_type(self, filename):
+		"""
+		parquet, feather, or csv (which covers any delimited text file, compressed or not), going by the extension
+		"""
+		for extension, file_type in self.columnar_extensions.items():
+			if str(filename).lower().endswith(extension):
+				return file_type
+		return 'csv'
+
+	def file_columns(self, filename):
+		"""
+		The column headers of a file, w/o reading the whole thing. For parquet and feather, that's just the schema. For csv, it's the 1st line of the sample detect_dialect looks at.
+		returns None if they can't be figured out
+		"""
+		file_type = self.file_type(filename)
+		if file_type == 'parquet':
+			import pyarrow.parquet
+			return pyarrow.parquet.read_schema(filename).names
+		elif file_type == 'feather':
+			import pyarrow, pyarrow.ipc
+			with pyarrow.memory_map(filename) as source:
+				return pyarrow.ipc.open_file(source).schema.names
+		return detect_dialect(filename).columns
+
+	def read_file(self, filename, chunksize=None, columns=None):
+		"""
+		Reads a file into a dataframe, everything as strings.
+		Parquet and feather files are read w/ pyarrow. Anything else is treated as a delimited text file, and the delimiter, quoting, encoding, compression, and whether there's a header row are figured out by detect_dialect. Compressed files are decompressed as they're read. A file w/o a header row gets columns named column_1, column_2, etc.
+		If pyarrow is installed, it does the reading, since it's a lot faster than pandas.
+		chunksize (optional) - if you specify this, you get back an iterator of dataframes w/ that many rows each instead (see pandas.read_csv). Use it in a with statement.
+		columns (optional) - only load these columns. Only works for parquet and feather, which can skip the rest entirely.
+		"""
+		file_type = self.file_type(filename)
+		if file_type != 'csv':
+			return self.read_columnar_file(filename, file_type, chunksize=chunksize, columns=columns)
+		dialect = detect_dialect(filename)
+		pyarrow_options = dialect.pyarrow_csv_options() if chunksize is None else None
+		if pyarrow_options is not None:
+			import pyarrow, pyarrow.csv
+			read_options, parse_options, convert_options = pyarrow_options
+			try:
+				return pyarrow.csv.read_csv(filename, read_options=read_options, parse_options=parse_options, convert_options=convert_options).to_pandas()
+			except pyarrow.ArrowInvalid:
+				# pyarrow is pickier than pandas about weird files (no rows, ragged lines, etc). let pandas have a go.
+				pass
+		return pandas.read_csv(filename, dtype=object, chunksize=chunksize, **dialect.read_csv_kwargs())
+
+	def read_columnar_file(self, filename, file_type, chunksize=None, columns=None):
+		"""
+		read_file for parquet and feather files
+		"""
+		import pyarrow, pyarrow.parquet, pyarrow.feather
+		if file_type == 'parquet' and chunksize is not None:
+			batches = pyarrow.parquet.ParquetFile(filename).iter_batches(batch_size=chunksize, columns=columns)
+			return contextlib.closing(self.arrow_to_dataframe(pyarrow.Table.from_batches([batch])) for batch in batches)
+		if file_type == 'parquet':
+			table = pyarrow.parquet.read_table(filename, columns=columns)
+		else:
+			table = pyarrow.feather.read_table(filename, columns=columns, memory_map=True)
+		if chunksize is not None:
+			return contextlib.closing(self.arrow_to_dataframe(pyarrow.Table.from_batches([batch])) for batch in table.to_batches(max_chunksize=chunksize))
+		return self.arrow_to_dataframe(table)
+
+	def arrow_to_dataframe(self, table):
+		"""
+		Turns a pyarrow table into a dataframe of strings, like what you'd get reading a csv.
+		The columns are converted in arrow, so 99000 stays 99000 instead of becoming 99000.0 in a column w/ blanks.
+		"""
+		import pyarrow
+		string_columns = []
+		for column in table.columns:
+			try:
+				string_columns.append(column.cast(pyarrow.string()))
+			except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+				string_columns.append(column)
+		return pyarrow.Table.from_arrays(string_columns, names=table.column_names).to_pandas()
+
+	def from_file(self, group_name, filename, line_by_line_func=None, country_id='US', chunksize=None, project_columns=False, frame_transform=None, deadline=None):
+		"""
+		Makes a group out of a file. See read_file for the kinds of files it can read.
+		For parquet and feather files, the mapping is figured out from the schema first, and only the mapped columns are loaded. (Unless you use frame_transform, which might need the other columns.)
+		chunksize (optional) - if you specify this, the file is read this many rows at a time and streamed up to ThruText (see from_chunks). Use this for files too big to comfortably fit in memory.
+		project_columns, frame_transform (optional) - see from_dataframe
+		deadline (optional) - seconds the whole upload gets, retries and all. See Deadline.
+		"""
+		with Deadline(deadline):
+			columns = None
+			custom_field_mapping, critical_field_mapping = None, None
+			if self.file_type(filename) != 'csv' and frame_transform is None:
+				file_columns = self.file_columns(filename)
+				if not self.has_mapping():
+					if not self.figure_out_mapping(file_columns):
+						return False
+				# the mapping for the cut down columns. this group keeps the one for the whole file, so it can read the file again
+				positions, custom_field_mapping, critical_field_mapping = self.project_mapping()
+				columns = [file_columns[p] for p in positions]
+				project_columns = False
+			if chunksize is not None:
+				with self.read_file(filename, chunksize=chunksize, columns=columns) as df_chunks:
+					return self.from_chunks(group_name=group_name, df_chunks=df_chunks, line_by_line_func=line_by_line_func, country_id=country_id, project_columns=project_columns, frame_transform=frame_transform, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping)
+			df = self.read_file(filename, columns=columns)
+			return self.from_dataframe(group_name=group_name, df=df, line_by_line_func=line_by_line_func, country_id=country_id, project_columns=project_columns, frame_transform=frame_transform, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping)
+
+	def shard_name(self, group_name, part):
+		"""
+		name of the part-th shard (counting from 1) of group_name. ie, my_list_part_01
+		"""
+		return '{}_part_{:02d}'.format(group_name, part)
+
+	def split_csv_data(self, csv_data, rows_per_shard=None, max_payload_bytes=None, group_name=''):
+		"""
+		Splits csv_data into smaller csv_datas, each w/ its own copy of the header row.
+		input:
+		csv_data - 2-D list, header row first, same as make_new
+		rows_per_shard (optional) - most rows (not counting the header) in any one shard
+		max_payload_bytes (optional) - most bytes the make_new payload for any one shard should be. A single row bigger than this gets a shard to itself.
+		group_name (optional) - only used to estimate the size of the rest of the payload
+		You need at least one of rows_per_shard and max_payload_bytes. If you use both, shards stop at whichever limit they hit first.
+		output:
+		list of csv_datas
+		"""
+		if rows_per_shard is None and max_payload_bytes is None:
+			print("Error: need rows_per_shard or max_payload_bytes to know how to split csv data.")
+			return None
+		header, rows = csv_data[0], csv_data[1:]
+		if max_payload_bytes is None:
+			return [[header] + rows[start:start+rows_per_shard] for start in range(0, len(rows), rows_per_shard)]
+
+		codec = self.login_manager.json_codec
+		# size of everything in the payload except the rows
+		overhead = len(codec.dumps(self.new_group_payload(name=self.shard_name(group_name, 99), custom_field_mapping=self.figured_custom, critical_field_mapping=self.figured_critical, csv_data=[header])))
+		# what goes between rows. ',' for orjson, ', ' for json
+		separator_bytes = len(codec.dumps([[], []])) - 2 * len(codec.dumps([])) - 2
+		shards = []
+		start = 0
+		shard_bytes = overhead
+		for index, row in enumerate(rows):
+			row_bytes = len(codec.dumps(row)) + separator_bytes
+			full = (shard_bytes + row_bytes > max_payload_bytes) or (rows_per_shard is not None and index - start >= rows_per_shard)
+			if full and index > start:
+				shards.append([header] + rows[start:index])
+				start = index
+				shard_bytes = overhead
+			if shard_bytes + row_bytes > max_payload_bytes:
+				print("Warning: row " + str(index) + " is too big to fit in max_payload_bytes by itself. Giving it its own shard.")
+			shard_bytes += row_bytes
+		if start < len(rows):
+			shards.append([header] + rows[start:])
+		return shards
+
+	def make_shards(self, group_name, csv_data_list, country_id='US', custom_field_mapping=None, critical_field_mapping=None):
+		"""
+		Makes one group per csv_data in csv_data_list, named group_name_part_01, group_name_part_02, etc. They all use the same mapping, which defaults to this group's.
+		Stops at the first one that fails.
+		output:
+		list of the ThruTextGroups that were made, in order.
+		"""
+		if custom_field_mapping is None:
+			custom_field_mapping = self.figured_custom
+		if critical_field_mapping is None:
+			critical_field_mapping = self.figured_critical
+		groups = []
+		for part, csv_data in enumerate(csv_data_list, start=1):
+			shard = self.new_shard()
+			if not shard.make_new(name=self.shard_name(group_name, part), custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_data=csv_data, country_id=country_id):
+				print("Error: failed to make " + self.shard_name(group_name, part) + ". Made " + str(len(groups)) + " of " + str(len(csv_data_list)) + " shards.")
+				break
+			groups.append(shard)
+		return groups
+
+	def new_shard(self):
+		"""
+		A blank group w/ the same login and column mapping as this one
+		"""
+		shard = self.__class__(login_manager=self.login_manager)
+		shard.figured_custom = self.figured_custom
+		shard.figured_critical = self.figured_critical
+		return shard
+
+	def from_dataframe_sharded(self, group_name, df, rows_per_shard=None, max_payload_bytes=None, line_by_line_func=None, country_id='US', project_columns=False, frame_transform=None):
+		"""
+		Like from_dataframe, but splits the list up into several groups. Smaller uploads are faster and less likely to time out.
+		See split_csv_data for how rows_per_shard and max_payload_bytes work. The mapping is figured out once, and used for every shard.
+		output:
+		list of the ThruTextGroups that were made, in order. If something went wrong, it'll be shorter than you expected.
+		"""
+		if frame_transform is not None:
+			df = self.apply_frame_transform(df, frame_transform)
+			if df is None:
+				return []
 		if self.figured_custom is None or self.figured_critical is None:
-			self.figure_out_mapping(df.columns.values)
-		csv_data = []
-		csv_data.append(df.columns.values.tolist())
-		for index, row in df.iterrows():
-			raw_row = [v if not pandas.isnull(v) else '' for v in row.values]
-			if line_by_line_func is not None:
-				raw_row = line_by_line_func(raw_row)
-				if raw_row is None:
-					continue
-			csv_data.append(raw_row)
-		return self.make_new(name=group_name, custom_field_mapping=self.figured_custom, critical_field_mapping=self.figured_critical, csv_data=csv_data, country_id=country_id)
-
-	def from_file(self, group_name, filename, line_by_line_func=None, country_id='US'):
-		sep = detect(filename)
-		df = pandas.read_csv(filename, sep=sep, encoding='utf-8', dtype=object)
-		return self.from_dataframe(group_name=group_name, df=df, line_by_line_func=line_by_line_func, country_id=country_id)
+			if not self.figure_out_mapping(df.columns.values):
+				return []
+		columns, custom_field_mapping, critical_field_mapping = self.mapping_to_send(project_columns)
+		if columns is not None:
+			df = df.iloc[:, columns]
+		csv_data = self.dataframe_to_csv_data(df, line_by_line_func=line_by_line_func)
+		csv_data_list = self.split_csv_data(csv_data, rows_per_shard=rows_per_shard, max_payload_bytes=max_payload_bytes, group_name=group_name)
+		if csv_data_list is None:
+			return []
+		return self.make_shards(group_name, csv_data_list, country_id=country_id, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping)
+
+	def from_file_sharded(self, group_name, filename, rows_per_shard=None, max_payload_bytes=None, line_by_line_func=None, country_id='US', project_columns=False, frame_transform=None, deadline=None):
+		"""
+		Like from_file, but splits the list up into several groups. See from_dataframe_sharded.
+		If you only use rows_per_shard, the file is read one shard at a time instead of all at once.
+		deadline (optional) - seconds all the shards get between them. Once it's up, the shards that didn't make it fail. See Deadline.
+		"""
+		with Deadline(deadline):
+			if max_payload_bytes is not None or rows_per_shard is None:
+				df = self.read_file(filename)
+				return self.from_dataframe_sharded(group_name, df, rows_per_shard=rows_per_shard, max_payload_bytes=max_payload_bytes, line_by_line_func=line_by_line_func, country_id=country_id, project_columns=project_columns, frame_transform=frame_transform)
+			groups = []
+			with self.read_file(filename, chunksize=rows_per_shard) as df_chunks:
+				for part, df in enumerate(df_chunks, start=1):
+					if frame_transform is not None:
+						df = self.apply_frame_transform(df, frame_transform)
+						if df is None:
+							return groups
+					if self.figured_custom is None or self.figured_critical is None:
+						if not self.figure_out_mapping(df.columns.values):
+							return groups
+					shard = self.new_shard()
+					if not shard.from_dataframe(group_name=self.shard_name(group_name, part), df=df, line_by_line_func=line_by_line_func, country_id=country_id, project_columns=project_columns):
+						print("Error: failed to make " + self.shard_name(group_name, part) + ". Made " + str(len(groups)) + " shards.")
+						break
+					groups.append(shard)
+			return groups
+
+	@classmethod
+	def bulk_from_files(cls, name_file_pairs, login_manager=None, max_workers=4, line_by_line_func=None, country_id='US', project_columns=False, frame_transform=None, deadline=None, cfi=None):
+		"""
+		Makes a group out of each file, several at a time.
+		All the uploads share one LoginManager, one CustomFieldInterp, and the login manager's session, w/ enough pooled connections for every worker. One file failing doesn't stop the others.
+		input:
+		name_file_pairs - list of (group_name, filename)
+		login_manager (optional) - if not specified, we'll make one for you
+		max_workers (optional) - how many uploads to do at once. defaults to 4
+		line_by_line_func, country_id, project_columns, frame_transform (optional) - passed along to from_dataframe for every file
+		deadline (optional) - seconds all the uploads get between them. Uploads that haven't finished when it's up fail. See Deadline.
+		cfi (optional) - a CustomFieldInterp that's already been set up, same as figure_out_mapping. if not specified, we'll set one up for you
+		output:
+		list of (group_name, filename, group) in the same order as name_file_pairs. group is the ThruTextGroup that was made, or None if it failed.
+		"""
+		if login_manager is None:
+			login_manager = LoginManager()
+		# log in and set up the custom fields once, before any of the workers need them
+		login_manager.ensure_pool_size(max_workers)
+		login_manager.get_session()
+		if cfi is None:
+			cfi = CustomFieldInterp(login_manager=login_manager)
+			cfi.setup(verbose=False)
+
+		def upload(group_name, filename):
+			group = cls(login_manager=login_manager)
+			if frame_transform is not None:
+				# the transform can change the columns, so the mapping has to wait until it's done
+				df = group.apply_frame_transform(group.read_file(filename), frame_transform)
+				if df is None or not group.figure_out_mapping(df.columns.values, cfi=cfi):
+					return None
+				if not group.from_dataframe(group_name=group_name, df=df, line_by_line_func=line_by_line_func, country_id=country_id, project_columns=project_columns):
+					return None
+				return group
+			columns = group.file_columns(filename)
+			if columns is None:
+				print("Error: couldn't read the column headers of " + str(filename))
+				return None
+			if not group.figure_out_mapping(columns, cfi=cfi):
+				return None
+			if not group.from_file(group_name=group_name, filename=filename, line_by_line_func=line_by_line_func, country_id=country_id, project_columns=project_columns):
+				return None
+			return group
+
+		results = []
+		with Deadline(deadline), concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+			futures = [executor.submit(carry_deadline(upload), group_name, filename) for group_name, filename in name_file_pairs]
+			for (group_name, filename), future in zip(name_file_pairs, futures):
+				try:
+					group = future.result()
+				except Exception as e:
+					print("Error: " + str(filename) + " failed w/ " + repr(e))
+					group = None
+				if group is None:
+					print("Error: failed to make group " + str(group_name) + " from " + str(filename))
+				results.append((group_name, filename, group))
+		print("Made " + str(sum(1 for r in results if r[2] is not None)) + " of " + str(len(results)) + " groups.")
+		return results
 
 	def make_new(self, name, custom_field_mapping, critical_field_mapping, csv_data, country_id='US'):
 		"""
@@ -102,8 +527,45 @@ class ThruTextGroup(ThruTextObject):
 
 		country_id : (optional) country_id for the group. Defaults to US
 		"""
+		payload = self.new_group_payload(name=name, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_data=csv_data, country_id=country_id)
+		new_group_response, worked = self.safe_request('post', url=self.base_url, data=payload, headers={})
+		return self.become_new_group(new_group_response, worked)
+
+	async def async_make_new(self, name, custom_field_mapping, critical_field_mapping, csv_data, country_id='US'):
+		"""
+		make_new for asyncio
+		"""
+		payload = self.new_group_payload(name=name, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_data=csv_data, country_id=country_id)
+		new_group_response, worked = await self.async_safe_request('post', url=self.base_url, data=payload, headers={})
+		return self.become_new_group(new_group_response, worked)
+
+	def make_new_streaming(self, name, custom_field_mapping, critical_field_mapping, csv_chunks, country_id='US'):
+		"""
+		Same as make_new, but the csv data comes in pieces and the payload is sent as it's encoded (chunked transfer encoding), so the whole thing is never in memory at once.
+		csv_chunks : iterable of 2-D lists. Put them all together and you'd have make_new's csv_data, so the 1st row of the 1st chunk is the column headers.
+		Since the body can only be read once, this request won't be retried if the connection fails.
+		"""
+		body = self.streaming_payload(name=name, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_chunks=csv_chunks, country_id=country_id)
+		new_group_response, worked = self.safe_request('post', url=self.base_url, raw_data=body, headers={})
+		return self.become_new_group(new_group_response, worked)
 
-		payload = {
+	def become_new_group(self, new_group_response, worked):
+		"""
+		Turns this into the group ThruText sent back after making a new one.
+		"""
+		if not worked:
+			return False
+		try:
+			self.from_dict(self.response_json(new_group_response)['data'])
+		except json.JSONDecodeError:
+			print("Warning: got something weird back from attempt to make new group. This group may not be an accurate representation of what's in ThruText")
+		return True
+
+	def new_group_payload(self, name, custom_field_mapping, critical_field_mapping, csv_data, country_id='US'):
+		"""
+		The payload make_new sends. See make_new for what all the parameters mean.
+		"""
+		return {
 			'data' : {
 				'attributes': {
 					'name' : name,
@@ -118,13 +580,63 @@ class ThruTextGroup(ThruTextObject):
 			}
 		}
 
-		new_group_response, worked = self.safe_request('post', url=self.base_url, data=payload, headers={})
-		if not worked:
+	def streaming_payload(self, name, custom_field_mapping, critical_field_mapping, csv_chunks, country_id='US'):
+		"""
+		Generator that yields new_group_payload as json encoded bytes, one piece per chunk of csv_data.
+		The part of the payload that isn't csv_data gets encoded once w/ a placeholder, and the chunks get spliced in where the placeholder was.
+		"""
+		payload = self.new_group_payload(name=name, custom_field_mapping=custom_field_mapping, critical_field_mapping=critical_field_mapping, csv_data=self.csv_data_placeholder, country_id=country_id)
+		codec = self.login_manager.json_codec
+		head, tail = codec.dumps(payload).rsplit(codec.dumps(self.csv_data_placeholder), 1)
+		yield head + b'['
+		separator = b''
+		for chunk in csv_chunks:
+			if len(chunk) == 0:
+				continue
+			yield separator + codec.dumps(chunk)[1:-1]
+			separator = b','
+		yield b']' + tail
+
+	def is_processed(self):
+		"""
+		Whether ThruText is done w/ this group's import, going by what we last heard about it. A failed upload counts as done.
+		"""
+		if self.upload_failed_reason:
+			return True
+		if self.status in self.processing_statuses:
 			return False
-		try:
-			self.from_dict(json.loads(new_group_response.content)['data'])
-		except json.JSONDecodeError:
-			print("Warning: got something weird back from attempt to make new group. This group may not be an accurate representation of what's in ThruText")
+		return not self.contacts_unvalidated
+
+	def wait_until_processed(self, timeout=600, min_interval=1, max_interval=30):
+		"""
+		Waits for ThruText to finish processing this group. See wait_for_groups.
+		"""
+		return self.wait_for_groups([self], timeout=timeout, min_interval=min_interval, max_interval=max_interval)
+
+	@classmethod
+	def wait_for_groups(cls, groups, timeout=600, min_interval=1, max_interval=30, backoff=2):
+		"""
+		Waits for ThruText to finish processing all of the groups. Checks on the ones that aren't done yet each round, waiting min_interval before the first round and backoff times longer before each one after that, up to max_interval.
+		Each group is kept up to date as it goes, so look at status and upload_failed_reason afterwards to see how they turned out.
+		input:
+		groups - list of ThruTextGroups
+		timeout (optional) - most seconds to wait
+		output:
+		True if they all finished, False if we ran out of time first
+		"""
+		deadline = time.monotonic() + timeout
+		interval = min_interval
+		pending = [g for g in groups if not g.is_processed()]
+		while len(pending) > 0:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				print("Warning: gave up waiting on " + str(len(pending)) + " groups that are still processing: " + ', '.join(str(g.id) for g in pending))
+				return False
+			time.sleep(min(interval, remaining))
+			for group in pending:
+				group.become()
+			pending = [g for g in pending if not g.is_processed()]
+			interval = min(interval * backoff, max_interval)
 		return True
 
 	def get_rid_of(self, other_id=None):
@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 
-import json, time, requests
+import json, time, requests, gzip, zlib, asyncio, math
+import concurrent.futures
+from urllib.parse import urljoin
 from datetime import datetime
 import pytz
 from LoginManager import LoginManager
+from HttpxSession import trace_timings
+from RequestMetrics import route_template
+from Deadline import Deadline, carry_deadline
 import os
 from abc import ABC, abstractmethod
 
+try:
+	import httpx
+except ImportError:
+	httpx = None
+
 class ThruTextObject(ABC):
 	"""
 	A bunch of generically useful stuff that thru_text objects should be able to do
@@ -31,6 +41,9 @@ class ThruTextObject(ABC):
 	# all thru_text objects have an id and a type. This is the type, its meant to make sure you don't have a campaign object representing a group or something like that
 	thru_text_type = None
 
+	# whether the listing endpoint takes filter[id]=1,2,3, so fetch_many can get lots of ids in one request
+	filter_by_ids = False
+
 	@abstractmethod
 	def initialize_values(self):
 		"""
@@ -58,13 +71,14 @@ class ThruTextObject(ABC):
 
 	def configure_login(self, login_manager=None):
 		"""
-		This is where we handle logging in and making a session. From here on out, we assume that's all settled.
+		This is where we handle logging in and getting a session. From here on out, we assume that's all settled.
+		The session is the one the login manager shares, so don't close it unless you're done w/ everything using that login manager.
 		"""
 		if login_manager is None:
 			self.login_manager = LoginManager()
 		else:
 			self.login_manager = login_manager
-		self.session = self.login_manager.create_session()
+		self.session = self.login_manager.get_session()
 		
 	#thru_text objects are structured:
 	# {
@@ -80,11 +94,7 @@ class ThruTextObject(ABC):
 		if self.url_name is None:
 			print("Error: don't have a url name. Should " + str(self.__class__) + " have a custom base url function?")
 			return None
-		if self.login_manager.staging:
-			url_start = 'https://api.relaytxt-staging.io/v1/accounts/'
-		else:
-			url_start = 'https://api.relaytxt.io/v1/accounts/'
-		return url_start+str(self.login_manager.account_number)+'/'+str(self.url_name)
+		return self.login_manager.api_url+'/accounts/'+str(self.login_manager.account_number)+'/'+str(self.url_name)
 
 	@property
 	def display_url(self):
@@ -166,35 +176,371 @@ class ThruTextObject(ABC):
 		result = aware_time.astimezone(pytz.timezone('Etc/Zulu')).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
 		return result 
 		
-	def safe_request(self, method, *, url=None, headers=None, session=None, data=None, includes=None, filters=None):
+	def safe_request(self, method, *, url=None, headers=None, session=None, data=None, raw_data=None, includes=None, filters=None, params=None, compress=None, retry_policy=None, timeout=None):
 		"""
-		A method that makes the request. Automatically retries in cases of failed connections, and displays debug info. We're not trying to reinvent the wheel here, just incldue all the standard debugging stuff you'd do anyway in one place. You ought to be able to use safe_request to make any sort of request you could normally make. If you want to use the methods of the request module directly in your code, that also works, but when extending this code safe_request should be used for uniformity.
+		A method that makes the request. Automatically retries failed connections and responses like 503 (see RetryPolicy), and displays debug info. We're not trying to reinvent the wheel here, just incldue all the standard debugging stuff you'd do anyway in one place. You ought to be able to use safe_request to make any sort of request you could normally make. If you want to use the methods of the request module directly in your code, that also works, but when extending this code safe_request should be used for uniformity.
 		input:
 		method - post, get, delete, etc.
 		url - the url that you're sending the request to
 		headers - dictionary of any additional headers. is added to the ones in the session as normal
 		session - the session to use, if you want to specify a different one than this object normally uses
 		data - the payload of the request AS A DICTIONARY. This method does the json-ing to it
+		raw_data - a payload that's already been encoded, sent as is. Can be str, bytes, or a generator of bytes, which gets streamed w/ chunked transfer encoding. Use this or data, not both.
 		includes - a single include or list of includes as a string. This method does all the needed formatting.
+		filters - dict of filters. {'status': 'active'} is sent as filter[status]=active
+		params - dict of any other query parameters, ie {'page[size]': 100}
+		compress - 'gzip' or 'deflate' to compress the body, False not to. Defaults to what the login manager says (see LoginManager.enable_compression).
+		retry_policy - RetryPolicy to use instead of the login manager's
+		timeout - seconds to wait for each attempt, as a number or a (connect, read) tuple. Defaults to the login manager's connect_timeout and read_timeout (see LoginManager.request_timeout).
+		If the login manager has a response cache (see LoginManager.enable_cache), GETs can be answered from it, and anything else clears what's cached for that url.
+		If the login manager has a rate limiter (see LoginManager.enable_rate_limit), every attempt waits its turn.
+		If the login manager has a circuit breaker (see LoginManager.enable_circuit_breaker), requests to a route that keeps failing aren't sent, and you get back (None, False).
+		Inside a Deadline, timeouts are cut down to the time that's left, and once it's up nothing more gets sent or retried.
 		output:
 		my_request - the standard request object generated by what you asked for. This can be None if for some if you're not online or something like that.
 		working - whether or not the request worked (returned a status_code in the 200 range)
+		Identical GETs made at the same time from different threads share one request (see SingleFlight). Inside a Deadline, you don't wait on someone else's request for longer than you have left.
 		"""
 
 		# get the session we're going to use
 		if session is None:
 			session = self.session
 
+		single_flight = self.login_manager.single_flight
+		if single_flight is None or url is None or str(method).lower() != 'get':
+			return self.send_request(method, url=url, headers=headers, session=session, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress, retry_policy=retry_policy, timeout=timeout)
+		query = self.request_parameters(url=url, headers={}, includes=includes, filters=filters, params=params).get('params')
+		key = single_flight.key(url, query, self.login_manager.token, session, headers)
+		return single_flight.do(key, lambda: self.send_request(method, url=url, headers=headers, session=session, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress, retry_policy=retry_policy, timeout=timeout), timeout=self.single_flight_wait())
+
+	def send_request(self, method, *, url=None, headers=None, session=None, data=None, raw_data=None, includes=None, filters=None, params=None, compress=None, retry_policy=None, timeout=None):
+		"""
+		Where safe_request actually sends a request. Same parameters and output. Use safe_request instead.
+		"""
+		if session is None:
+			session = self.session
+
+		if url is None:
+			print("Error: no url for request!")
+			return False
+		if headers is None:
+			headers = {}
+
+		started = time.perf_counter()
+		request_parameters = self.request_parameters(url=url, headers=headers, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress)
+		cache = self.login_manager.response_cache
+		cache_key, cached = self.check_cache(cache, method, request_parameters)
+		if cached is not None and cached.is_fresh():
+			self.report_request(method, url, started, response=cached.response, cached=True)
+			return cached.response, True
+		body_size = self.body_size(request_parameters)
+		timings = {}
+		rate_limiter = self.login_manager.rate_limiter
+		breaker = self.login_manager.circuit_breaker
+		route = route_template(url)
+		short_circuited = False
+		deadline = Deadline.current()
+		out_of_time = False
+		timeout = self.login_manager.request_timeout(timeout)
+
+		#try to actually do the request
+		if retry_policy is None:
+			retry_policy = self.login_manager.retry_policy
+		max_attempts = retry_policy.max_attempts
+		if raw_data is not None and not isinstance(raw_data, (str, bytes)):
+			# a generator can only be sent once
+			max_attempts = 1
+		response = None
+		try:
+			request_method = getattr(session, method)
+		except AttributeError:
+			print("ERROR: no attribute of session named " + str(method))
+			request_method = None
+		attempt = 0
+		while request_method is not None:
+			if deadline is not None and deadline.expired():
+				out_of_time = True
+				break
+			if breaker is not None and not breaker.allow(route):
+				short_circuited = True
+				break
+			attempt += 1
+			try:
+				if rate_limiter is not None:
+					rate_limiter.acquire(method)
+					if deadline is not None and deadline.expired():
+						# waiting our turn used up what was left
+						out_of_time = True
+						if breaker is not None:
+							breaker.release(route)
+						break
+				response = request_method(timeout=deadline.timeout(timeout) if deadline is not None else timeout, **request_parameters)
+				if getattr(response, 'timings', None) is not None:
+					# HttpxSession times each part of the request
+					for phase, seconds in response.timings.items():
+						timings[phase] = timings.get(phase, 0.0) + seconds
+				elif getattr(response, 'elapsed', None) is not None:
+					timings['server'] = timings.get('server', 0.0) + response.elapsed.total_seconds()
+				if rate_limiter is not None:
+					rate_limiter.observe(method, response)
+				if breaker is not None:
+					breaker.record(route, breaker.is_failure(response=response))
+			except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+				# a connect timeout is a ConnectionError. a read timeout isn't, and the server might have gotten the request
+				response = None
+				if breaker is not None:
+					breaker.record(route, True)
+				if not retry_policy.should_retry(method, attempt, error=e, max_attempts=max_attempts, sent=not isinstance(e, requests.exceptions.ConnectionError)):
+					break
+				reason = repr(e)
+			except BaseException:
+				# a half open circuit is waiting to hear how this went, so even something we didn't expect counts
+				if breaker is not None:
+					breaker.record(route, True)
+				raise
+			else:
+				if not retry_policy.should_retry(method, attempt, response=response, max_attempts=max_attempts):
+					break
+				reason = response.status_code
+			delay = retry_policy.start_retry(method=method, url=url, attempt=attempt, reason=reason, response=response, deadline=deadline)
+			if delay is None:
+				out_of_time = True
+				break
+			print("Warning: " + str(method) + " " + str(url) + " got " + str(reason) + ". Trying again (attempt " + str(attempt + 1) + " of " + str(max_attempts) + ").")
+			time.sleep(delay)
+
+		self.report_request(method, url, started, response=response, retries=max(0, attempt - 1), request_bytes=body_size['bytes'], timings=timings, breaker=breaker, short_circuited=short_circuited)
+		if short_circuited or out_of_time:
+			if short_circuited:
+				self.print_short_circuited(method, url, route, attempt)
+			else:
+				self.print_out_of_time(method, url, deadline, attempt)
+			if response is None:
+				return None, False
+		if cache is not None:
+			response = cache.after_request(method, url, cache_key, cached, response)
+		return self.check_response(response, method=method, url=url, headers=headers, includes=includes, data=data, raw_data=raw_data)
+
+	async def async_safe_request(self, method, *, url=None, headers=None, data=None, raw_data=None, includes=None, filters=None, params=None, compress=None, retry_policy=None, timeout=None):
+		"""
+		safe_request for asyncio. Same parameters (but no session) and the same output, except the response is an httpx.Response.
+		Requests go through the login manager's async client, no more than login_manager.async_concurrency at a time. See LoginManager.get_async_client.
+		If httpx isn't installed, or raw_data is a generator (which an async client can't send), this runs safe_request in a thread instead.
+		"""
+		single_flight = self.login_manager.single_flight
+		if single_flight is None or url is None or str(method).lower() != 'get':
+			return await self.async_send_request(method, url=url, headers=headers, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress, retry_policy=retry_policy, timeout=timeout)
+		query = self.request_parameters(url=url, headers={}, includes=includes, filters=filters, params=params).get('params')
+		key = single_flight.key(url, query, self.login_manager.token, None, headers)
+		return await single_flight.async_do(key, lambda: self.async_send_request(method, url=url, headers=headers, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress, retry_policy=retry_policy, timeout=timeout), timeout=self.single_flight_wait())
+
+	def single_flight_wait(self):
+		"""
+		Most seconds to wait on someone else's identical GET (see SingleFlight), which is however long our Deadline has left. None if we don't have one.
+		Once it's up, we make the request ourselves, which w/ the deadline gone returns (None, False) straight away.
+		"""
+		deadline = Deadline.current()
+		if deadline is None or deadline.expires == math.inf:
+			return None
+		return deadline.remaining()
+
+	async def async_send_request(self, method, *, url=None, headers=None, data=None, raw_data=None, includes=None, filters=None, params=None, compress=None, retry_policy=None, timeout=None):
+		"""
+		Where async_safe_request actually sends a request. Use async_safe_request instead.
+		"""
+		client, semaphore = self.login_manager.get_async_client()
+		if client is None or (raw_data is not None and not isinstance(raw_data, (str, bytes))):
+			async with semaphore:
+				return await asyncio.to_thread(self.safe_request, method, url=url, headers=headers, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress, retry_policy=retry_policy, timeout=timeout)
+
 		if url is None:
 			print("Error: no url for request!")
 			return False
 		if headers is None:
 			headers = {}
+		request_parameters = self.request_parameters(url=url, headers=headers, data=data, raw_data=raw_data, includes=includes, filters=filters, params=params, compress=compress)
+		started = time.perf_counter()
+		request_parameters['content'] = request_parameters.pop('data', None)
+		cache = self.login_manager.response_cache
+		cache_key, cached = self.check_cache(cache, method, request_parameters)
+		if cached is not None and cached.is_fresh():
+			self.report_request(method, url, started, response=cached.response, cached=True)
+			return cached.response, True
+		request_bytes = len(request_parameters['content'] or b'')
+		timings = {}
+		if self.login_manager.request_hooks:
+			request_parameters['extensions'] = {'trace': trace_timings(timings, asynchronous=True)}
+		rate_limiter = self.login_manager.rate_limiter
+		breaker = self.login_manager.circuit_breaker
+		route = route_template(url)
+		short_circuited = False
+		deadline = Deadline.current()
+		out_of_time = False
+		timeout = self.login_manager.request_timeout(timeout)
+
+		if retry_policy is None:
+			retry_policy = self.login_manager.retry_policy
+		response = None
+		attempt = 0
+		while True:
+			if deadline is not None and deadline.expired():
+				out_of_time = True
+				break
+			if breaker is not None and not breaker.allow(route):
+				short_circuited = True
+				break
+			attempt += 1
+			try:
+				if rate_limiter is not None:
+					await rate_limiter.async_acquire(method)
+					if deadline is not None and deadline.expired():
+						out_of_time = True
+						if breaker is not None:
+							breaker.release(route)
+						break
+				connect_timeout, read_timeout = deadline.timeout(timeout) if deadline is not None else timeout
+				async with semaphore:
+					response = await client.request(str(method).upper(), timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **request_parameters)
+				if rate_limiter is not None:
+					rate_limiter.observe(method, response)
+				if breaker is not None:
+					breaker.record(route, breaker.is_failure(response=response))
+			except httpx.TransportError as e:
+				response = None
+				if breaker is not None:
+					breaker.record(route, True)
+				if not retry_policy.should_retry(method, attempt, error=e, sent=isinstance(e, (httpx.ReadTimeout, httpx.WriteTimeout))):
+					break
+				reason = repr(e)
+			except asyncio.CancelledError:
+				# whoever cancelled us didn't find out anything about the route
+				if breaker is not None:
+					breaker.release(route)
+				raise
+			except BaseException:
+				if breaker is not None:
+					breaker.record(route, True)
+				raise
+			else:
+				if not retry_policy.should_retry(method, attempt, response=response):
+					break
+				reason = response.status_code
+			delay = retry_policy.start_retry(method=method, url=url, attempt=attempt, reason=reason, response=response, deadline=deadline)
+			if delay is None:
+				out_of_time = True
+				break
+			print("Warning: " + str(method) + " " + str(url) + " got " + str(reason) + ". Trying again (attempt " + str(attempt + 1) + " of " + str(retry_policy.max_attempts) + ").")
+			await asyncio.sleep(delay)
+
+		self.report_request(method, url, started, response=response, retries=max(0, attempt - 1), request_bytes=request_bytes, timings=timings, breaker=breaker, short_circuited=short_circuited)
+		if short_circuited or out_of_time:
+			if short_circuited:
+				self.print_short_circuited(method, url, route, attempt)
+			else:
+				self.print_out_of_time(method, url, deadline, attempt)
+			if response is None:
+				return None, False
+		if cache is not None:
+			response = cache.after_request(method, url, cache_key, cached, response)
+		return self.check_response(response, method=method, url=url, headers=headers, includes=includes, data=data, raw_data=raw_data)
 
+	def check_response(self, response, *, method, url, headers, includes=None, data=None, raw_data=None):
+		"""
+		returns response, and whether it worked. Prints out what happened if it didn't.
+		"""
+		try:
+			if response.status_code < 200 or response.status_code >= 300:
+				self.print_failed_request(response, method=method, url=url, headers=headers, includes=includes, data=data, raw_data=raw_data)
+				return response, False
+		except AttributeError:
+			print("ERROR: something is weird with the request after safe_request.")
+			return response, False
+		return response, True
+
+	def check_cache(self, cache, method, request_parameters):
+		"""
+		Looks for a GET in the login manager's response cache. returns (cache key, CachedResponse or None).
+		If what we have is stale, the If-None-Match/If-Modified-Since headers are added to request_parameters so ThruText can tell us it hasn't changed.
+		"""
+		if cache is None or str(method).lower() != 'get':
+			return None, None
+		cache_key = cache.key(request_parameters['url'], request_parameters.get('params'), self.login_manager.token)
+		cached = cache.lookup(cache_key)
+		if cached is not None and not cached.is_fresh():
+			request_parameters['headers'] = dict(request_parameters['headers'], **cached.conditional_headers())
+		return cache_key, cached
+
+	def body_size(self, request_parameters):
+		"""
+		Returns {'bytes': size of the request body}. A streamed body gets wrapped so the size adds up as it's sent, but only if someone's listening (see LoginManager.add_request_hook).
+		"""
+		body = request_parameters.get('data')
+		if body is None or isinstance(body, (str, bytes)):
+			return {'bytes': len(body or '')}
+		body_size = {'bytes': 0}
+		if self.login_manager.request_hooks:
+			request_parameters['data'] = self.counting_stream(body, body_size)
+		return body_size
+
+	def counting_stream(self, chunks, body_size):
+		for chunk in chunks:
+			body_size['bytes'] += len(chunk)
+			yield chunk
+
+	def report_request(self, method, url, started, *, response=None, retries=0, request_bytes=0, cached=False, timings=None, breaker=None, short_circuited=False):
+		"""
+		Tells the login manager's request hooks how a request went. See LoginManager.notify_request.
+		"""
+		if not self.login_manager.request_hooks:
+			return
+		timings = timings or {}
+		self.login_manager.notify_request(
+			method=str(method).lower(), url=str(url), route=route_template(url),
+			status=getattr(response, 'status_code', None), retries=retries,
+			request_bytes=request_bytes, response_bytes=0 if cached or response is None else len(getattr(response, 'content', None) or b''),
+			connect=timings.get('connect'), tls=timings.get('tls'), server=timings.get('server'),
+			total=time.perf_counter() - started, cached=cached,
+			circuit=None if breaker is None else breaker.state(route_template(url)), short_circuited=short_circuited,
+		)
+
+	def print_short_circuited(self, method, url, route, attempt):
+		if attempt == 0:
+			print("Error: didn't send " + str(method) + " " + str(url) + " because " + str(route) + " keeps failing (its circuit breaker is open).")
+		else:
+			print("Error: stopped retrying " + str(method) + " " + str(url) + " because " + str(route) + " keeps failing (its circuit breaker is open).")
+
+	def print_out_of_time(self, method, url, deadline, attempt):
+		if attempt == 0:
+			print("Error: didn't send " + str(method) + " " + str(url) + " because its deadline (" + str(deadline.seconds) + "s) is up.")
+		else:
+			print("Error: stopped retrying " + str(method) + " " + str(url) + " after " + str(attempt) + " attempts because its deadline (" + str(deadline.seconds) + "s) is up.")
+
+	def response_json(self, response):
+		"""
+		The body of a response from safe_request, parsed w/ the login manager's json codec. It's only parsed once, so ask for it as often as you like, but don't change it.
+		"""
+		return self.login_manager.json_codec.decode(response)
+
+	def request_parameters(self, *, url, headers, data=None, raw_data=None, includes=None, filters=None, params=None, compress=None):
+		"""
+		The keyword arguments for a requests.Session method, made from safe_request's parameters.
+		"""
 		# stuff all the parameters into a dict, w/ some formatting as you go
 		request_parameters = {'url':url, 'headers':headers}
 		if data is not None:
-			request_parameters['data'] = json.dumps(data)
+			request_parameters['data'] = self.login_manager.json_codec.dumps(data)
+		elif raw_data is not None:
+			request_parameters['data'] = raw_data
+		if compress is None:
+			compress = self.login_manager.request_compression
+		if compress and compress not in ['gzip', 'deflate']:
+			print("Warning: don't know how to compress with " + str(compress) + ". Sending it uncompressed.")
+			compress = False
+		if compress and request_parameters.get('data') is not None:
+			compressed = self.compress_body(request_parameters['data'], compress)
+			if compressed is not None:
+				request_parameters['data'] = compressed
+				request_parameters['headers'] = dict(headers, **{'Content-Encoding': compress})
 		if includes is not None:
 			if request_parameters.get('params') is None:
 				request_parameters['params'] = {}
@@ -205,42 +551,52 @@ class ThruTextObject(ABC):
 		if filters is not None:
 			if request_parameters.get('params') is None:
 				request_parameters['params'] = {}
-			filter_str = ''
 			for key, value in filters.items():
 				request_parameters['params']['filter['+str(key)+']'] = str(value)
+		if params is not None:
+			request_parameters['params'] = dict(request_parameters.get('params') or {}, **params)
+		return request_parameters
 
-		#try to actually do the request
-		max_tries = 3
-		tries = 0
-		connected = False
-		response = None
-		while not connected and tries < max_tries:
-			try:
-				response = getattr(session, method)(**request_parameters)
-				connected = True
-			except requests.exceptions.ConnectionError:
-				tries += 1
-			except AttributeError:
-				print("ERROR: no attribute of session named " + str(method))
-				break
+	def print_failed_request(self, response, *, method, url, headers, includes=None, data=None, raw_data=None):
+		print("status_code: " + str(response.status_code))
+		print("text:        " + str(response.text))
+		print("method:      " + str(method))
+		print("url:         " + str(url))
+		print("headers:     " + str(headers))
+		if includes is not None:
+			print("includes:    " + str(includes))
+		if data is not None:
+			print("data:     " + str(data))
+		elif raw_data is not None:
+			print("raw_data: " + (str(raw_data) if isinstance(raw_data, (str, bytes)) else '<streamed>'))
 
-		#did it work?
-		try:
-			if response.status_code < 200 or response.status_code >= 300:
-				print("status_code: " + str(response.status_code))
-				print("text:        " + str(response.text))
-				print("method:      " + str(method))
-				print("url:         " + str(url))
-				print("headers:     " + str(headers))
-				if includes is not None:
-					print("includes:    " + str(includes))
-				if data is not None:
-					print("data:     " + str(data))
-				return response, False
-		except AttributeError:
-			print("ERROR: something is weird with the request after safe_request.")
-			return response, False
-		return response, True
+	def compress_body(self, body, encoding):
+		"""
+		Compresses a request body w/ gzip or deflate.
+		str and bytes bodies under the login manager's compression_threshold aren't worth it, so you get None back for those. Generators get wrapped in a generator that compresses as it goes.
+		"""
+		level = self.login_manager.compression_level
+		if isinstance(body, str):
+			body = body.encode('utf-8')
+		if isinstance(body, bytes):
+			if len(body) < self.login_manager.compression_threshold:
+				return None
+			if encoding == 'gzip':
+				return gzip.compress(body, compresslevel=level)
+			return zlib.compress(body, level)
+		return self.compress_stream(body, encoding)
+
+	def compress_stream(self, chunks, encoding):
+		"""
+		Generator that compresses a stream of bytes w/ gzip or deflate.
+		"""
+		# wbits 31 makes a gzip header, 15 a zlib one (which is what http calls deflate)
+		compressor = zlib.compressobj(self.login_manager.compression_level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+		for chunk in chunks:
+			compressed = compressor.compress(chunk)
+			if compressed:
+				yield compressed
+		yield compressor.flush()
 
 	def become(self, become_id=None, *, includes=None):
 		"""
@@ -253,11 +609,95 @@ class ThruTextObject(ABC):
 		if not worked:
 			return False
 		try:
-			self.from_dict(json.loads(future_me_request.content)['data'])
+			self.from_dict(self.response_json(future_me_request)['data'])
 		except KeyError:
 			return False
 		return self.type == self.thru_text_type
 
+	async def async_become(self, become_id=None, *, includes=None):
+		"""
+		become for asyncio
+		"""
+		if become_id is None:
+			become_id = self.id
+		url = self.base_url+'/'+str(become_id)
+		future_me_request, worked = await self.async_safe_request('get', url=url, headers={}, includes=includes)
+		if not worked:
+			return False
+		try:
+			self.from_dict(self.response_json(future_me_request)['data'])
+		except KeyError:
+			return False
+		return self.type == self.thru_text_type
+
+	@classmethod
+	def fetch_many(cls, ids, login_manager=None, includes=None, max_workers=8, use_filter=None, batch_size=100):
+		"""
+		become for a whole list of ids at once. Instead of one round trip after another, the GETs run max_workers at a time over the login manager's shared session.
+		input:
+		ids - list of ids. Duplicates are only fetched once.
+		login_manager (optional) - if not specified, we'll make one for you
+		includes (optional) - same as become
+		max_workers (optional) - how many requests to have going at once. defaults to 8
+		use_filter (optional) - ask for batch_size ids at a time w/ one filter[id]=1,2,3 listing instead of a GET each. Defaults to filter_by_ids. Anything the listing doesn't return gets fetched one at a time.
+		output:
+		list of (id, thru_text_object, error) in the same order as ids. thru_text_object is None if we couldn't get it, and error says why.
+		"""
+		if login_manager is None:
+			login_manager = LoginManager()
+		if use_filter is None:
+			use_filter = cls.filter_by_ids
+		login_manager.ensure_pool_size(max_workers)
+		template = cls(login_manager=login_manager)
+		unique_ids = list(dict.fromkeys(str(i) for i in ids))
+		found = {}
+		errors = {}
+
+		def fetch_batch(batch):
+			# ask for the whole batch in one page, but follow links.next in case ThruText won't make pages that big
+			object_list = []
+			for page in template.iter_pages(page_size=len(batch), filters={'id': ','.join(batch)}, includes=includes):
+				if page is None:
+					break
+				object_list.extend(page)
+				if len(object_list) >= len(batch):
+					break
+			return object_list
+
+		def fetch_one(one_id):
+			response, worked = template.safe_request('get', url=template.base_url+'/'+one_id, headers={}, includes=includes)
+			if not worked:
+				raise LookupError('got ' + str(getattr(response, 'status_code', response)))
+			return template.response_json(response)['data']
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+			if use_filter:
+				batches = [unique_ids[i:i+batch_size] for i in range(0, len(unique_ids), batch_size)]
+				for batch, future in zip(batches, [executor.submit(carry_deadline(fetch_batch), batch) for batch in batches]):
+					try:
+						object_list = future.result()
+					except Exception as e:
+						print("Warning: listing " + str(cls.url_name) + " by id failed w/ " + repr(e) + ". Getting them one at a time.")
+						continue
+					wanted = set(batch)
+					for in_dict in object_list:
+						if str(in_dict.get('id')) in wanted:
+							found[str(in_dict['id'])] = in_dict
+			missing = [one_id for one_id in unique_ids if one_id not in found]
+			for one_id, future in zip(missing, [executor.submit(carry_deadline(fetch_one), one_id) for one_id in missing]):
+				try:
+					found[one_id] = future.result()
+				except Exception as e:
+					errors[one_id] = str(e) if isinstance(e, LookupError) else repr(e)
+
+		objects = {str(o.id): o for o in cls.from_dicts(list(found.values()), login_manager=login_manager) if o.type == cls.thru_text_type}
+		for one_id in found:
+			if one_id not in objects:
+				errors[one_id] = 'not a ' + str(cls.thru_text_type)
+		if len(errors) > 0:
+			print("Error: couldn't get " + str(len(errors)) + " of " + str(len(unique_ids)) + " " + str(cls.url_name) + ".")
+		return [(one_id, objects.get(str(one_id)), errors.get(str(one_id))) for one_id in ids]
+
 	@abstractmethod
 	def get_rid_of(self, other_id=None):
 		"""
@@ -281,21 +721,183 @@ class ThruTextObject(ABC):
 		archive, worked = self.safe_request('post', url=url, headers={}, data=payload)
 		return worked
 
+	async def async_archive(self, archive_id=None):
+		"""
+		archive for asyncio
+		"""
+		if archive_id is None:
+			archive_id = self.id
+		url = self.base_url+'/'+str(archive_id)+'/archive'
+		archive, worked = await self.async_safe_request('post', url=url, headers={}, data={})
+		return worked
+
+	async def async_make_new(self, *args, **kwargs):
+		"""
+		make_new for asyncio. Takes whatever this object's make_new does.
+		Runs make_new in a thread, unless the object has a real async version. Counts against login_manager.async_concurrency like any other async_ request.
+		"""
+		client, semaphore = self.login_manager.get_async_client()
+		async with semaphore:
+			return await asyncio.to_thread(self.make_new, *args, **kwargs)
+
 	def list_all(self, filters=None, includes=None):
 		"""
 		Returns a list of all of this object represented as the appropriate type of ThruText object
+		Follows links.next if ThruText splits the list into pages. Returns None if any page fails, rather than part of the list.
 		You will frequently want to filter by active only. Example: TODO
 		"""
-		object_list_request, worked = self.safe_request('get', url=self.base_url, headers={}, includes=includes, filters=filters)
+		result = []
+		for object_list in self.iter_pages(prefetch=False, filters=filters, includes=includes):
+			if object_list is None:
+				return None
+			result.extend(self.from_dicts(object_list, login_manager=self.login_manager))
+		return result
+
+	def iter_all(self, page_size=None, prefetch=True, filters=None, includes=None):
+		"""
+		Generator version of list_all. Yields the objects a page at a time, so you get the first one after one request and only have a page or two in memory at once.
+		input:
+		page_size (optional) - how many to ask for per page (page[size]). If not specified, ThruText decides.
+		prefetch (optional) - get the next page in the background while you're working on this one. defaults to True
+		filters, includes (optional) - same as list_all
+		If a page fails, this prints an error and stops, so check for that if you need everything.
+		"""
+		for object_list in self.iter_pages(page_size=page_size, prefetch=prefetch, filters=filters, includes=includes):
+			if object_list is None:
+				print("Error: stopped listing " + str(self.url_name) + " because a page failed.")
+				return
+			for thru_text_object in self.from_dicts(object_list, login_manager=self.login_manager):
+				yield thru_text_object
+
+	def iter_pages(self, page_size=None, prefetch=False, filters=None, includes=None):
+		"""
+		Generator that yields the list of dicts in each page of the listing of this object, or None (and then stops) if a page fails.
+		w/ prefetch, the next page is requested in a background thread as soon as we know where it is.
+		"""
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if prefetch else None
+		def start(page):
+			if executor is None:
+				return page
+			return executor.submit(carry_deadline(self.get_page), page)
+		def finish(started):
+			if executor is None:
+				return self.get_page(started)
+			return started.result()
+
+		page = {'url': self.base_url, 'params': None if page_size is None else {'page[size]': page_size}, 'filters': filters, 'includes': includes}
+		seen = {'urls': set(), 'pages': set()}
+		started = start(page)
+		try:
+			while started is not None:
+				content = finish(started)
+				if content is None:
+					yield None
+					return
+				if self.is_repeat_page(content['data'], seen):
+					return
+				page = self.next_page(content, page, page_size, seen)
+				started = start(page) if page is not None else None
+				yield content['data']
+		finally:
+			if executor is not None:
+				executor.shutdown(wait=False, cancel_futures=True)
+
+	def get_page(self, page):
+		"""
+		Gets one page of a listing. page is a dict of url, params, filters and includes, like next_page makes.
+		returns the response as a dict, or None if it didn't work.
+		"""
+		response, worked = self.safe_request('get', url=page['url'], headers={}, params=page['params'], filters=page['filters'], includes=page['includes'])
 		if not worked:
 			return None
-		object_list = json.loads(object_list_request.content)['data']
+		try:
+			content = self.response_json(response)
+			content['data']
+		except (json.JSONDecodeError, KeyError):
+			print("Error: got something weird back listing " + str(page['url']))
+			return None
+		return content
+
+	def next_page(self, content, page, page_size, seen):
+		"""
+		Where to get the page after this one, or None if this was the last page.
+		Follows links.next if ThruText gave us one. If it never has, and we asked for pages of page_size and got a full one, asks for the next page[number].
+		"""
+		next_url = (content.get('links') or {}).get('next')
+		if next_url:
+			next_url = urljoin(str(self.base_url), next_url)
+			if next_url in seen['urls']:
+				print("Warning: ThruText's next page is one we've already seen (" + next_url + "). Stopping there.")
+				return None
+			seen['urls'].add(next_url)
+			# the filters and includes are already in the link
+			return {'url': next_url, 'params': None, 'filters': None, 'includes': None}
+		if page_size is None or len(seen['urls']) > 0 or len(content['data']) < page_size:
+			return None
+		params = dict(page['params'] or {})
+		params['page[size]'] = page_size
+		params['page[number]'] = int(params.get('page[number]', 1)) + 1
+		return dict(page, params=params)
+
+	def is_repeat_page(self, object_list, seen):
+		"""
+		Whether we've already gotten a page w/ exactly these objects, which means ThruText is ignoring our paging and we'd go around forever.
+		"""
+		if len(object_list) == 0:
+			return False
+		ids = hash(tuple(str(o.get('id')) for o in object_list))
+		if ids in seen['pages']:
+			print("Warning: got the same page of " + str(self.url_name) + " twice. Stopping there.")
+			return True
+		seen['pages'].add(ids)
+		return False
+
+	async def async_list_all(self, filters=None, includes=None):
+		"""
+		list_all for asyncio
+		"""
+		result = []
+		page = {'url': self.base_url, 'params': None, 'filters': filters, 'includes': includes}
+		seen = {'urls': set(), 'pages': set()}
+		while page is not None:
+			response, worked = await self.async_safe_request('get', url=page['url'], headers={}, params=page['params'], filters=page['filters'], includes=page['includes'])
+			if not worked:
+				return None
+			content = self.response_json(response)
+			if self.is_repeat_page(content['data'], seen):
+				break
+			result.extend(self.from_dicts(content['data'], login_manager=self.login_manager))
+			page = self.next_page(content, page, None, seen)
+		return result
+
+	@classmethod
+	def from_dicts(cls, dict_list, login_manager):
+		"""
+		Makes one of these out of each dictionary, like calling the constructor w/ in_dict on each one, but much faster when there are a lot of them.
+		Logging in and initialize_values only happen once, for a template object. Every new object starts as a copy of the template (w/ its own copies of any lists, dicts or sets) and shares login_manager's session.
+		Skips any dictionary from_dict can't handle.
+		"""
+		template = cls.__new__(cls)
+		template.id = None
+		template.type = None
+		template.default_timezone = None
+		template.login_manager = login_manager
+		template.session = login_manager.get_session()
+		template.initialize_values()
+		template_state = template.__dict__
+		mutable_names = [name for name, value in template_state.items() if isinstance(value, (list, dict, set))]
 		result = []
-		for ol in object_list:
+		for in_dict in dict_list:
+			hydrated = cls.__new__(cls)
+			state = hydrated.__dict__
+			state.update(template_state)
+			for name in mutable_names:
+				state[name] = template_state[name].copy()
 			try:
-				result.append(self.__class__(in_dict=ol, login_manager=self.login_manager))
+				hydrated.from_dict(in_dict)
 			except KeyError:
-				pass
+				continue
+			result.append(hydrated)
 		return result
 
 class ConcreteThruTextObject(ThruTextObject):
@@ -321,13 +923,31 @@ class ConcreteThruTextObject(ThruTextObject):
 	def get_rid_of(self, other_id=None):
 		pass
 
-import unittest
+import unittest, threading
+from RetryPolicy import RetryPolicy
+from SingleFlight import SingleFlight
+from FakeThruText import FakeThruTextServer
+from FakeSession import FakeResponse, FakeSession
 
 class TestGenericThruTextObject(unittest.TestCase):
 	"""
 	Tests for functions that are not likely to be overriden by inheriting classes, like configure_login or any of the datetime to string functions.
+	Set the environment variable THRU_TEXT_OFFLINE to run against a FakeThruTextServer instead of ThruText.
 	"""
 
+	fake_server = None
+
+	@classmethod
+	def setUpClass(cls):
+		super(TestGenericThruTextObject, cls).setUpClass()
+		cls.fake_server = FakeThruTextServer.for_offline_tests()
+
+	@classmethod
+	def tearDownClass(cls):
+		super(TestGenericThruTextObject, cls).tearDownClass()
+		if cls.fake_server is not None:
+			cls.fake_server.stop()
+
 	def prove_session_works(self, session, base_url):
 		response = session.get(url=base_url+'groups', headers={})
 		return (response.status_code >= 200 and response.status_code < 300)
@@ -357,9 +977,341 @@ class TestGenericThruTextObject(unittest.TestCase):
 		assert self.prove_session_works(testing.session, testing.base_url)
 		testing.session.close()
 
+	def test_objects_share_session(self):
+		lm = LoginManager(fake=True, pool_size=2)
+		one = ConcreteThruTextObject(login_manager=lm)
+		two = ConcreteThruTextObject(login_manager=lm)
+		assert one.session is two.session
+		lm.token = 'new_fake'
+		assert lm.get_session() is one.session
+		self.assert_same(one.session.headers['Authorization'], 'Token token="new_fake"', 'test_objects_share_session_relogin')
+		closed = []
+		old_adapter = one.session.get_adapter('https://api.relaytxt.io')
+		old_adapter.close = lambda: closed.append(old_adapter)
+		lm.ensure_pool_size(8)
+		self.assert_same(one.session.get_adapter('https://api.relaytxt.io')._pool_maxsize, 8, 'test_objects_share_session_pool_size')
+		self.assert_same(closed, [old_adapter], 'test_objects_share_session_old_pool_closed')
+
+	def test_safe_request_retries(self):
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		retries = []
+		lm.retry_policy.add_hook(lambda **kwargs: retries.append(kwargs['reason']))
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession([requests.exceptions.ConnectionError(), FakeResponse(503, {'Retry-After': '0'}), FakeResponse(200)])
+		response, worked = tto.safe_request('get', url='https://example.com', session=session)
+		assert worked
+		self.assert_same(len(session.calls), 3, 'test_safe_request_retries_get')
+		self.assert_same(retries[1], 503, 'test_safe_request_retries_reason')
+		session = FakeSession([FakeResponse(503)])
+		response, worked = tto.safe_request('post', url='https://example.com', session=session, data={})
+		assert not worked
+		self.assert_same(len(session.calls), 1, 'test_safe_request_retries_post')
+
+	def test_request_hooks(self):
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		metrics = lm.enable_metrics()
+		events = []
+		lm.add_request_hook(lambda **event: events.append(event))
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession([FakeResponse(503), FakeResponse(200, content=b'{"data": []}'), FakeResponse(201)])
+		tto.safe_request('get', url='https://api.relaytxt.io/v1/accounts/0000000001/groups/5', session=session)
+		tto.safe_request('post', url='https://api.relaytxt.io/v1/accounts/0000000001/groups', session=session, raw_data=(b'x' * 10 for i in range(3)))
+		self.assert_same([(e['method'], e['route'], e['status'], e['retries']) for e in events], [('get', '/v1/accounts/:id/groups/:id', 200, 1), ('post', '/v1/accounts/:id/groups', 201, 0)], 'test_request_hooks_events')
+		self.assert_same(events[0]['response_bytes'], 12, 'test_request_hooks_response_bytes')
+		self.assert_same(events[1]['request_bytes'], 30, 'test_request_hooks_request_bytes')
+		self.assert_same(metrics.routes[('get', '/v1/accounts/:id/groups/:id')].count, 1, 'test_request_hooks_metrics')
+
+	def test_safe_request_rate_limit(self):
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		limiter = lm.enable_rate_limit(reads_per_second=50, read_burst=1)
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession([FakeResponse(429), FakeResponse(200)])
+		start = time.monotonic()
+		for i in range(4):
+			tto.safe_request('get', url='https://example.com/groups', session=session)
+		assert time.monotonic() - start >= 4 / 50.0
+		self.assert_same(len(session.calls), 5, 'test_safe_request_rate_limit_calls')
+		self.assert_same(limiter.throttled, 1, 'test_safe_request_rate_limit_throttled')
+
+	def test_safe_request_circuit_breaker(self):
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		breaker = lm.enable_circuit_breaker(failure_threshold=4, reset_timeout=60)
+		events = []
+		lm.add_request_hook(lambda **event: events.append(event))
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession([FakeResponse(503)])
+		url = 'https://api.relaytxt.io/v1/accounts/1/groups/'
+		first, worked = tto.safe_request('get', url=url + '5', session=session)
+		assert not worked and first.status_code == 503
+		second, worked = tto.safe_request('get', url=url + '6', session=session)
+		assert not worked and second.status_code == 503
+		third, worked = tto.safe_request('get', url=url + '7', session=session)
+		assert third is None and not worked
+		self.assert_same(len(session.calls), 4, 'test_safe_request_circuit_breaker_calls')
+		self.assert_same([(e['circuit'], e['short_circuited']) for e in events], [('closed', False), ('open', True), ('open', True)], 'test_safe_request_circuit_breaker_events')
+
+	def test_safe_request_circuit_breaker_lost_probe(self):
+		lm = LoginManager(fake=True)
+		lm.single_flight = None
+		breaker = lm.enable_circuit_breaker(failure_threshold=1, reset_timeout=0.05)
+		tto = ConcreteThruTextObject(login_manager=lm)
+		url = 'https://api.relaytxt.io/v1/accounts/1/groups'
+		breaker.record(route_template(url), True)
+		time.sleep(0.06)
+		with self.assertRaises(ValueError):
+			tto.safe_request('get', url=url, session=FakeSession([ValueError('Invalid timeout')]))
+		self.assert_same(breaker.state(route_template(url)), 'open', 'test_safe_request_circuit_breaker_lost_probe_sync')
+		time.sleep(0.06)
+		response, worked = tto.safe_request('get', url=url, session=FakeSession([FakeResponse(200)]))
+		assert worked and breaker.state(route_template(url)) == 'closed'
+		if httpx is None:
+			return
+		async def hang(request):
+			await asyncio.sleep(10)
+		lm.async_client_kwargs = {'transport': httpx.MockTransport(hang)}
+		breaker.record(route_template(url), True)
+		time.sleep(0.06)
+		async def run():
+			try:
+				probe = asyncio.ensure_future(tto.async_safe_request('get', url=url))
+				await asyncio.sleep(0.02)
+				probe.cancel()
+				with self.assertRaises(asyncio.CancelledError):
+					await probe
+			finally:
+				await lm.aclose()
+		asyncio.run(run())
+		assert breaker.allow(route_template(url))
+
+	def test_safe_request_deadline(self):
+		def respond(method, **kwargs):
+			if method == 'get':
+				return FakeResponse(503, {'Retry-After': '0.04'})
+			return requests.exceptions.ReadTimeout('read timed out')
+		lm = LoginManager(fake=True, connect_timeout=3, read_timeout=30)
+		lm.retry_policy.max_attempts = 100
+		lm.single_flight = None
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession(respond=respond)
+		tto.safe_request('get', url='https://example.com/groups', session=session, retry_policy=RetryPolicy(max_attempts=1))
+		tto.safe_request('get', url='https://example.com/groups', session=session, retry_policy=RetryPolicy(max_attempts=1), timeout=5)
+		self.assert_same(session.sent('timeout'), [(3, 30), (5, 5)], 'test_safe_request_deadline_timeouts')
+		session.calls = []
+		start = time.monotonic()
+		with Deadline(0.2):
+			response, worked = tto.safe_request('get', url='https://example.com/groups', session=session)
+			assert not worked and response.status_code == 503
+			assert 2 <= len(session.calls) <= 5 and all(read <= 0.2 for connect, read in session.sent('timeout'))
+			time.sleep(0.2)
+			response, worked = tto.safe_request('get', url='https://example.com/groups', session=session)
+			assert response is None and not worked
+		assert time.monotonic() - start < 0.6
+		session.calls = []
+		response, worked = tto.safe_request('post', url='https://example.com/groups', session=session, data={})
+		assert response is None and not worked
+		self.assert_same(len(session.calls), 1, 'test_safe_request_deadline_read_timeout')
+
+	def test_safe_request_rate_limit_deadline(self):
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		lm.enable_rate_limit(reads_per_second=1, read_burst=1)
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession([requests.exceptions.ConnectionError('refused')])
+		with Deadline(0.3):
+			response, worked = tto.safe_request('get', url='https://example.com/groups', session=session)
+		assert response is None and not worked
+		self.assert_same(len(session.calls), 1, 'test_safe_request_rate_limit_deadline_calls')
+		assert all(connect > 0 and read > 0 for connect, read in session.sent('timeout'))
+		if httpx is None:
+			return
+		sent = []
+		def refuse(request):
+			sent.append(request)
+			raise httpx.ConnectError('refused', request=request)
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		lm.enable_rate_limit(reads_per_second=1, read_burst=1)
+		lm.async_client_kwargs = {'transport': httpx.MockTransport(refuse)}
+		tto = ConcreteThruTextObject(login_manager=lm)
+		async def run():
+			try:
+				with Deadline(0.3):
+					return await tto.async_safe_request('get', url='https://example.com/groups')
+			finally:
+				await lm.aclose()
+		self.assert_same(asyncio.run(run()), (None, False), 'test_safe_request_rate_limit_deadline_async')
+		self.assert_same(len(sent), 1, 'test_safe_request_rate_limit_deadline_async_calls')
+
+	def test_safe_request_single_flight(self):
+		lm = LoginManager(fake=True)
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession(respond=lambda method, **kwargs: FakeResponse(200, content=b'{"data": {"id": "5"}}'), delay=0.05)
+		url = 'https://api.relaytxt.io/v1/accounts/1/groups/5'
+		with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+			results = list(executor.map(lambda i: tto.safe_request('get', url=url, session=session, includes='campaigns'), range(6)))
+		self.assert_same(len(session.calls), 1, 'test_safe_request_single_flight_calls')
+		assert all(response is results[0][0] and worked for response, worked in results)
+		assert tto.response_json(results[0][0]) is tto.response_json(results[-1][0])
+		tto.safe_request('get', url=url, session=session, includes='surveys')
+		lm.single_flight = None
+		tto.safe_request('get', url=url, session=session, includes='campaigns')
+		self.assert_same(len(session.calls), 3, 'test_safe_request_single_flight_after')
+		lm.single_flight = SingleFlight()
+		session = FakeSession(respond=lambda method, **kwargs: FakeResponse(200), delay=0.5)
+		leader = threading.Thread(target=lambda: tto.safe_request('get', url=url, session=session))
+		leader.start()
+		time.sleep(0.05)
+		start = time.monotonic()
+		with Deadline(0.1):
+			self.assert_same(tto.safe_request('get', url=url, session=session), (None, False), 'test_safe_request_single_flight_deadline')
+		assert time.monotonic() - start < 0.3
+		leader.join()
+		self.assert_same(len(session.calls), 1, 'test_safe_request_single_flight_deadline_calls')
+
+	def test_safe_request_cache(self):
+		def respond(method, **kwargs):
+			if method == 'get' and kwargs['headers'].get('If-None-Match') == '"v1"':
+				return FakeResponse(304)
+			return FakeResponse(200, {'ETag': '"v1"'} if method == 'get' else {})
+		lm = LoginManager(fake=True)
+		cache = lm.enable_cache(ttl=60)
+		tto = ConcreteThruTextObject(login_manager=lm)
+		session = FakeSession(respond=respond)
+		url = 'https://api.relaytxt.io/v1/accounts/1/groups/5'
+		first, worked = tto.safe_request('get', url=url, session=session)
+		second, worked = tto.safe_request('get', url=url, session=session)
+		assert worked and second is first
+		self.assert_same(len(session.calls), 1, 'test_safe_request_cache_hit')
+		for cached in cache.entries.values():
+			cached.expires = 0
+		third, worked = tto.safe_request('get', url=url, session=session)
+		assert worked and third is first
+		self.assert_same(session.sent('headers')[-1].get('If-None-Match'), '"v1"', 'test_safe_request_cache_revalidate')
+		tto.safe_request('post', url=url + '/archive', session=session, data={})
+		tto.safe_request('get', url=url, session=session)
+		self.assert_same(len(session.calls), 4, 'test_safe_request_cache_invalidate')
+		self.assert_same(session.sent('headers')[-1].get('If-None-Match'), None, 'test_safe_request_cache_invalidate_headers')
+
+	def test_fetch_many(self):
+		def respond(method, url, params=None, **kwargs):
+			if url.endswith('/things'):
+				wanted = params['filter[id]'].split(',')
+				return FakeResponse(200, content={'data': [{'id': i, 'type': 'other' if i == '7' else 'thing'} for i in wanted if i not in ['2', '404']]})
+			thing_id = url.rsplit('/', 1)[1]
+			if thing_id == '404':
+				return FakeResponse(404, content={})
+			return FakeResponse(200, content={'data': {'id': thing_id, 'type': 'other' if thing_id == '7' else 'thing'}})
+		class Thing(ConcreteThruTextObject):
+			url_name = 'things'
+			thru_text_type = 'thing'
+			def from_dict(self, in_dict):
+				self.id = in_dict['id']
+				self.type = in_dict['type']
+		lm = LoginManager(fake=True)
+		session = FakeSession(respond=respond)
+		lm.session = session
+		lm.session_token = lm.token
+		for use_filter, num_requests in [(False, 4), (True, 4)]:
+			session.calls = []
+			results = Thing.fetch_many(['1', '2', 1, '404', '7', '2'], login_manager=lm, use_filter=use_filter, batch_size=2)
+			self.assert_same([r[0] for r in results], ['1', '2', 1, '404', '7', '2'], 'test_fetch_many_order')
+			self.assert_same([r[1].id if r[1] is not None else None for r in results], ['1', '2', '1', None, None, '2'], 'test_fetch_many_objects')
+			self.assert_same([r[2] is not None for r in results], [False, False, False, True, True, False], 'test_fetch_many_errors')
+			self.assert_same(len(session.calls), num_requests, 'test_fetch_many_requests')
+
+	def test_async_safe_request(self):
+		if httpx is None:
+			return
+		statuses = [503, 200, 200]
+		seen = []
+		def handler(request):
+			seen.append((request.method, str(request.url), request.headers['Authorization']))
+			return httpx.Response(statuses[len(seen) - 1], json={'data': []})
+		lm = LoginManager(fake=True)
+		lm.retry_policy.backoff_base = 0
+		lm.async_client_kwargs = {'transport': httpx.MockTransport(handler)}
+		tto = ConcreteThruTextObject(login_manager=lm)
+		async def run():
+			try:
+				first = await tto.async_safe_request('get', url='https://example.com/groups', includes=['a', 'b'])
+				second = await tto.async_safe_request('post', url='https://example.com/groups', data={})
+			finally:
+				await lm.aclose()
+			return first, second
+		(first_response, first_worked), (second_response, second_worked) = asyncio.run(run())
+		assert first_worked and second_worked
+		self.assert_same(seen[1], ('GET', 'https://example.com/groups?include=a%2Cb', 'Token token="fake"'), 'test_async_safe_request')
+		self.assert_same(len(seen), 3, 'test_async_safe_request_retried')
+
+	def test_async_make_new(self):
+		running = []
+		most = []
+		class Slow(ConcreteThruTextObject):
+			def make_new(self, name):
+				running.append(name)
+				most.append(len(running))
+				time.sleep(0.05)
+				running.remove(name)
+				return name
+		lm = LoginManager(fake=True)
+		lm.async_concurrency = 2
+		slow = Slow(login_manager=lm)
+		async def run():
+			try:
+				return await asyncio.gather(*[slow.async_make_new(name='group ' + str(i)) for i in range(6)])
+			finally:
+				await lm.aclose()
+		self.assert_same(asyncio.run(run()), ['group ' + str(i) for i in range(6)], 'test_async_make_new')
+		self.assert_same(max(most), 2, 'test_async_make_new_concurrency')
+
+	def test_iter_all(self):
+		def paging_session(num_items, style):
+			items = [{'id': i} for i in range(num_items)]
+			def respond(method, url, params=None, **kwargs):
+				params = params or {}
+				if style == 'links':
+					number = int(url.split('page=')[1]) if 'page=' in url else 1
+					size = 4
+				else:
+					number = int(params.get('page[number]', 1))
+					size = int(params.get('page[size]', len(items)))
+				if style == 'ignores_paging':
+					number = 1
+				links = {}
+				if style == 'links' and number * size < len(items):
+					links['next'] = '/v1/groups?page=' + str(number + 1)
+				return FakeResponse(200, content={'data': items[(number - 1) * size:number * size], 'links': links})
+			return FakeSession(respond=respond)
+		tto = ConcreteThruTextObject(login_manager=LoginManager(fake=True))
+		tto.url_name = 'groups'
+		for style, page_size, prefetch, num_items, num_requests in [('links', None, True, 10, 3), ('links', 4, False, 8, 2), ('numbers', 4, False, 10, 3), ('numbers', 5, True, 10, 3), ('ignores_paging', 4, False, 10, 2)]:
+			tto.session = paging_session(num_items, style)
+			found = list(tto.iter_all(page_size=page_size, prefetch=prefetch, filters={'status': 'active'}))
+			self.assert_same(len(found), 4 if style == 'ignores_paging' else num_items, 'test_iter_all_' + style)
+			self.assert_same(len(tto.session.calls), num_requests, 'test_iter_all_requests_' + style)
+		tto.session = paging_session(10, 'links')
+		self.assert_same(len(tto.list_all()), 10, 'test_iter_all_list_all')
+		self.assert_same(tto.session.sent('url')[1], urljoin(tto.base_url, '/v1/groups?page=2'), 'test_iter_all_next_link')
+
 	#TODO:
 	# safe request
 
+	def test_compress_body(self):
+		lm = LoginManager(fake=True)
+		lm.compression_threshold = 100
+		cro = ConcreteThruTextObject(login_manager=lm)
+		small = json.dumps({'data': 'small'})
+		big = json.dumps({'data': [['John', 'Doe', '555-555-1234']] * 100})
+		assert cro.compress_body(small, 'gzip') is None
+		self.assert_same(gzip.decompress(cro.compress_body(big, 'gzip')), big.encode('utf-8'), 'test_compress_body_gzip')
+		self.assert_same(zlib.decompress(cro.compress_body(big.encode('utf-8'), 'deflate')), big.encode('utf-8'), 'test_compress_body_deflate')
+		chunks = (big[i:i+64].encode('utf-8') for i in range(0, len(big), 64))
+		self.assert_same(gzip.decompress(b''.join(cro.compress_body(chunks, 'gzip'))), big.encode('utf-8'), 'test_compress_body_stream')
+
 	def datetime_list(self):
 		dt1 = datetime(year=1941, month=12, day=7, hour=8, minute=10)
 		dt2 = datetime(year=2001, month=9, day=11, hour=8, minute=46, microsecond=194)
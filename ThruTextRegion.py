@@ -20,14 +20,11 @@ class ThruTextRegion(ThruTextObject):
 		return True
 
 	def new_region_list(self, filename=None):
-		if self.login_manager.staging:
-			response, worked = self.safe_request('get', url='https://api.relaytxt-staging.io/v1/countries', headers={}, includes='regions')
-		else:
-			response, worked = self.safe_request('get', url='https://api.relaytxt.io/v1/countries', headers={}, includes='regions')
+		response, worked = self.safe_request('get', url=self.login_manager.api_url+'/countries', headers={}, includes='regions')
 		if not worked:
 			print("Error: failed to get the countries.")
 			return False
-		included_list = [{'id':n['id'], 'type':n['type'], 'name':n['attributes']['name']} for n in json.loads(response.content)['included']]
+		included_list = [{'id':n['id'], 'type':n['type'], 'name':n['attributes']['name']} for n in self.response_json(response)['included']]
 		if filename is None:
 			filename = os.path.join('config', self.default_filename)
 		with open(filename, 'w') as ofile:
@@ -87,7 +87,7 @@ class ThruTextSurvey(ThruTextObject):
 			return False
 
 		try:
-			self.from_dict(json.loads(response.content)['data'])
+			self.from_dict(self.response_json(response)['data'])
 		except json.JSONDecodeError:
 			print("Warning: got something weird back from attempt to make new survey. This survey may not be an accurate representation of what's in ThruText")
 		return True